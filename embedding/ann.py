@@ -0,0 +1,259 @@
+#built-in modules
+import json
+import os
+import time
+
+#third-party libraries
+import numpy as np
+
+#own libraries
+from embedding.search import METRICS, ExactIndex, finalize_top_k, merge_top_k, normalize
+
+
+def kmeans(vectors, n_clusters: int, n_iter: int=20, sample_size: int=None, metric: str="l2", seed: int=0) -> np.ndarray:
+    """
+    Lloyd's k-means on a random sample of the vectors.
+
+    Args:
+        vectors: A (n, d) array of vectors (NaN rows are ignored).
+        n_clusters (int): The number of centroids.
+        n_iter (int, optional): The number of assignment/update iterations. Defaults to 20.
+        sample_size (int, optional): The number of vectors used for training. Defaults to 256 per centroid.
+        metric (str, optional): 'l2', or 'cosine' for spherical k-means on unit vectors. Defaults to 'l2'.
+        seed (int, optional): The random seed. Defaults to 0.
+
+    Returns:
+        np.ndarray: The (n_clusters, d) float32 centroids.
+    """
+    rng = np.random.default_rng(seed)
+    sample_size = sample_size or 256 * n_clusters
+
+    valid = np.flatnonzero(~np.isnan(np.asarray(vectors[:, 0], dtype=np.float32)))
+    sample = np.sort(rng.choice(valid, size=min(sample_size, len(valid)), replace=False))
+    sample = np.asarray(vectors[sample], dtype=np.float32)
+    if metric == "cosine":
+        sample = normalize(sample)
+    if len(sample) < n_clusters:
+        raise ValueError(f"Cannot train {n_clusters} centroids on {len(sample)} vectors")
+
+    centroids = sample[rng.choice(len(sample), size=n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        _, assignment = ExactIndex(centroids, "l2" if metric != "cosine" else "cosine", normalized=True).search(sample, 1)
+        assignment = assignment[:, 0]
+
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        counts = np.bincount(assignment, minlength=n_clusters)
+
+        # reseed empty clusters with random training vectors
+        empty = counts == 0
+        sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()), replace=False)]
+        counts[empty] = 1
+
+        centroids = sums / counts[:, None]
+        if metric == "cosine":
+            centroids = normalize(centroids)
+
+    return centroids.astype(np.float32)
+
+
+class IVFIndex:
+    """
+    Inverted-file approximate nearest-neighbor index.
+
+    Vectors are assigned to their closest k-means centroid and stored contiguously per list. A query
+    only scans the nprobe lists whose centroids score best, trading recall for latency. Queries that
+    probe the same list are scored together with one matrix multiply.
+
+    Args:
+        centroids: The (n_lists, d) coarse centroids.
+        vectors: The (n, d) vectors ordered by list.
+        ids: The (n,) original row of each stored vector.
+        offsets: The (n_lists + 1,) start of each list in vectors.
+        metric (str, optional): 'cosine', 'dot' or 'l2'. Defaults to 'cosine'.
+        nprobe (int, optional): The default number of lists scanned per query. Defaults to 8.
+    """
+
+    def __init__(self, centroids, vectors, ids, offsets, metric: str="cosine", nprobe: int=8):
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric {metric!r}, expected one of {METRICS}")
+        self.centroids = centroids
+        self.vectors = vectors
+        self.ids = ids
+        self.offsets = offsets
+        self.metric = metric
+        self.nprobe = nprobe
+        self._centroid_index = ExactIndex(centroids, metric if metric == "cosine" else "l2", normalized=True)
+
+    @classmethod
+    def build(cls, vectors, n_lists: int=None, metric: str="cosine", nprobe: int=8, n_iter: int=20,
+              sample_size: int=None, block_size: int=65536, seed: int=0):
+        """
+        Trains the centroids and assigns every vector to its list.
+
+        Args:
+            vectors: A (n, d) array, e.g. np.asarray of the embeddings from populate_openai_embeddings or
+                generate_huggingface_embeddings, or a memory-mapped matrix from embedding.storage.load_vectors.
+                NaN rows (failed embeddings) are left out of the index.
+            n_lists (int, optional): The number of inverted lists. Defaults to 4 * sqrt(n).
+            metric (str, optional): 'cosine', 'dot' or 'l2'. Defaults to 'cosine'.
+            nprobe (int, optional): The default number of lists scanned per query. Defaults to 8.
+            n_iter (int, optional): The number of k-means iterations. Defaults to 20.
+            sample_size (int, optional): The number of vectors used to train k-means. Defaults to 256 per list.
+            block_size (int, optional): The number of vectors assigned at a time. Defaults to 65536.
+            seed (int, optional): The random seed. Defaults to 0.
+
+        Returns:
+            IVFIndex: The built index.
+        """
+        vectors = vectors if isinstance(vectors, np.ndarray) else np.asarray(vectors, dtype=np.float32)
+        n_lists = n_lists or max(1, int(4 * np.sqrt(len(vectors))))
+        centroids = kmeans(vectors, n_lists, n_iter, sample_size, "cosine" if metric == "cosine" else "l2", seed)
+        centroid_index = ExactIndex(centroids, metric if metric == "cosine" else "l2", normalized=True)
+
+        # assign in blocks so a memory-mapped corpus is never loaded at once
+        assignments = []
+        for block_start in range(0, len(vectors), block_size):
+            block = np.asarray(vectors[block_start:block_start + block_size], dtype=np.float32)
+            scores, assignment = centroid_index.search(block, 1)
+            assignments.append(np.where(np.isnan(block[:, 0]), -1, assignment[:, 0]))
+        assignment = np.concatenate(assignments) if assignments else np.zeros(0, dtype=np.int64)
+
+        ids = np.flatnonzero(assignment >= 0)
+        ids = ids[np.argsort(assignment[ids], kind="stable")]
+        offsets = np.searchsorted(assignment[ids], np.arange(n_lists + 1))
+
+        stored = np.empty((len(ids), vectors.shape[1]), dtype=np.float32)
+        for block_start in range(0, len(ids), block_size):
+            block_ids = ids[block_start:block_start + block_size]
+            stored[block_start:block_start + len(block_ids)] = vectors[np.sort(block_ids)][np.argsort(np.argsort(block_ids))]
+        if metric == "cosine":
+            stored = normalize(stored)
+
+        return cls(centroids, stored, ids, offsets, metric, nprobe)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, queries, k: int=10, nprobe: int=None):
+        """
+        Returns the approximate k best matches of each query.
+
+        Args:
+            queries: A (q, d) array-like of query vectors, or a single (d,) vector.
+            k (int, optional): The number of neighbors returned per query. Defaults to 10.
+            nprobe (int, optional): The number of lists scanned per query. Defaults to self.nprobe.
+
+        Returns:
+            tuple: (scores, indices), two (q, k) arrays sorted best first, with indices into the
+            original vectors and the same score convention as embedding.search.ExactIndex.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if self.metric == "cosine":
+            queries = normalize(queries)
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+
+        _, probes = self._centroid_index.search(queries, nprobe)
+
+        best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        best_indices = np.full((len(queries), k), -1, dtype=np.int64)
+
+        # score every query that probes a list at once
+        query_rows, probe_columns = np.nonzero(probes >= 0)
+        lists = probes[query_rows, probe_columns]
+        order = np.argsort(lists, kind="stable")
+        query_rows, lists = query_rows[order], lists[order]
+        boundaries = np.flatnonzero(np.diff(lists)) + 1
+        for rows, list_ids in zip(np.split(query_rows, boundaries), np.split(lists, boundaries)):
+            if not len(rows):
+                continue
+            list_id = list_ids[0]
+            start, end = self.offsets[list_id], self.offsets[list_id + 1]
+            if start == end:
+                continue
+            block = np.asarray(self.vectors[start:end], dtype=np.float32)
+            scores = queries[rows] @ block.T
+            if self.metric == "l2":
+                scores = -(np.einsum("ij,ij->i", queries[rows], queries[rows])[:, None] - 2 * scores
+                           + np.einsum("ij,ij->i", block, block)[None, :])
+            candidates = np.broadcast_to(np.arange(start, end), scores.shape)
+            if scores.shape[1] > k:
+                candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, candidates, axis=1)
+                candidates = candidates + start
+            best_scores[rows], best_indices[rows] = merge_top_k(best_scores[rows], best_indices[rows],
+                                                                scores, candidates, k)
+
+        best_scores, best_indices = finalize_top_k(best_scores, best_indices, k, self.metric)
+        return best_scores, np.where(best_indices >= 0, self.ids[np.maximum(best_indices, 0)], -1)
+
+    def save(self, directory: str):
+        """
+        Saves the index as .npy files plus a JSON manifest in directory.
+        """
+        os.makedirs(directory, exist_ok=True)
+        for name in ("centroids", "vectors", "ids", "offsets"):
+            np.save(os.path.join(directory, name + ".npy"), getattr(self, name))
+        with open(os.path.join(directory, "index.json"), "w", encoding="utf-8") as f:
+            json.dump({"type": "ivf", "metric": self.metric, "nprobe": self.nprobe}, f)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool=True):
+        """
+        Loads an index saved with save, memory-mapping the stored vectors by default.
+        """
+        with open(os.path.join(directory, "index.json"), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        arrays = {name: np.load(os.path.join(directory, name + ".npy"), mmap_mode="r" if mmap and name == "vectors" else None)
+                  for name in ("centroids", "vectors", "ids", "offsets")}
+        return cls(metric=manifest["metric"], nprobe=manifest["nprobe"], **arrays)
+
+
+def recall_at_k(approximate_indices, exact_indices) -> float:
+    """
+    Returns the fraction of the exact top-k neighbors found by an approximate search.
+
+    Args:
+        approximate_indices: The (q, k) indices returned by the approximate index.
+        exact_indices: The (q, k) indices returned by an exhaustive search.
+
+    Returns:
+        float: The mean recall@k over the queries.
+    """
+    hits = 0
+    total = 0
+    for approximate, exact in zip(approximate_indices, exact_indices):
+        exact = exact[exact >= 0]
+        hits += len(np.intersect1d(approximate, exact))
+        total += len(exact)
+    return hits / total if total else 1.0
+
+
+def evaluate_recall(index, vectors, queries, k: int=10, nprobes=(1, 2, 4, 8, 16, 32)) -> list:
+    """
+    Measures recall@k and latency of an approximate index against brute force for several nprobe values.
+
+    Args:
+        index (IVFIndex): The approximate index.
+        vectors: The (n, d) vectors the index was built from.
+        queries: A (q, d) array of query vectors.
+        k (int, optional): The number of neighbors. Defaults to 10.
+        nprobes (optional): The nprobe values to evaluate. Defaults to (1, 2, 4, 8, 16, 32).
+
+    Returns:
+        list[dict]: One dictionary per setting with nprobe, recall and milliseconds per query,
+        preceded by the brute force baseline.
+    """
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+
+    start = time.perf_counter()
+    _, exact_indices = ExactIndex(vectors, index.metric).search(queries, k)
+    results = [{"nprobe": None, "recall": 1.0, "ms_per_query": 1000 * (time.perf_counter() - start) / len(queries)}]
+
+    for nprobe in nprobes:
+        start = time.perf_counter()
+        _, indices = index.search(queries, k, nprobe)
+        elapsed = time.perf_counter() - start
+        results.append({"nprobe": nprobe, "recall": recall_at_k(indices, exact_indices),
+                        "ms_per_query": 1000 * elapsed / len(queries)})
+    return results
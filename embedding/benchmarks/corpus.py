@@ -0,0 +1,57 @@
+#third-party libraries
+import numpy as np
+
+
+_VOCABULARY = (
+    "la corte constitucional sala plena magistrado ponente sentencia tutela demanda accionante accionado "
+    "derecho fundamental debido proceso igualdad dignidad humana salud educación trabajo pensión "
+    "artículo ley decreto constitución política jurisprudencia precedente ratio decidendi obiter dicta "
+    "exequible inexequible condicionalmente procedencia subsidiariedad inmediatez perjuicio irremediable "
+    "ministerio público procuraduría defensoría entidad promotora eps colpensiones juzgado tribunal "
+    "primera segunda instancia revisión fallo amparo vulneración protección garantía principio "
+    "de del los las el en por para con sin sobre entre que como cuando donde se su sus al una un"
+).split()
+
+_BOILERPLATE = [
+    "En mérito de lo expuesto, la Sala Plena de la Corte Constitucional, administrando justicia en nombre "
+    "del pueblo y por mandato de la Constitución, RESUELVE:",
+    "Notifíquese, comuníquese, publíquese en la Gaceta de la Corte Constitucional y cúmplase.",
+    "Por Secretaría General, líbrense las comunicaciones de que trata el artículo 36 del Decreto 2591 de 1991.",
+    "La Sala de Revisión es competente para revisar el fallo de tutela proferido dentro del proceso de la referencia.",
+]
+
+
+def iter_synthetic_corpus(n_records: int, mean_words: int=250, sigma: float=1.0, boilerplate_rate: float=0.2,
+                          seed: int=0):
+    """
+    Generates records shaped like the chunked court rulings, with a length-skewed distribution and repeated boilerplate.
+
+    Args:
+        n_records (int): The number of records.
+        mean_words (int, optional): The median number of words per record. Defaults to 250.
+        sigma (float, optional): The spread of the log-normal length distribution; larger values give
+            more very long records. Defaults to 1.0.
+        boilerplate_rate (float, optional): The fraction of records that are standard paragraphs. Defaults to 0.2.
+        seed (int, optional): The random seed. Defaults to 0.
+
+    Yields:
+        dict: Records with 'id', 'year' and 'text'.
+    """
+    rng = np.random.default_rng(seed)
+    for i in range(n_records):
+        if rng.random() < boilerplate_rate:
+            text = _BOILERPLATE[rng.integers(len(_BOILERPLATE))]
+        else:
+            n_words = max(5, int(rng.lognormal(np.log(mean_words), sigma)))
+            words = rng.choice(_VOCABULARY, size=n_words)
+            # end a sentence every 20 words or so
+            sentences = [" ".join(words[j:j + 20]).capitalize() + "." for j in range(0, n_words, 20)]
+            text = " ".join(sentences)
+        yield {"id": f"T-{i:07d}", "year": 2023, "text": text}
+
+
+def synthetic_corpus(n_records: int, **kwargs) -> list[dict]:
+    """
+    Returns iter_synthetic_corpus as a list.
+    """
+    return list(iter_synthetic_corpus(n_records, **kwargs))
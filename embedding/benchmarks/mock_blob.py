@@ -0,0 +1,216 @@
+#built-in modules
+import base64
+import email.utils
+import hashlib
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.etree import ElementTree
+
+
+ACCOUNT_NAME = "devstoreaccount1"
+# The well-known development storage key; the emulator does not check signatures
+ACCOUNT_KEY = "Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw=="
+
+_RANGE = re.compile(r"bytes=(\d+)-(\d*)")
+
+
+class MockBlobServer:
+    """
+    In-memory stand-in for Azure Blob Storage, enough for the block blob operations the pipeline uses.
+
+    Supports container creation, Put Blob, Put Block / Put Block List, ranged Get Blob (with If-Match)
+    and Get Blob Properties, so BlobServiceClient works against it unchanged. Connect with
+    account_url=server.account_url and credential=server.credential.
+
+    Args:
+        latency (float, optional): Seconds added to every request. Defaults to 0.
+        bandwidth (float, optional): Bytes per second of each transfer, or None for unlimited. Defaults to None.
+        host (str, optional): The interface to listen on. Defaults to '127.0.0.1'.
+        port (int, optional): The port to listen on, 0 for any free port. Defaults to 0.
+    """
+
+    def __init__(self, latency: float=0.0, bandwidth: float=None, host: str='127.0.0.1', port: int=0):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.containers = {}
+        self.requests = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._staged = {}
+        self._lock = threading.Lock()
+
+        self._server = ThreadingHTTPServer((host, port), _handler(self))
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def account_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/{ACCOUNT_NAME}"
+
+    @property
+    def credential(self) -> dict:
+        return {"account_name": ACCOUNT_NAME, "account_key": ACCOUNT_KEY}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def put(self, container_name: str, blob_name: str, data: bytes):
+        """
+        Stores a blob directly, e.g. to seed a benchmark corpus.
+        """
+        with self._lock:
+            self.containers.setdefault(container_name, {})[blob_name] = _blob(data, hashlib.md5(data).digest())
+
+    def get(self, container_name: str, blob_name: str) -> bytes:
+        return self.containers[container_name][blob_name]["data"]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"requests": self.requests, "bytes_in": self.bytes_in, "bytes_out": self.bytes_out}
+
+    def _throttle(self, size):
+        time.sleep(self.latency + (size / self.bandwidth if self.bandwidth else 0))
+
+
+def _blob(data, content_md5):
+    return {"data": data, "etag": f'"0x{uuid.uuid4().hex[:15].upper()}"', "content_md5": content_md5,
+            "last_modified": email.utils.formatdate(usegmt=True)}
+
+
+def _handler(server):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _route(self):
+            url = urllib.parse.urlsplit(self.path)
+            query = dict(urllib.parse.parse_qsl(url.query))
+            parts = urllib.parse.unquote(url.path).lstrip("/").split("/", 2)
+            # /<account>/<container>/<blob name with slashes>
+            container_name = parts[1] if len(parts) > 1 else None
+            blob_name = parts[2] if len(parts) > 2 else None
+            with server._lock:
+                server.requests += 1
+            return container_name, blob_name, query
+
+        def do_PUT(self):
+            container_name, blob_name, query = self._route()
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            with server._lock:
+                server.bytes_in += len(body)
+            server._throttle(len(body))
+
+            if blob_name is None:
+                with server._lock:
+                    server.containers.setdefault(container_name, {})
+                return self._send(201)
+            if container_name not in server.containers:
+                return self._error(404, "ContainerNotFound")
+
+            comp = query.get("comp")
+            if comp == "block":
+                with server._lock:
+                    server._staged.setdefault((container_name, blob_name), {})[query["blockid"]] = body
+                return self._send(201)
+
+            if comp == "blocklist":
+                ids = [element.text for element in ElementTree.fromstring(body)]
+                with server._lock:
+                    staged = server._staged.pop((container_name, blob_name), {})
+                    if any(block_id not in staged for block_id in ids):
+                        return self._error(400, "InvalidBlockList")
+                    data = b"".join(staged[block_id] for block_id in ids)
+                    content_md5 = self.headers.get("x-ms-blob-content-md5")
+                    blob = _blob(data, base64.b64decode(content_md5) if content_md5 else None)
+                    server.containers[container_name][blob_name] = blob
+                return self._send(201, headers=self._version_headers(blob))
+
+            # Put Blob: the service computes the MD5 of single-shot uploads
+            with server._lock:
+                blob = server.containers[container_name][blob_name] = _blob(body, hashlib.md5(body).digest())
+            return self._send(201, headers=self._version_headers(blob))
+
+        def do_HEAD(self):
+            blob = self._find_blob()
+            if blob is None:
+                return self._send(404, headers={"x-ms-error-code": "BlobNotFound"})
+            self._send(200, headers={**self._properties(blob), "Content-Length": str(len(blob["data"]))}, length=False)
+
+        def do_GET(self):
+            blob = self._find_blob()
+            if blob is None:
+                return self._error(404, "BlobNotFound")
+            if_match = self.headers.get("If-Match")
+            if if_match and if_match not in ("*", blob["etag"]):
+                return self._error(412, "ConditionNotMet")
+
+            data = blob["data"]
+            match = _RANGE.match(self.headers.get("x-ms-range") or self.headers.get("Range") or "")
+            if match is None or not data:
+                body, status, headers = data, 200, {}
+            else:
+                start = int(match.group(1))
+                end = min(int(match.group(2)) if match.group(2) else len(data) - 1, len(data) - 1)
+                if start >= len(data):
+                    return self._error(416, "InvalidRange")
+                body, status = data[start:end + 1], 206
+                headers = {"Content-Range": f"bytes {start}-{end}/{len(data)}"}
+
+            with server._lock:
+                server.bytes_out += len(body)
+            server._throttle(len(body))
+            self._send(status, body, {**self._properties(blob), **headers})
+
+        def _find_blob(self):
+            container_name, blob_name, _ = self._route()
+            with server._lock:
+                return server.containers.get(container_name, {}).get(blob_name)
+
+        def _properties(self, blob):
+            headers = {**self._version_headers(blob), "x-ms-blob-type": "BlockBlob",
+                       "Content-Type": "application/octet-stream", "Accept-Ranges": "bytes"}
+            if blob["content_md5"]:
+                headers["Content-MD5"] = base64.b64encode(blob["content_md5"]).decode()
+            return headers
+
+        @staticmethod
+        def _version_headers(blob):
+            return {"ETag": blob["etag"], "Last-Modified": blob["last_modified"]}
+
+        def _error(self, status, code):
+            body = f'<?xml version="1.0" encoding="utf-8"?><Error><Code>{code}</Code><Message>{code}</Message></Error>'.encode()
+            self._send(status, body, {"x-ms-error-code": code, "Content-Type": "application/xml"})
+
+        def _send(self, status, body=b"", headers=None, length=True):
+            self.send_response(status)
+            self.send_header("x-ms-request-id", str(uuid.uuid4()))
+            self.send_header("x-ms-version", "2025-01-05")
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            if length:
+                self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if body and self.command != "HEAD":
+                self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
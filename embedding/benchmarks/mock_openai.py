@@ -0,0 +1,169 @@
+#built-in modules
+import base64
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+#third-party libraries
+import numpy as np
+
+
+class MockOpenAIServer:
+    """
+    Local stand-in for the OpenAI embeddings endpoint, for benchmarks that must not spend money.
+
+    Answers POST /v1/embeddings with deterministic unit vectors (the same text always gets the same
+    vector), after a configurable latency. It can enforce a requests-per-minute limit with 429
+    responses carrying retry-after headers and fail a fraction of requests with 500s, so the client's
+    retry behavior is exercised too. Point the OpenAI clients at it with OPENAI_BASE_URL=server.base_url.
+
+    Args:
+        latency (float, optional): Seconds spent on each request. Defaults to 0.05.
+        jitter (float, optional): Extra uniformly random seconds per request. Defaults to 0.02.
+        seconds_per_token (float, optional): Extra seconds per input token, like a real model. Defaults to 0.
+        requests_per_minute (int, optional): The rate limit, or None for no limit. Defaults to None.
+        error_rate (float, optional): The fraction of requests that fail with a 500. Defaults to 0.
+        dimensions (int, optional): The size of the returned vectors when the request does not set one. Defaults to 1536.
+        host (str, optional): The interface to listen on. Defaults to '127.0.0.1'.
+        port (int, optional): The port to listen on, 0 for any free port. Defaults to 0.
+        seed (int, optional): The seed of the simulated errors and jitter. Defaults to 0.
+    """
+
+    def __init__(self, latency: float=0.05, jitter: float=0.02, seconds_per_token: float=0.0,
+                 requests_per_minute: int=None, error_rate: float=0.0, dimensions: int=1536,
+                 host: str='127.0.0.1', port: int=0, seed: int=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.seconds_per_token = seconds_per_token
+        self.requests_per_minute = requests_per_minute
+        self.error_rate = error_rate
+        self.dimensions = dimensions
+        self.requests = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.inputs = 0
+        self.tokens = 0
+        self.latencies = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._window = []
+
+        self._server = ThreadingHTTPServer((host, port), _handler(self))
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def stats(self) -> dict:
+        """
+        Returns the number of requests, inputs and tokens served, and of rate-limited and failed requests.
+        """
+        with self._lock:
+            return {"requests": self.requests, "inputs": self.inputs, "tokens": self.tokens,
+                    "rate_limited": self.rate_limited, "errors": self.errors}
+
+    def embed(self, texts: list[str], dimensions: int=None) -> np.ndarray:
+        """
+        Returns the deterministic unit vectors served for texts.
+        """
+        vectors = np.empty((len(texts), dimensions or self.dimensions), dtype=np.float32)
+        for i, text in enumerate(texts):
+            seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+            vectors[i] = np.random.default_rng(seed).standard_normal(vectors.shape[1])
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    def _admit(self):
+        # returns None, or the seconds to wait before retrying
+        now = time.monotonic()
+        with self._lock:
+            self.requests += 1
+            if self.requests_per_minute:
+                self._window = [t for t in self._window if now - t < 60]
+                if len(self._window) >= self.requests_per_minute:
+                    self.rate_limited += 1
+                    return 60 - (now - self._window[0])
+                self._window.append(now)
+            if self._random.random() < self.error_rate:
+                self.errors += 1
+                return -1
+            return None
+
+    def _respond(self, body):
+        texts = body["input"]
+        texts = [texts] if isinstance(texts, str) else texts
+        # approximate tokens as whitespace-separated words
+        n_tokens = sum(len(text.split()) for text in texts)
+        with self._lock:
+            self.inputs += len(texts)
+            self.tokens += n_tokens
+            delay = self.latency + self._random.random() * self.jitter + n_tokens * self.seconds_per_token
+        time.sleep(delay)
+
+        vectors = self.embed(texts, body.get("dimensions"))
+        encode = ((lambda vector: base64.b64encode(vector.astype("<f4").tobytes()).decode())
+                  if body.get("encoding_format") == "base64" else (lambda vector: vector.tolist()))
+        return {
+            "object": "list",
+            "model": body.get("model"),
+            "data": [{"object": "embedding", "index": i, "embedding": encode(vector)} for i, vector in enumerate(vectors)],
+            "usage": {"prompt_tokens": n_tokens, "total_tokens": n_tokens},
+        }
+
+
+def _handler(server):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            start = time.perf_counter()
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not self.path.rstrip("/").endswith("/embeddings"):
+                return self._send(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+
+            wait = server._admit()
+            if wait is not None and wait >= 0:
+                return self._send(429, {"error": {"message": "Rate limit reached", "type": "requests"}},
+                                  {"retry-after-ms": str(int(wait * 1000)), "retry-after": str(int(wait) + 1)})
+            if wait is not None:
+                return self._send(500, {"error": {"message": "Simulated server error", "type": "server_error"}})
+
+            self._send(200, server._respond(body))
+            with server._lock:
+                server.latencies.append(time.perf_counter() - start)
+
+        def _send(self, status, payload, headers=None):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
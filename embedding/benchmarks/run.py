@@ -0,0 +1,262 @@
+#built-in modules
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import threading
+import time
+
+#third-party libraries
+import numpy as np
+
+#own libraries
+from embedding.benchmarks.corpus import synthetic_corpus
+from embedding.benchmarks.mock_blob import MockBlobServer
+from embedding.benchmarks.mock_openai import MockOpenAIServer
+from embedding.blob_transfer import iter_json_array_bytes, upload_blob_blocks
+from embedding.clients import get_blob_service_client
+from embedding.embedding import (download_blob_content, generate_huggingface_embeddings, parse_blob_content_to_json,
+                                 populate_openai_embeddings, upload_blob_content)
+from embedding.openai_functions import count_tokens_list
+from embedding.streaming import iter_blob_records
+
+
+CONTAINER_NAME = "benchmark"
+
+
+def run_benchmarks(n_records: int=2000, output: str='benchmark_results.json', model_name: str='text-embedding-3-small',
+                   dimensions: int=None, batch_size: int=200, max_in_flight: int=8, latency: float=0.05,
+                   jitter: float=0.02, requests_per_minute: int=None, error_rate: float=0.0,
+                   blob_latency: float=0.0, hf_model: str=None, hf_batch_size: int=64, seed: int=0) -> dict:
+    """
+    Runs the pipeline end to end against local stand-ins for OpenAI and Azure Blob Storage and saves the measurements.
+
+    Every stage reports its wall time, records/s, tokens/s, bytes and peak resident memory; the
+    embedding stages also report p50/p95/p99 batch latency. Nothing is sent to OpenAI or Azure.
+
+    Args:
+        n_records (int, optional): The size of the synthetic corpus. Defaults to 2000.
+        output (str, optional): The JSON file the results are written to. Defaults to 'benchmark_results.json'.
+        model_name (str, optional): The OpenAI model name sent to the mock server (its tokenizer counts tokens). Defaults to 'text-embedding-3-small'.
+        dimensions (int, optional): The dimensions requested from the mock server. Defaults to the model's full size.
+        batch_size (int, optional): The batch_size of populate_openai_embeddings. Defaults to 200.
+        max_in_flight (int, optional): The max_in_flight of populate_openai_embeddings. Defaults to 8.
+        latency (float, optional): Seconds per request of the mock OpenAI server. Defaults to 0.05.
+        jitter (float, optional): Extra random seconds per request of the mock OpenAI server. Defaults to 0.02.
+        requests_per_minute (int, optional): The rate limit of the mock OpenAI server. Defaults to None.
+        error_rate (float, optional): The fraction of failed requests of the mock OpenAI server. Defaults to 0.
+        blob_latency (float, optional): Seconds per request of the mock blob server. Defaults to 0.
+        hf_model (str, optional): A Hugging Face model to benchmark as well, if it is available locally. Defaults to None.
+        hf_batch_size (int, optional): The batch_size of generate_huggingface_embeddings. Defaults to 64.
+        seed (int, optional): The seed of the corpus and of the simulated errors. Defaults to 0.
+
+    Returns:
+        dict: The results, as written to output.
+    """
+    corpus = synthetic_corpus(n_records, seed=seed)
+    n_tokens = count_tokens_list([record["text"] for record in corpus], model_name)
+    stages = {}
+
+    with MockBlobServer(latency=blob_latency) as blob_server, \
+            MockOpenAIServer(latency=latency, jitter=jitter, requests_per_minute=requests_per_minute,
+                             error_rate=error_rate, dimensions=dimensions or 1536, seed=seed) as openai_server:
+        account_url, credential = blob_server.account_url, blob_server.credential
+        get_blob_service_client(account_url, credential).create_container(CONTAINER_NAME)
+
+        data = stages_run(stages, "serialize", n_records, n_tokens,
+                          lambda: b"".join(iter_json_array_bytes(corpus)))
+        stages["serialize"]["bytes"] = len(data)
+
+        stages_run(stages, "upload", n_records, n_tokens,
+                   lambda: upload_blob_content(data, account_url, CONTAINER_NAME, "corpus.json", credential))
+        stages_run(stages, "upload_blocks", n_records, n_tokens,
+                   lambda: upload_blob_blocks(iter_json_array_bytes(corpus), account_url, CONTAINER_NAME,
+                                              "corpus_blocks.json", credential=credential))
+        content = stages_run(stages, "download", n_records, n_tokens,
+                             lambda: download_blob_content(account_url, CONTAINER_NAME, "corpus.json", credential=credential))
+        stages_run(stages, "parse", n_records, n_tokens, lambda: parse_blob_content_to_json(content))
+        records = stages_run(stages, "download_and_parse_streaming", n_records, n_tokens,
+                             lambda: list(iter_blob_records(account_url, CONTAINER_NAME, "corpus.json",
+                                                            credential=credential)))
+        for name in ("upload", "upload_blocks", "download", "parse", "download_and_parse_streaming"):
+            stages[name]["bytes"] = len(data)
+
+        # the OpenAI clients read OPENAI_BASE_URL when they are created
+        environment = {"OPENAI_BASE_URL": openai_server.base_url,
+                       "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "benchmark")}
+        saved_environment = {name: os.environ.get(name) for name in environment}
+        os.environ.update(environment)
+        try:
+            first_latency = len(openai_server.latencies)
+            embedded = stages_run(stages, "embed_openai", n_records, n_tokens,
+                                  lambda: populate_openai_embeddings(records, model_name, batch_size=batch_size,
+                                                                     max_in_flight=max_in_flight, dimensions=dimensions))
+            stages["embed_openai"].update(latency_percentiles(openai_server.latencies[first_latency:]))
+            stages["embed_openai"]["server"] = openai_server.stats()
+            stages["embed_openai"]["failed"] = sum(1 for record in embedded if record.get("embedding") is None)
+        finally:
+            for name, value in saved_environment.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+        stages_run(stages, "upload_embeddings", n_records, n_tokens,
+                   lambda: upload_blob_blocks(iter_json_array_bytes(embedded), account_url, CONTAINER_NAME,
+                                              "embeddings.json", credential=credential))
+        stages["upload_embeddings"]["bytes"] = len(blob_server.get(CONTAINER_NAME, "embeddings.json"))
+
+        if hf_model:
+            stages.update(benchmark_huggingface(corpus, hf_model, hf_batch_size))
+
+    results = {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "machine": {"platform": platform.platform(), "cpus": os.cpu_count()},
+        "config": {"n_records": n_records, "tokens": n_tokens, "model_name": model_name, "dimensions": dimensions,
+                   "batch_size": batch_size, "max_in_flight": max_in_flight, "latency": latency, "jitter": jitter,
+                   "requests_per_minute": requests_per_minute, "error_rate": error_rate,
+                   "blob_latency": blob_latency, "hf_model": hf_model, "seed": seed},
+        "stages": stages,
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    return results
+
+
+def benchmark_huggingface(corpus: list[dict], model_name: str, batch_size: int=64) -> dict:
+    """
+    Measures generate_huggingface_embeddings on the corpus, timing each model.encode call.
+
+    Returns:
+        dict: {'embed_huggingface': stage results}.
+    """
+    from embedding.models import count_model_tokens, get_sentence_transformer
+
+    model = get_sentence_transformer(model_name)
+    timed_model = _TimedModel(model)
+    n_tokens = int(count_model_tokens(model.tokenizer, [record["text"] for record in corpus], model.max_seq_length).sum())
+
+    stages = {}
+    stages_run(stages, "embed_huggingface", len(corpus), n_tokens,
+               lambda: generate_huggingface_embeddings([dict(record) for record in corpus], model_name,
+                                                       batch_size=batch_size, model=timed_model))
+    stages["embed_huggingface"].update(latency_percentiles(timed_model.latencies))
+    return stages
+
+
+def stages_run(stages: dict, name: str, n_records: int, n_tokens: int, fn):
+    """
+    Runs one stage, records its measurements in stages[name] and returns what fn returned.
+    """
+    sampler = _PeakRSS().start()
+    start = time.perf_counter()
+    try:
+        result = fn()
+    finally:
+        seconds = time.perf_counter() - start
+        peak_rss = sampler.stop()
+    stages[name] = {"seconds": seconds, "records": n_records, "tokens": n_tokens,
+                    "records_per_second": n_records / seconds if seconds else None,
+                    "tokens_per_second": n_tokens / seconds if seconds else None,
+                    "peak_rss_mb": peak_rss / 2 ** 20}
+    print(f"{name}: {seconds:.3f}s, {stages[name]['records_per_second']:.0f} records/s, "
+          f"peak RSS {stages[name]['peak_rss_mb']:.0f} MB")
+    return result
+
+
+def latency_percentiles(latencies) -> dict:
+    """
+    Returns the number of batches and the p50/p95/p99 latency in milliseconds.
+    """
+    if not len(latencies):
+        return {"batches": 0, "p50_ms": None, "p95_ms": None, "p99_ms": None}
+    p50, p95, p99 = np.percentile(np.asarray(latencies) * 1000, [50, 95, 99])
+    return {"batches": len(latencies), "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99)}
+
+
+class _TimedModel:
+    # forwards everything to the model and records how long each encode call takes
+
+    def __init__(self, model):
+        self._model = model
+        self.latencies = []
+
+    def encode(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._model.encode(*args, **kwargs)
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+
+class _PeakRSS:
+    # samples the resident memory of the process in a background thread
+
+    def __init__(self, interval: float=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.peak = _current_rss()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return max(self.peak, _current_rss())
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _current_rss())
+
+
+def _current_rss():
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # the lifetime peak is the best available without /proc (ru_maxrss is in bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if platform.system() == "Darwin" else peak * 1024
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark of the embedding pipeline.")
+    parser.add_argument("--records", type=int, default=2000)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--model", default="text-embedding-3-small")
+    parser.add_argument("--dimensions", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--max-in-flight", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--requests-per-minute", type=int, default=None)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--blob-latency", type=float, default=0.0)
+    parser.add_argument("--hf-model", default=None)
+    parser.add_argument("--hf-batch-size", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    run_benchmarks(args.records, args.output, args.model, args.dimensions, args.batch_size, args.max_in_flight,
+                   args.latency, args.jitter, args.requests_per_minute, args.error_rate, args.blob_latency,
+                   args.hf_model, args.hf_batch_size, args.seed)
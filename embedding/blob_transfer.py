@@ -0,0 +1,272 @@
+#built-in modules
+import base64
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+
+#third-party libraries
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.blob import BlobBlock, ContentSettings, StandardBlobTier
+
+#own libraries
+from embedding.clients import get_blob_service_client
+from embedding.metrics import get_metrics
+from embedding.streaming import iter_file_chunks
+
+
+DEFAULT_BLOCK_SIZE = 8 * 1024 * 1024
+DEFAULT_CACHE_DIR = "blob_cache"
+
+# Skipped transfers are logged at INFO and failed ones at ERROR, in the same stream as the pipeline
+logger = logging.getLogger(__name__)
+
+
+def iter_blocks(chunks, block_size: int=DEFAULT_BLOCK_SIZE):
+    """
+    Regroups a stream of str or bytes chunks into blocks of block_size bytes (the last one may be smaller).
+
+    Args:
+        chunks: An iterable of str (encoded as UTF-8) or bytes.
+        block_size (int, optional): The size in bytes of each block. Defaults to 8 MiB.
+
+    Yields:
+        bytes: Consecutive blocks.
+    """
+    block = bytearray()
+    for chunk in chunks:
+        block += chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+        while len(block) >= block_size:
+            yield bytes(block[:block_size])
+            del block[:block_size]
+    if block:
+        yield bytes(block)
+
+
+def iter_json_array_bytes(records):
+    """
+    Serializes records as a JSON array, one record at a time, so the output is never built as one string.
+
+    Args:
+        records: An iterable of JSON-serializable records.
+
+    Yields:
+        bytes: Consecutive pieces of the UTF-8 encoded JSON array.
+    """
+    yield b"["
+    for i, record in enumerate(records):
+        yield (b"," if i else b"") + json.dumps(record).encode("utf-8")
+    yield b"]"
+
+
+def iter_json_lines_bytes(records):
+    """
+    Serializes records as JSON Lines, one record at a time.
+
+    Args:
+        records: An iterable of JSON-serializable records.
+
+    Yields:
+        bytes: One UTF-8 encoded line per record.
+    """
+    for record in records:
+        yield json.dumps(record).encode("utf-8") + b"\n"
+
+
+def upload_blob_blocks(chunks, account_url: str, container_name: str, blob_name: str,
+                       block_size: int=DEFAULT_BLOCK_SIZE, max_concurrency: int=4,
+                       standard_blob_tier=None, credential=None):
+    """
+    Uploads a stream of data to Azure Blob Storage as blocks staged in parallel, then commits the block list.
+
+    At most max_concurrency blocks are held in memory and uploaded at the same time, so the content
+    is never built as one object and upload time scales with the available bandwidth.
+
+    Args:
+        chunks: An iterable of str or bytes, e.g. iter_json_array_bytes(records) or iter_file_chunks(path).
+        account_url (str): The URL of the Azure storage account (or of a local emulator such as Azurite).
+        container_name (str): The name of the container where the blob is written.
+        blob_name (str): The name of the blob to write (overwritten if it exists).
+        block_size (int, optional): The size in bytes of each staged block. Defaults to 8 MiB.
+        max_concurrency (int, optional): The number of blocks staged in parallel. Defaults to 4.
+        standard_blob_tier (str or StandardBlobTier, optional): The access tier of the blob, e.g. 'Hot', 'Cool' or 'Archive'.
+        credential (optional): The credential for the storage account. Defaults to the shared credential from embedding.clients.
+
+    Returns:
+        int: The number of bytes uploaded, or None if an error occurred.
+    """
+    try:
+        blob_service_client = get_blob_service_client(account_url, credential)
+        blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
+
+        if isinstance(standard_blob_tier, str):
+            standard_blob_tier = StandardBlobTier(standard_blob_tier)
+
+        block_ids = []
+        uploaded_bytes = 0
+        md5 = hashlib.md5()
+        # the chunks are produced while uploading, so the stage includes their serialization
+        stage = get_metrics().stage('upload')
+        with stage, concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            pending = set()
+            for index, block in enumerate(iter_blocks(chunks, block_size)):
+                # block ids must all have the same length within a blob
+                block_id = base64.b64encode(f"{index:010d}".encode()).decode()
+                block_ids.append(block_id)
+                uploaded_bytes += len(block)
+                md5.update(block)
+
+                # wait for a free slot so only max_concurrency blocks are held in memory
+                if len(pending) >= max_concurrency:
+                    done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                pending.add(executor.submit(blob_client.stage_block, block_id, block, length=len(block)))
+
+            for future in concurrent.futures.as_completed(pending):
+                future.result()
+            stage.add(bytes=uploaded_bytes)
+
+        # the service does not compute the MD5 of a block list, so store it for upload_file_if_changed
+        blob_client.commit_block_list([BlobBlock(block_id=block_id) for block_id in block_ids],
+                                      content_settings=ContentSettings(content_md5=md5.digest()),
+                                      standard_blob_tier=standard_blob_tier)
+        return uploaded_bytes
+
+    except Exception as e:
+        logger.error("Could not upload %s: %s", blob_name, e)
+        return None
+
+
+def upload_file_if_changed(path: str, account_url: str, container_name: str, blob_name: str,
+                           block_size: int=DEFAULT_BLOCK_SIZE, max_concurrency: int=4,
+                           standard_blob_tier=None, credential=None):
+    """
+    Uploads a local file with upload_blob_blocks unless the blob already holds the same content.
+
+    The MD5 of the file is compared with the Content-MD5 of the existing blob, so unchanged outputs are not sent again.
+
+    Args:
+        path (str): The path of the local file.
+        account_url (str): The URL of the Azure storage account (or of a local emulator such as Azurite).
+        container_name (str): The name of the container where the blob is written.
+        blob_name (str): The name of the blob to write.
+        block_size (int, optional): The size in bytes of each staged block. Defaults to 8 MiB.
+        max_concurrency (int, optional): The number of blocks staged in parallel. Defaults to 4.
+        standard_blob_tier (str or StandardBlobTier, optional): The access tier of the blob.
+        credential (optional): The credential for the storage account. Defaults to the shared credential from embedding.clients.
+
+    Returns:
+        int: The number of bytes uploaded (0 if the blob was already up to date), or None if an error occurred.
+    """
+    try:
+        md5 = hashlib.md5()
+        for chunk in iter_file_chunks(path, block_size):
+            md5.update(chunk)
+
+        blob_service_client = get_blob_service_client(account_url, credential)
+        blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
+        if blob_content_md5(blob_client) == md5.digest():
+            logger.info("%s is up to date, skipping upload", blob_name)
+            return 0
+
+    except Exception as e:
+        logger.error("Could not upload %s: %s", blob_name, e)
+        return None
+
+    return upload_blob_blocks(iter_file_chunks(path, block_size), account_url, container_name, blob_name,
+                              block_size, max_concurrency, standard_blob_tier, credential)
+
+
+def blob_content_md5(blob_client):
+    """
+    Returns the Content-MD5 stored for a blob.
+
+    Args:
+        blob_client (BlobClient): The client of the blob.
+
+    Returns:
+        bytes: The MD5 digest, or None if the blob does not exist or has no MD5.
+    """
+    try:
+        content_md5 = blob_client.get_blob_properties().content_settings.content_md5
+    except ResourceNotFoundError:
+        return None
+    return bytes(content_md5) if content_md5 else None
+
+
+def download_blob_to_file(account_url: str, container_name: str, blob_name: str, path: str,
+                          max_concurrency: int=8, chunk_size: int=DEFAULT_BLOCK_SIZE, credential=None, etag: str=None):
+    """
+    Downloads a blob to a local file with parallel ranged requests.
+
+    Args:
+        account_url (str): The URL of the Azure storage account (or of a local emulator such as Azurite).
+        container_name (str): The name of the container where the blob resides.
+        blob_name (str): The name of the blob to download.
+        path (str): The path of the local file to write.
+        max_concurrency (int, optional): The number of ranges downloaded in parallel. Defaults to 8.
+        chunk_size (int, optional): The size in bytes of each ranged request. Defaults to 8 MiB.
+        credential (optional): The credential for the storage account. Defaults to the shared credential from embedding.clients.
+        etag (str, optional): If given, the download fails instead of mixing versions when the blob changes meanwhile.
+
+    Returns:
+        int: The number of bytes downloaded.
+    """
+    blob_service_client = get_blob_service_client(account_url, credential,
+                                                  max_single_get_size=chunk_size, max_chunk_get_size=chunk_size)
+    blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
+
+    conditions = {"etag": etag, "match_condition": MatchConditions.IfNotModified} if etag else {}
+    with get_metrics().stage('download') as stage, open(path + ".tmp", "wb") as f:
+        size = blob_client.download_blob(max_concurrency=max_concurrency, **conditions).readinto(f)
+        stage.add(bytes=size)
+    os.replace(path + ".tmp", path)
+    return size
+
+
+def download_blob_cached(account_url: str, container_name: str, blob_name: str, cache_dir: str=DEFAULT_CACHE_DIR,
+                         max_concurrency: int=8, chunk_size: int=DEFAULT_BLOCK_SIZE, credential=None):
+    """
+    Returns a local copy of a blob, downloading it only if the cached copy is missing or out of date.
+
+    The cached copy is current when its recorded ETag and last-modified time match the blob's properties;
+    otherwise the blob is downloaded again with download_blob_to_file.
+
+    Args:
+        account_url (str): The URL of the Azure storage account (or of a local emulator such as Azurite).
+        container_name (str): The name of the container where the blob resides.
+        blob_name (str): The name of the blob.
+        cache_dir (str, optional): The directory of the local cache. Defaults to 'blob_cache'.
+        max_concurrency (int, optional): The number of ranges downloaded in parallel. Defaults to 8.
+        chunk_size (int, optional): The size in bytes of each ranged request. Defaults to 8 MiB.
+        credential (optional): The credential for the storage account. Defaults to the shared credential from embedding.clients.
+
+    Returns:
+        str: The path of the local copy, or None if an error occurred.
+    """
+    try:
+        blob_service_client = get_blob_service_client(account_url, credential)
+        properties = blob_service_client.get_blob_client(container=container_name, blob=blob_name).get_blob_properties()
+        version = {"etag": properties.etag, "last_modified": properties.last_modified.isoformat(),
+                   "size": properties.size}
+
+        path = os.path.join(cache_dir, container_name, blob_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        if os.path.exists(path) and os.path.exists(path + ".meta.json"):
+            with open(path + ".meta.json", "r", encoding="utf-8") as f:
+                if json.load(f) == version and os.path.getsize(path) == properties.size:
+                    return path
+
+        download_blob_to_file(account_url, container_name, blob_name, path, max_concurrency, chunk_size,
+                              credential, etag=properties.etag)
+        with open(path + ".meta.json", "w", encoding="utf-8") as f:
+            json.dump(version, f)
+        return path
+
+    except Exception as e:
+        logger.error("Could not download %s: %s", blob_name, e)
+        return None
@@ -0,0 +1,189 @@
+#built-in modules
+from collections import OrderedDict
+import hashlib
+import sqlite3
+import threading
+
+#third-party libraries
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache backed by SQLite with a bounded in-memory LRU in front.
+
+    Entries are keyed by a SHA-256 of (model, dimensions, newline-normalized text) and stored as
+    float32 blobs, so the same chunk is only ever paid for once per model and dimension setting.
+
+    Args:
+        path (str): Path of the SQLite database file (created if it does not exist).
+        max_memory_items (int, optional): Maximum number of vectors kept in the in-memory LRU. Defaults to 50000.
+    """
+
+    def __init__(self, path: str, max_memory_items: int=50000):
+        self.path = path
+        self.max_memory_items = max_memory_items
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.memory_hits = 0
+        self.misses = 0
+
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self._connection.commit()
+
+    @staticmethod
+    def key(model: str, text: str, dimensions: int=None) -> bytes:
+        """
+        Returns the cache key of a text for a given model and dimension setting.
+
+        Args:
+            model (str): The name of the embedding model.
+            text (str): The text to be embedded. Newlines are replaced as they are before embedding.
+            dimensions (int, optional): The requested output dimensions, if any.
+
+        Returns:
+            bytes: The SHA-256 digest identifying the embedding.
+        """
+        text = text.replace("\n", " ")
+        return hashlib.sha256(f"{model}\x1f{dimensions}\x1f{text}".encode("utf-8")).digest()
+
+    def get_many(self, keys: list[bytes]) -> list:
+        """
+        Looks up several keys, first in memory and then on disk.
+
+        Args:
+            keys (list[bytes]): Keys produced by EmbeddingCache.key.
+
+        Returns:
+            list: One float32 numpy array per key, or None where the key is not cached.
+        """
+        vectors = [None] * len(keys)
+        pending = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    vectors[i] = vector
+                    self.memory_hits += 1
+                else:
+                    pending.setdefault(key, []).append(i)
+
+            # SQLite limits the number of bound parameters per statement
+            pending_keys = list(pending)
+            for chunk_start in range(0, len(pending_keys), 500):
+                chunk = pending_keys[chunk_start:chunk_start + 500]
+                rows = self._connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    self._remember(key, vector)
+                    for i in pending[key]:
+                        vectors[i] = vector
+
+            n_hits = sum(vector is not None for vector in vectors)
+            self.hits += n_hits
+            self.misses += len(keys) - n_hits
+        return vectors
+
+    def put_many(self, items: dict):
+        """
+        Stores several embeddings.
+
+        Args:
+            items (dict): A mapping from key to embedding (list of floats or numpy array).
+        """
+        rows = []
+        with self._lock:
+            for key, embedding in items.items():
+                vector = np.asarray(embedding, dtype=np.float32)
+                self._remember(key, vector)
+                rows.append((key, vector.tobytes()))
+            self._connection.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+            self._connection.commit()
+
+    def get_or_compute(self, texts: list[str], model: str, embed_fn, dimensions: int=None) -> list:
+        """
+        Returns the embeddings of texts, calling embed_fn only for the ones that are not cached.
+
+        Args:
+            texts (list[str]): The texts to embed.
+            model (str): The name of the embedding model.
+            embed_fn: A function that takes a list of texts and returns their embeddings in order.
+            dimensions (int, optional): The requested output dimensions, if any.
+
+        Returns:
+            list: The embeddings of texts as lists of floats, in the same order as texts.
+        """
+        embeddings, misses = self._lookup(texts, model, dimensions)
+        if misses:
+            self._fill(embeddings, misses, embed_fn([texts[misses[key][0]] for key in misses]))
+        return embeddings
+
+    async def aget_or_compute(self, texts: list[str], model: str, embed_fn, dimensions: int=None) -> list:
+        """
+        Asynchronous counterpart of get_or_compute, where embed_fn is a coroutine function.
+        """
+        embeddings, misses = self._lookup(texts, model, dimensions)
+        if misses:
+            self._fill(embeddings, misses, await embed_fn([texts[misses[key][0]] for key in misses]))
+        return embeddings
+
+    def stats(self) -> dict:
+        """
+        Returns hit/miss statistics since the cache was opened.
+
+        Returns:
+            dict: Hits (total and from memory), misses, hit rate and number of vectors held in memory.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "memory_hits": self.memory_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "memory_items": len(self._memory),
+        }
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, texts, model, dimensions):
+        keys = [self.key(model, text, dimensions) for text in texts]
+        embeddings = [vector.tolist() if vector is not None else None for vector in self.get_many(keys)]
+
+        # positions of each missing key, so repeated texts are only embedded once
+        misses = {}
+        for i, embedding in enumerate(embeddings):
+            if embedding is None:
+                misses.setdefault(keys[i], []).append(i)
+        return embeddings, misses
+
+    def _fill(self, embeddings, misses, computed):
+        new_items = {}
+        for key, embedding in zip(misses, computed):
+            for i in misses[key]:
+                embeddings[i] = embedding
+            # failed items come back as None, [] or [None] and must not be cached
+            if embedding is not None and len(embedding) and embedding[0] is not None:
+                new_items[key] = embedding
+        if new_items:
+            self.put_many(new_items)
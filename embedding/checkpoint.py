@@ -0,0 +1,110 @@
+#built-in modules
+import hashlib
+import json
+import os
+
+#third-party libraries
+import numpy as np
+
+
+def job_fingerprint(texts: list[str], model: str, **settings) -> str:
+    """
+    Identifies an embedding job by its model, settings and input texts.
+
+    Args:
+        texts (list[str]): The texts to be embedded, in order.
+        model (str): The name of the embedding model.
+        **settings: Any other setting that changes the batches or the vectors (batch size, token budget...).
+
+    Returns:
+        str: A hex digest that changes whenever the job would produce different batches.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps({"model": model, **settings}, sort_keys=True).encode("utf-8"))
+    for text in texts:
+        digest.update(b"\x1e")
+        digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class EmbeddingCheckpoint:
+    """
+    Per-batch checkpoints of an embedding job on local disk.
+
+    Each completed batch is written atomically as a float32 .npy file named after its input range,
+    so a restarted job can load finished batches and only send the missing or failed ones again.
+    Checkpoints of different jobs live in separate subdirectories named after their fingerprint.
+
+    Args:
+        directory (str): The root directory of the checkpoints.
+        fingerprint (str): The fingerprint of the job, as returned by job_fingerprint.
+    """
+
+    def __init__(self, directory: str, fingerprint: str):
+        self.directory = os.path.join(directory, fingerprint[:16])
+        os.makedirs(self.directory, exist_ok=True)
+
+        manifest_path = os.path.join(self.directory, "manifest.json")
+        if not os.path.exists(manifest_path):
+            self._write_json(manifest_path, {"fingerprint": fingerprint})
+
+        self._failed_path = os.path.join(self.directory, "failed.json")
+        self._failed = set()
+        if os.path.exists(self._failed_path):
+            with open(self._failed_path, "r", encoding="utf-8") as f:
+                self._failed = {tuple(batch_range) for batch_range in json.load(f)}
+
+    def is_done(self, start: int, end: int) -> bool:
+        return os.path.exists(self._batch_path(start, end))
+
+    def load(self, start: int, end: int) -> list:
+        """
+        Returns the embeddings saved for the batch covering texts[start:end].
+        """
+        return np.load(self._batch_path(start, end)).tolist()
+
+    def save(self, start: int, end: int, embeddings: list):
+        """
+        Saves the embeddings of the batch covering texts[start:end] and marks it as done.
+        """
+        path = self._batch_path(start, end)
+        with open(path + ".tmp", "wb") as f:
+            np.save(f, np.asarray(embeddings, dtype=np.float32))
+        os.replace(path + ".tmp", path)
+
+        if (start, end) in self._failed:
+            self._failed.discard((start, end))
+            self._write_json(self._failed_path, sorted(self._failed))
+
+    def mark_failed(self, start: int, end: int):
+        """
+        Records that the batch covering texts[start:end] failed, so it is retried on the next run.
+        """
+        self._failed.add((start, end))
+        self._write_json(self._failed_path, sorted(self._failed))
+
+    def completed_ranges(self) -> list:
+        """
+        Returns the (start, end) ranges of the batches that are done.
+        """
+        ranges = []
+        for name in os.listdir(self.directory):
+            if name.startswith("batch_") and name.endswith(".npy"):
+                start, end = name[len("batch_"):-len(".npy")].split("_")
+                ranges.append((int(start), int(end)))
+        return sorted(ranges)
+
+    def failed_ranges(self) -> list:
+        """
+        Returns the (start, end) ranges of the batches that failed in a previous attempt and are not done yet.
+        """
+        return sorted(self._failed)
+
+    def _batch_path(self, start, end):
+        return os.path.join(self.directory, f"batch_{start}_{end}.npy")
+
+    @staticmethod
+    def _write_json(path, data):
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(path + ".tmp", path)
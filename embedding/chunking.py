@@ -0,0 +1,194 @@
+#built-in modules
+from bisect import bisect_left
+from collections import deque
+import functools
+import itertools
+import multiprocessing
+import re
+
+#third-party libraries
+import tiktoken
+
+#own libraries
+from embedding.streaming import iter_windows
+
+
+# Boundaries tried in order when a span does not fit: paragraphs, then sentences
+_BOUNDARIES = [
+    re.compile(r"\n\s*\n"),
+    re.compile(r"(?<=[.!?;:])\s+"),
+]
+
+# Tokenizer loaded by each worker process
+_tokenizer = None
+
+
+def load_tokenizer(model_name: str):
+    """
+    Returns the tokenizer of an embedding model: tiktoken for OpenAI models, the Hugging Face tokenizer otherwise.
+    """
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        # imported here so OpenAI-only pipelines do not need transformers
+        from embedding.models import get_tokenizer
+        return get_tokenizer(model_name)
+
+
+def token_offsets(tokenizer, text: str) -> list[int]:
+    """
+    Returns the character offset at which each token of text starts.
+
+    Args:
+        tokenizer: A tiktoken encoding or a Hugging Face fast tokenizer.
+        text (str): The text to tokenize.
+
+    Returns:
+        list[int]: One offset per token, in increasing order.
+    """
+    if hasattr(tokenizer, "decode_with_offsets"):
+        _, offsets = tokenizer.decode_with_offsets(tokenizer.encode_ordinary(text))
+        return offsets
+    encoding = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+    return [start for start, _ in encoding["offset_mapping"]]
+
+
+def chunk_text(text: str, tokenizer, max_tokens: int=512, overlap: int=64) -> list[tuple]:
+    """
+    Splits a text into spans of at most max_tokens tokens, cutting at paragraph or sentence boundaries when possible.
+
+    The text is tokenized once. Paragraphs that do not fit are split into sentences, and sentences that
+    still do not fit are cut every max_tokens tokens. The pieces are then packed greedily, and each
+    chunk repeats the trailing pieces of the previous one, up to overlap tokens.
+
+    Args:
+        text (str): The text to split.
+        tokenizer: A tiktoken encoding or a Hugging Face fast tokenizer (see load_tokenizer).
+        max_tokens (int, optional): The maximum number of tokens per chunk. Defaults to 512.
+        overlap (int, optional): The maximum number of tokens repeated from the previous chunk. Defaults to 64.
+
+    Returns:
+        list[tuple]: (start, end, n_tokens) for each chunk, where text[start:end] is the chunk.
+    """
+    offsets = token_offsets(tokenizer, text)
+
+    def count(start, end):
+        return bisect_left(offsets, end) - bisect_left(offsets, start)
+
+    def split(start, end, level):
+        if count(start, end) <= max_tokens:
+            return [(start, end)]
+        if level == len(_BOUNDARIES):
+            # no boundary left: cut every max_tokens tokens
+            first, last = bisect_left(offsets, start), bisect_left(offsets, end)
+            cuts = [start] + offsets[first + max_tokens:last:max_tokens] + [end]
+            return list(zip(cuts[:-1], cuts[1:]))
+        cuts = [start] + [match.end() for match in _BOUNDARIES[level].finditer(text, start, end)] + [end]
+        pieces = []
+        for piece_start, piece_end in zip(cuts[:-1], cuts[1:]):
+            if piece_end > piece_start:
+                pieces.extend(split(piece_start, piece_end, level + 1))
+        return pieces
+
+    chunks = []
+    window = deque()
+    for piece in split(0, len(text), 0):
+        if window and count(window[0][0], piece[1]) > max_tokens:
+            chunks.append((window[0][0], window[-1][1]))
+            # carry the trailing pieces that fit in the overlap and leave room for the next piece
+            while window and (count(window[0][0], window[-1][1]) > overlap
+                              or count(window[0][0], piece[1]) > max_tokens):
+                window.popleft()
+        window.append(piece)
+    if window:
+        chunks.append((window[0][0], window[-1][1]))
+
+    # drop the whitespace around each chunk
+    result = []
+    for start, end in chunks:
+        stripped = text[start:end]
+        start += len(stripped) - len(stripped.lstrip())
+        end -= len(stripped) - len(stripped.rstrip())
+        if end > start:
+            result.append((start, end, count(start, end)))
+    return result
+
+
+def chunk_record(record: dict, tokenizer, key: str='text', max_tokens: int=512, overlap: int=64,
+                 id_key: str='id', parent_id=None) -> list[dict]:
+    """
+    Splits one record into child records, one per chunk of its text.
+
+    Each child keeps every field of the record, with key replaced by the chunk and the fields
+    parent_id, chunk_index, start and end (character offsets in the original text) and n_tokens added.
+    A record whose text is empty or blank gets one empty chunk with n_tokens 0, so no record is lost;
+    the embedding stages do not send it and give it a None embedding. Records without key are returned unchanged.
+
+    Args:
+        record (dict): The record to split.
+        tokenizer: A tiktoken encoding or a Hugging Face fast tokenizer (see load_tokenizer).
+        key (str, optional): The key of the text. Defaults to 'text'.
+        max_tokens (int, optional): The maximum number of tokens per chunk. Defaults to 512.
+        overlap (int, optional): The maximum number of tokens repeated from the previous chunk. Defaults to 64.
+        id_key (str, optional): The key of the record id, copied to parent_id. Defaults to 'id'.
+        parent_id (optional): The parent id used when the record has no id_key. Defaults to None.
+
+    Returns:
+        list[dict]: The child records, in order.
+    """
+    if key not in record:
+        return [record]
+    text = record[key]
+    parent_id = record.get(id_key, parent_id)
+    chunks = chunk_text(text, tokenizer, max_tokens, overlap) or [(0, 0, 0)]
+    return [{**record, key: text[start:end], "parent_id": parent_id, "chunk_index": i,
+             "start": start, "end": end, "n_tokens": n_tokens}
+            for i, (start, end, n_tokens) in enumerate(chunks)]
+
+
+def iter_chunks(records, model_name: str, key: str='text', max_tokens: int=512, overlap: int=64,
+                id_key: str='id', n_workers: int=1, window_size: int=1000):
+    """
+    Streams records split into chunks that fit the token limit of the embedding model.
+
+    Args:
+        records: An iterable of dictionaries, such as the output of iter_blob_records or iter_file_records.
+        model_name (str): The embedding model whose tokenizer counts the tokens.
+        key (str, optional): The key of the text. Defaults to 'text'.
+        max_tokens (int, optional): The maximum number of tokens per chunk. Defaults to 512.
+        overlap (int, optional): The maximum number of tokens repeated from the previous chunk. Defaults to 64.
+        id_key (str, optional): The key of the record id; records without it get their position in the stream. Defaults to 'id'.
+        n_workers (int, optional): The number of processes tokenizing in parallel. Defaults to 1.
+        window_size (int, optional): The number of records sent to a worker at a time. Defaults to 1000.
+
+    Yields:
+        dict: The child records (see chunk_record), in the order of the input.
+    """
+    settings = {"key": key, "max_tokens": max_tokens, "overlap": overlap, "id_key": id_key}
+    windows = (list(enumerate(window, window_start))
+               for window_start, window in zip(itertools.count(0, window_size), iter_windows(records, window_size)))
+
+    if n_workers <= 1:
+        tokenizer = load_tokenizer(model_name)
+        for window in windows:
+            for position, record in window:
+                yield from chunk_record(record, tokenizer, parent_id=position, **settings)
+        return
+
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(n_workers, initializer=_init_worker, initargs=(model_name,)) as pool:
+        # imap keeps the order of the windows
+        for chunks in pool.imap(functools.partial(_chunk_window, settings=settings), windows):
+            yield from chunks
+
+
+def _init_worker(model_name):
+    global _tokenizer
+    _tokenizer = load_tokenizer(model_name)
+
+
+def _chunk_window(window, settings):
+    chunks = []
+    for position, record in window:
+        chunks.extend(chunk_record(record, _tokenizer, parent_id=position, **settings))
+    return chunks
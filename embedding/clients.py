@@ -0,0 +1,253 @@
+#built-in modules
+import asyncio
+import threading
+import time
+
+#third-party libraries
+from azure.ai.ml import MLClient
+from azure.core.pipeline.transport import RequestsTransport
+from azure.identity import DefaultAzureCredential
+from azure.mgmt.compute import ComputeManagementClient
+from azure.mgmt.network import NetworkManagementClient
+from azure.mgmt.resource import ResourceManagementClient
+from azure.storage.blob import BlobServiceClient
+import requests
+
+
+# Connections kept open per host, shared by every client of the process
+POOL_MAXSIZE = 32
+
+# Tokens are refreshed this many seconds before they expire
+TOKEN_REFRESH_MARGIN = 300
+
+_lock = threading.RLock()
+_credential = None
+_session = None
+_clients = {}
+# Async clients and credentials per event loop: {loop: {key: client}}
+_loop_clients = {}
+
+
+class CachingCredential:
+    """
+    Wraps a credential and reuses each access token until shortly before it expires.
+
+    DefaultAzureCredential walks its credential chain (environment, managed identity, Azure CLI...) and
+    some of those do not cache tokens, so every client call could otherwise spawn a new token request.
+
+    Args:
+        credential: The credential to wrap, e.g. DefaultAzureCredential().
+    """
+
+    def __init__(self, credential):
+        self.credential = credential
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def get_token(self, *scopes, **kwargs):
+        key = (scopes, kwargs.get("tenant_id"), kwargs.get("claims"))
+        with self._lock:
+            token = self._tokens.get(key)
+            if token is None or token.expires_on - TOKEN_REFRESH_MARGIN <= time.time():
+                token = self.credential.get_token(*scopes, **kwargs)
+                self._tokens[key] = token
+            return token
+
+    def close(self):
+        self.credential.close()
+
+
+class AsyncCachingCredential:
+    """
+    The asyncio counterpart of CachingCredential, for azure.identity.aio credentials.
+
+    Args:
+        credential: The async credential to wrap, e.g. azure.identity.aio.DefaultAzureCredential().
+    """
+
+    def __init__(self, credential):
+        self.credential = credential
+        self._tokens = {}
+        self._lock = asyncio.Lock()
+
+    async def get_token(self, *scopes, **kwargs):
+        key = (scopes, kwargs.get("tenant_id"), kwargs.get("claims"))
+        async with self._lock:
+            token = self._tokens.get(key)
+            if token is None or token.expires_on - TOKEN_REFRESH_MARGIN <= time.time():
+                token = await self.credential.get_token(*scopes, **kwargs)
+                self._tokens[key] = token
+            return token
+
+    async def close(self):
+        await self.credential.close()
+
+
+def get_credential():
+    """
+    Returns the process-wide credential, creating it on first use.
+
+    Returns:
+        CachingCredential: A DefaultAzureCredential whose tokens are cached until expiry.
+    """
+    global _credential
+    with _lock:
+        if _credential is None:
+            _credential = CachingCredential(DefaultAzureCredential())
+        return _credential
+
+
+def get_transport():
+    """
+    Returns an HTTP transport backed by the process-wide connection pool.
+
+    Returns:
+        RequestsTransport: A transport that shares one requests.Session and does not close it.
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=POOL_MAXSIZE, pool_maxsize=POOL_MAXSIZE)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return RequestsTransport(session=_session, session_owner=False)
+
+
+def get_blob_service_client(account_url: str, credential=None, **kwargs):
+    """
+    Returns a shared BlobServiceClient for a storage account.
+
+    Clients are shared for the process-wide credential and for account keys, SAS tokens and
+    {'account_name', 'account_key'} dicts, which are compared by value. Any other credential object
+    gets a new client on every call, still on the shared connection pool.
+
+    Args:
+        account_url (str): The URL of the Azure storage account (or of a local emulator such as Azurite).
+        credential (optional): The credential for the storage account. Defaults to the process-wide credential.
+        **kwargs: Client configuration, e.g. max_single_get_size or max_chunk_get_size.
+
+    Returns:
+        BlobServiceClient: The same client for the same account, credential and configuration.
+    """
+    credential = credential or get_credential()
+    factory = lambda: BlobServiceClient(account_url, credential=credential, transport=get_transport(), **kwargs)
+    credential_key = _credential_key(credential, get_credential())
+    if credential_key is None:
+        return factory()
+    return _get_client(("blob", account_url, credential_key, tuple(sorted(kwargs.items()))), factory)
+
+
+def get_async_blob_service_client(account_url: str, credential=None, **kwargs):
+    """
+    Returns a shared azure.storage.blob.aio BlobServiceClient for a storage account and the running event loop.
+
+    aiohttp sessions cannot be used from another event loop, so each loop gets its own clients and its
+    own async DefaultAzureCredential; clients of loops that have been closed are dropped. Credentials are
+    shared as in get_blob_service_client. Must be called from a coroutine.
+
+    Args:
+        account_url (str): The URL of the Azure storage account (or of a local emulator such as Azurite).
+        credential (optional): The credential for the storage account. Defaults to the loop's async credential.
+        **kwargs: Client configuration, e.g. max_single_get_size or max_chunk_get_size.
+
+    Returns:
+        azure.storage.blob.aio.BlobServiceClient: The same client for the same loop, account, credential and configuration.
+    """
+    # the aio clients need aiohttp, which the synchronous pipelines do not
+    from azure.identity.aio import DefaultAzureCredential as AsyncDefaultAzureCredential
+    from azure.storage.blob.aio import BlobServiceClient as AsyncBlobServiceClient
+
+    loop = asyncio.get_running_loop()
+    with _lock:
+        for closed in [other for other in _loop_clients if other.is_closed()]:
+            del _loop_clients[closed]
+        clients = _loop_clients.setdefault(loop, {})
+        default_credential = clients.get("credential")
+        if default_credential is None:
+            default_credential = clients["credential"] = AsyncCachingCredential(AsyncDefaultAzureCredential())
+        credential = credential or default_credential
+        credential_key = _credential_key(credential, default_credential)
+        if credential_key is None:
+            return AsyncBlobServiceClient(account_url, credential=credential, **kwargs)
+        key = ("blob", account_url, credential_key, tuple(sorted(kwargs.items())))
+        client = clients.get(key)
+        if client is None:
+            client = clients[key] = AsyncBlobServiceClient(account_url, credential=credential, **kwargs)
+        return client
+
+
+async def close_async_clients():
+    """
+    Closes the async clients and credential of the running event loop, e.g. before the loop ends.
+    """
+    with _lock:
+        clients = _loop_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.close()
+
+
+def get_compute_client(subscription_id: str):
+    """
+    Returns a shared ComputeManagementClient for a subscription.
+    """
+    return _get_client(("compute", subscription_id),
+                       lambda: ComputeManagementClient(get_credential(), subscription_id, transport=get_transport()))
+
+
+def get_network_client(subscription_id: str):
+    """
+    Returns a shared NetworkManagementClient for a subscription.
+    """
+    return _get_client(("network", subscription_id),
+                       lambda: NetworkManagementClient(get_credential(), subscription_id, transport=get_transport()))
+
+
+def get_resource_client(subscription_id: str):
+    """
+    Returns a shared ResourceManagementClient for a subscription.
+    """
+    return _get_client(("resource", subscription_id),
+                       lambda: ResourceManagementClient(get_credential(), subscription_id, transport=get_transport()))
+
+
+def get_ml_client(subscription_id: str, resource_group: str, workspace: str):
+    """
+    Returns a shared MLClient for an Azure ML workspace.
+    """
+    return _get_client(("ml", subscription_id, resource_group, workspace),
+                       lambda: MLClient(get_credential(), subscription_id, resource_group, workspace))
+
+
+def clear_clients():
+    """
+    Forgets every cached client and the process-wide credential, e.g. after forking or in tests.
+    """
+    global _credential
+    with _lock:
+        _clients.clear()
+        _loop_clients.clear()
+        _credential = None
+
+
+def _get_client(key, factory):
+    # fast path without the lock once the client exists
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = factory()
+    return client
+
+
+def _credential_key(credential, default_credential):
+    # only credentials compared by value are cached: keying on id() could match a new credential after the
+    # old one is garbage collected, and a client keeps its credential alive, so weak keys would never expire
+    if credential is default_credential:
+        return "default"
+    if isinstance(credential, str):
+        return ("str", credential)
+    if isinstance(credential, dict) and all(isinstance(value, str) for value in credential.values()):
+        return ("dict", tuple(sorted(credential.items())))
+    return None
@@ -1,6 +1,11 @@
 #built-in modules
+import concurrent.futures
 import datetime
+import json
 import os
+import queue
+import shlex
+import time
 
 #third-party libraries
 from azure.ai.ml import MLClient
@@ -18,6 +23,11 @@ import requests
 load_dotenv()
 
 #own libraries
+from embedding.blob_transfer import download_blob_to_file
+from embedding.clients import get_compute_client, get_ml_client, get_network_client
+# only the executor base class: the rest of sharding is imported where it is used
+from embedding.sharding import ShardExecutor
+from embedding.vm_planner import fetch_vm_prices, load_calibration, plan_vm_size
 
 # Access the variables 
 subscription_id_env = os.getenv('subscription_id')
@@ -29,29 +39,25 @@ def AML_workspace(subscription_id, resource_group, workspace):
     # resource_group = f"<RESOURCE_GROUP>"
     # workspace = f"<AML_WORKSPACE_NAME>"
 
-    ml_client = MLClient(
-        DefaultAzureCredential(), subscription_id, resource_group, workspace
-    )
+    ml_client = get_ml_client(subscription_id, resource_group, workspace)
 
     return ml_client
 
 
-def list_azure_compute_instances(subscription_id):
+def list_azure_compute_instances(subscription_id, compute_client=None):
     """
     List all Azure compute instances in a subscription.
 
     Args:
         subscription_id (str): Azure subscription ID.
+        compute_client (optional): The client to use, e.g. a fake in tests. Defaults to the shared ComputeManagementClient.
 
     Returns:
         list: A list of compute instance names and details.
     """
     try:
-        # Authenticate using DefaultAzureCredential
-        credential = DefaultAzureCredential()
-
-        # Create ComputeManagementClient
-        compute_client = ComputeManagementClient(credential, subscription_id)
+        # Get the shared ComputeManagementClient
+        compute_client = compute_client or get_compute_client(subscription_id)
 
         # List all virtual machines in the subscription
         vms = compute_client.virtual_machines.list_all()
@@ -73,23 +79,21 @@ def list_azure_compute_instances(subscription_id):
         return []
 
 
-def list_dedicated_cores(subscription_id, location):
+def list_dedicated_cores(subscription_id, location, compute_client=None):
     """
     Lists dedicated cores (quota limits) available for the subscription in a specific location.
 
     Args:
         subscription_id (str): Azure subscription ID.
         location (str): Azure location (e.g., 'eastus').
+        compute_client (optional): The client to use, e.g. a fake in tests. Defaults to the shared ComputeManagementClient.
 
     Returns:
         dict: A dictionary containing dedicated core limits and usage.
     """
     try:
-        # Authenticate using DefaultAzureCredential
-        credential = DefaultAzureCredential()
-
-        # Create ComputeManagementClient
-        compute_client = ComputeManagementClient(credential, subscription_id)
+        # Get the shared ComputeManagementClient
+        compute_client = compute_client or get_compute_client(subscription_id)
 
         # Fetch usage details for the specified location
         usage_details = compute_client.usage.list(location)
@@ -110,23 +114,21 @@ def list_dedicated_cores(subscription_id, location):
         return {}
 
 
-def list_available_vm_sizes(subscription_id, location):
+def list_available_vm_sizes(subscription_id, location, compute_client=None):
     """
     Lists the specific Azure VM sizes available for a subscription in a given location.
 
     Args:
         subscription_id (str): Azure subscription ID.
         location (str): Azure location (e.g., 'eastus').
+        compute_client (optional): The client to use, e.g. a fake in tests. Defaults to the shared ComputeManagementClient.
 
     Returns:
         list: A list of VM size details available in the specified location.
     """
     try:
-        # Authenticate using DefaultAzureCredential
-        credential = DefaultAzureCredential()
-
-        # Create ComputeManagementClient
-        compute_client = ComputeManagementClient(credential, subscription_id)
+        # Get the shared ComputeManagementClient
+        compute_client = compute_client or get_compute_client(subscription_id)
 
         # Get available VM sizes for the specified location
         vm_sizes = compute_client.virtual_machine_sizes.list(location)
@@ -149,6 +151,90 @@ def list_available_vm_sizes(subscription_id, location):
         return []    
 
 
+def list_remaining_cores(subscription_id, location, compute_client=None):
+    """
+    Lists the vCPUs still free under each core quota of a location.
+
+    Args:
+        subscription_id (str): Azure subscription ID.
+        location (str): Azure location (e.g., 'eastus').
+        compute_client (optional): The client to use, e.g. a fake in tests. Defaults to the shared ComputeManagementClient.
+
+    Returns:
+        dict: {quota name: free vCPUs}, where 'cores' is the regional total and the other names are
+        VM families (e.g. 'standardNCASv3_T4Family'), as in the 'family' of list_vm_skus.
+    """
+    try:
+        compute_client = compute_client or get_compute_client(subscription_id)
+        return {item.name.value: item.limit - item.current_value for item in compute_client.usage.list(location)}
+
+    except Exception as e:
+        print(f"Error: {e}")
+        return {}
+
+
+def list_vm_skus(subscription_id, location, compute_client=None):
+    """
+    Lists the VM sizes the subscription can deploy in a location, with their family, vCPUs, memory and GPUs.
+
+    Args:
+        subscription_id (str): Azure subscription ID.
+        location (str): Azure location (e.g., 'eastus').
+        compute_client (optional): The client to use, e.g. a fake in tests. Defaults to the shared ComputeManagementClient.
+
+    Returns:
+        list: One dictionary per VM size with 'name', 'family', 'vcpus', 'memory_gb' and 'gpus'.
+    """
+    try:
+        compute_client = compute_client or get_compute_client(subscription_id)
+
+        skus = []
+        for sku in compute_client.resource_skus.list(filter=f"location eq '{location}'"):
+            # sizes restricted for the subscription (e.g. NotAvailableForSubscription) cannot be deployed
+            if sku.resource_type != "virtualMachines" or sku.restrictions:
+                continue
+            capabilities = {capability.name: capability.value for capability in sku.capabilities or []}
+            skus.append({
+                "name": sku.name,
+                "family": sku.family,
+                "vcpus": int(capabilities.get("vCPUs", 0)),
+                "memory_gb": float(capabilities.get("MemoryGB", 0)),
+                "gpus": int(capabilities.get("GPUs", 0)),
+            })
+        return skus
+
+    except Exception as e:
+        print(f"Error: {e}")
+        return []
+
+
+def recommend_vm_size(subscription_id, location, total_tokens, deadline_hours, calibration,
+                      compute_client=None, price_session=requests, **kwargs):
+    """
+    Recommends a VM size, VM count and worker layout for an embedding job, from live quota and prices.
+
+    Args:
+        subscription_id (str): Azure subscription ID.
+        location (str): Azure location (e.g., 'westus3').
+        total_tokens (int): The tokens of the corpus (see vm_planner.corpus_tokens).
+        deadline_hours (float): The wall time the job must finish in.
+        calibration (dict or str): The calibration results, or the path of a file written by vm_planner.save_calibration.
+        compute_client (optional): The client to use, e.g. a fake in tests. Defaults to the shared ComputeManagementClient.
+        price_session (optional): Used to query the retail prices API, e.g. a fake in tests. Defaults to requests.
+        **kwargs: Other arguments of vm_planner.plan_vm_size (max_vms, startup_hours, model_memory_gb...).
+
+    Returns:
+        dict: The plan returned by vm_planner.plan_vm_size, or None if no size can run the job.
+    """
+    if isinstance(calibration, str):
+        calibration = load_calibration(calibration)
+    skus = list_vm_skus(subscription_id, location, compute_client)
+    remaining_cores = list_remaining_cores(subscription_id, location, compute_client)
+    prices = fetch_vm_prices(location, session=price_session)
+    return plan_vm_size(total_tokens, deadline_hours, skus, prices, remaining_cores,
+                        calibration["cpu"], calibration.get("gpu"), **kwargs)
+
+
 def create_vm(size = None):
     # Enter details of your AML workspace
     subscription_id = subscription_id_env
@@ -189,6 +275,99 @@ def delete_vm(vm_name: str):
     print('VM deleted')
 
 
+class RunCommandExecutor(ShardExecutor):
+    """
+    Runs shards on existing Azure VMs with Run Command, one shard per VM at a time.
+
+    Run Command stops a script after about 90 minutes, so the worker is started in the background with
+    nohup and followed with short Run Command polls until it writes its exit code next to its outputs.
+
+    Each VM needs this repository in workdir and its dependencies installed. The workers read the
+    corpus from blob storage and upload their outputs to spec['upload'], from where they are
+    downloaded to the coordinator. A VM whose shard failed goes to the back of the queue, so the
+    retry runs on another idle VM when there is one.
+
+    Args:
+        subscription_id (str): Azure subscription ID.
+        resource_group (str): The resource group of the VMs.
+        vm_names (list[str]): The worker VMs.
+        workdir (str, optional): The directory of the repository on the VMs. Defaults to '/home/andres/Lawgorithm'.
+        python (str, optional): The Python interpreter on the VMs. Defaults to 'python3'.
+        poll_interval (float, optional): The seconds between polls of a running shard. Defaults to 60.
+        timeout (float, optional): The seconds after which a running shard is counted as failed. Defaults to None.
+    """
+
+    def __init__(self, subscription_id: str, resource_group: str, vm_names: list[str],
+                 workdir: str='/home/andres/Lawgorithm', python: str='python3', poll_interval: float=60,
+                 timeout: float=None):
+        self.subscription_id = subscription_id
+        self.resource_group = resource_group
+        self.workdir = workdir
+        self.python = python
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self._idle = queue.Queue()
+        for vm_name in vm_names:
+            self._idle.put(vm_name)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(vm_names))
+
+    def submit(self, spec: dict) -> concurrent.futures.Future:
+        return self._executor.submit(self._run, spec)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def _run(self, spec):
+        from embedding.sharding import parse_shard_result
+
+        vm_name = self._idle.get()
+        try:
+            # the outputs are written on the VM and copied back through blob storage
+            remote_prefix = os.path.join("shards", os.path.basename(spec["output_prefix"]))
+            remote_spec = {**spec, "output_prefix": remote_prefix, "metrics_log": None}
+            log, exit_code, pid = (shlex.quote(remote_prefix + extension) for extension in (".log", ".exit", ".pid"))
+            worker = f"{self.python} -m embedding.sharding {shlex.quote(json.dumps(remote_spec))} > {log} 2>&1; echo $? > {exit_code}"
+            self._run_command(vm_name, f"mkdir -p shards && rm -f {exit_code} && "
+                                       f"(nohup sh -c {shlex.quote(worker)} > /dev/null 2>&1 & echo $! > {pid})")
+
+            start = time.monotonic()
+            while True:
+                time.sleep(self.poll_interval)
+                # the output of Run Command is cut to its last 4 KB, so only the end of the log is printed
+                output = self._run_command(vm_name, f"if [ -f {exit_code} ]; then echo EXIT $(cat {exit_code}); tail -c 3000 {log}; "
+                                                    f"elif kill -0 $(cat {pid}) 2>/dev/null; then echo RUNNING; "
+                                                    f"else echo LOST; tail -c 3000 {log}; fi")
+                status = output.lstrip().split("\n", 1)[0].strip()
+                if status.startswith("EXIT") or status == "LOST":
+                    break
+                if self.timeout is not None and time.monotonic() - start > self.timeout:
+                    self._run_command(vm_name, f"kill $(cat {pid}) 2>/dev/null")
+                    raise RuntimeError(f"Shard {spec['index']} timed out on {vm_name} after {self.timeout}s")
+
+            shard_result = parse_shard_result(output)
+            if status != "EXIT 0" or shard_result is None:
+                raise RuntimeError(f"Shard {spec['index']} failed on {vm_name} ({status}): {output[-2000:]}")
+
+            upload = spec.get("upload")
+            if upload:
+                for extension in (".npy", ".meta.jsonl"):
+                    download_blob_to_file(upload["account_url"], upload["container_name"],
+                                          os.path.basename(spec["output_prefix"]) + extension,
+                                          spec["output_prefix"] + extension)
+            return {**shard_result, "vm_name": vm_name, "output_prefix": spec["output_prefix"]}
+        finally:
+            self._idle.put(vm_name)
+
+    def _run_command(self, vm_name, script):
+        command = RunCommandInput(command_id="RunShellScript", script=[f"cd {shlex.quote(self.workdir)} && {script}"])
+        result = get_compute_client(self.subscription_id).virtual_machines.begin_run_command(
+            resource_group_name=self.resource_group,
+            vm_name=vm_name,
+            parameters=command
+        ).result()
+        return "\n".join(message.message or "" for message in result.value)
+
+
 def is_azure_vm():
     try:
         # Query the Azure Metadata Service
@@ -251,29 +430,35 @@ def main1():
 
 
 def main2():
-    subscription_id = subscription_id_env  # Replace with your subscription ID
-    location = "westus3"  # Replace with your desired Azure location
-    dedicated_cores = list_dedicated_cores(subscription_id, location)
+    # imported here because embedding.inventory builds on this module
+    from embedding.inventory import AzureInventory
 
-    if dedicated_cores:
-        print(f"Dedicated cores in location {location}:")
-        for core_type, details in dedicated_cores.items():
-            print(f"  {core_type}: Used {details['current_usage']} / {details['limit']}")
-    else:
-        print("No dedicated core information found or an error occurred.")
+    subscription_id = subscription_id_env  # Replace with your subscription ID
+    # all regions are queried concurrently and cached for an hour
+    inventory = AzureInventory(subscription_id, regions=["westus2", "westus3", "eastus"])
+
+    for location, dedicated_cores in inventory.dedicated_cores().items():
+        if dedicated_cores:
+            print(f"Dedicated cores in location {location}:")
+            for core_type, details in dedicated_cores.items():
+                print(f"  {core_type}: Used {details['current_usage']} / {details['limit']}")
+        else:
+            print(f"No dedicated core information found in {location} or an error occurred.")
 
 
 def main3():
+    from embedding.inventory import AzureInventory
+
     subscription_id = subscription_id_env  # Replace with your subscription ID
-    location = "westus2"  # Replace with your desired Azure location
-    vm_sizes = list_available_vm_sizes(subscription_id, location)
+    inventory = AzureInventory(subscription_id, regions=["westus2", "westus3", "eastus"])
 
-    if vm_sizes:
-        print(f"Available VM sizes in {location}:")
-        for vm in vm_sizes:
-            print(f"  Name: {vm['name']}, Cores: {vm['number_of_cores']}, Memory: {vm['memory_in_mb']} MB, Max Disks: {vm['max_data_disk_count']}")
-    else:
-        print("No VM sizes found or an error occurred.")    
+    for location, vm_sizes in inventory.vm_sizes().items():
+        if vm_sizes:
+            print(f"Available VM sizes in {location}:")
+            for vm in vm_sizes:
+                print(f"  Name: {vm['name']}, Cores: {vm['number_of_cores']}, Memory: {vm['memory_in_mb']} MB, Max Disks: {vm['max_data_disk_count']}")
+        else:
+            print(f"No VM sizes found in {location} or an error occurred.")
 
 
 def main4():
@@ -381,7 +566,7 @@ def main8():
     # Replace with your resource group and VM name
     resource_group = 'Lawgorithm_group'
     # Initialize the NetworkManagementClient
-    network_client = NetworkManagementClient(DefaultAzureCredential(), subscription_id_env)
+    network_client = get_network_client(subscription_id_env)
 
     # Replace with your public IP resource group and name
     ip_name = 'prueba-ip'
@@ -424,14 +609,11 @@ def main8():
 
 
 def main9():
-    # Authenticate with Azure
-    credential = DefaultAzureCredential()
-
     # Replace with your Azure subscription ID
     subscription_id = subscription_id_env
 
-    # Initialize ComputeManagementClient
-    compute_client = ComputeManagementClient(credential, subscription_id)
+    # Get the shared ComputeManagementClient
+    compute_client = get_compute_client(subscription_id)
 
     # Define the Python script as a string
     python_script = """
@@ -475,11 +657,8 @@ def main10():
     resource_group = 'Lawgorithm_group'
     vm_name = 'embedding'
 
-    # Authenticate with Azure
-    credential = DefaultAzureCredential()
-
-    # Initialize ComputeManagementClient
-    compute_client = ComputeManagementClient(credential, subscription_id)
+    # Get the shared ComputeManagementClient
+    compute_client = get_compute_client(subscription_id)
 
     # Define the Run Command input
     command = RunCommandInput(
@@ -502,6 +681,51 @@ def main10():
         print(message.message)
 
 
+def main11():
+    # Embed the 2023 corpus on several VMs, one shard of about the same number of tokens each
+    from embedding.sharding import run_sharded
+
+    resource_group = 'Lawgorithm_group'
+    vm_names = ['embedding', 'embedding-2', 'embedding-3']
+    source = {"account_url": "https://lawgorithm.blob.core.windows.net",
+              "container_name": 'jurisprudencia-chunked-text',
+              "blob_name": 'jurisprudencia_2023.json'}
+
+    with RunCommandExecutor(subscription_id_env, resource_group, vm_names) as executor:
+        count = run_sharded(source, "text-embedding-3-large", 'jurisprudencia-embeddings_openai_large-2023',
+                            executor, n_shards=len(vm_names), work_dir='shards',
+                            upload={"account_url": "https://lawgorithm.blob.core.windows.net",
+                                    "container_name": 'jurisprudencia-embeddings-shards'},
+                            batch_size=200, checkpoint_dir='checkpoints')
+    print(f"Merged {count} embeddings")
+
+
+def main12():
+    # Same flow on this machine, with one worker process per shard
+    from embedding.sharding import LocalSubprocessExecutor, run_sharded
+
+    source = {"path": 'jurisprudencia_2023.json'}
+    with LocalSubprocessExecutor(max_workers=4) as executor:
+        count = run_sharded(source, "text-embedding-3-large", 'jurisprudencia-embeddings_openai_large-2023',
+                            executor, n_shards=4, work_dir='shards', batch_size=200, checkpoint_dir='checkpoints')
+    print(f"Merged {count} embeddings")
+
+
+def main13():
+    # Pick the VM size for the 2023 corpus from a local calibration run (see vm_planner.calibrate_cpu_throughput)
+    plan = recommend_vm_size(subscription_id_env, "westus3", total_tokens=450_000_000, deadline_hours=12,
+                             calibration='calibration.json')
+    if plan is None:
+        print("No VM size can run the job.")
+        return
+    print(f"{plan['vms']} x {plan['sku']} ({plan['workers_per_vm']} workers each): "
+          f"{plan['wall_hours']:.1f} h, ${plan['cost']:.2f}, meets deadline: {plan['feasible']}")
+    for alternative in plan['alternatives']:
+        print(f"  {alternative['vms']} x {alternative['sku']}: {alternative['wall_hours']:.1f} h, ${alternative['cost']:.2f}")
+    vm_name = create_vm(size=plan['sku'])
+    print(vm_name)
+
+
 if __name__ == '__main__':
     print(subscription_id_env)
 
@@ -0,0 +1,143 @@
+#built-in modules
+from collections import deque
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+
+#third-party libraries
+import numpy as np
+import torch
+
+#own libraries
+from embedding.models import count_model_tokens, default_dtype, get_sentence_transformer
+
+
+# Model loaded by each worker process
+_model = None
+
+# Failed batches are logged by the workers at WARNING; the parent records them in the metrics
+logger = logging.getLogger(__name__)
+
+
+class CPUEncoderPool:
+    """
+    Encodes texts with a SentenceTransformer on several CPU worker processes.
+
+    A single process running model.encode only uses the intra-op threads of one interpreter, which
+    stops scaling after a few cores. Each worker loads the model once, is pinned to its own set of
+    threads_per_worker cores and encodes whole batches, and results are yielded in submission order.
+
+    Args:
+        model_name (str): The Hugging Face model id or local path.
+        n_workers (int, optional): The number of worker processes. Defaults to cores // threads_per_worker.
+        threads_per_worker (int, optional): The torch threads of each worker. Defaults to 4 (or the core count if smaller).
+        dtype (str, optional): The dtype of the weights. Defaults to bfloat16 on CPUs that support it and float32 otherwise.
+        pin (bool, optional): Whether each worker is bound to distinct cores (Linux only). Defaults to True.
+        **model_kwargs: Other SentenceTransformer arguments, e.g. trust_remote_code=True.
+    """
+
+    def __init__(self, model_name: str, n_workers: int=None, threads_per_worker: int=None, dtype: str=None,
+                 pin: bool=True, **model_kwargs):
+        cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+        self.threads_per_worker = threads_per_worker or min(4, cores)
+        self.n_workers = n_workers or max(1, cores // self.threads_per_worker)
+        self.dtype = dtype or default_dtype("cpu")
+        self.model_name = model_name
+
+        # fork is unsafe once torch has started its thread pools
+        context = multiprocessing.get_context("spawn")
+        self._executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.n_workers, mp_context=context, initializer=_init_worker,
+            initargs=(model_name, self.dtype, self.threads_per_worker, pin, context.Value("i", 0), model_kwargs),
+        )
+
+    def imap(self, batches, max_pending: int=None, **encode_kwargs):
+        """
+        Encodes batches of texts in parallel.
+
+        Args:
+            batches: An iterable of lists of texts.
+            max_pending (int, optional): The number of batches submitted ahead of the one being yielded,
+                bounding memory on long streams. Defaults to 2 per worker.
+            **encode_kwargs: Arguments for SentenceTransformer.encode, e.g. prompt_name or normalize_embeddings.
+
+        Yields:
+            np.ndarray: The float32 embeddings of each batch, in order, or None if the batch failed.
+        """
+        max_pending = max_pending or 2 * self.n_workers
+        pending = deque()
+        for batch in batches:
+            pending.append(self._executor.submit(_encode, list(batch), encode_kwargs))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def encode(self, texts: list[str], batch_size: int=32, **encode_kwargs) -> list:
+        """
+        Encodes a list of texts, batch_size texts per task.
+
+        Returns:
+            list: One embedding (list of floats) per text, or None for the texts of a failed batch.
+        """
+        batches = [texts[batch_start:batch_start + batch_size] for batch_start in range(0, len(texts), batch_size)]
+        embeddings = []
+        for batch, response in zip(batches, self.imap(batches, **encode_kwargs)):
+            embeddings.extend(response.tolist() if response is not None else [None] * len(batch))
+        return embeddings
+
+    def count_tokens(self, texts: list[str], chunk_size: int=10000) -> np.ndarray:
+        """
+        Counts the tokens of each text with the workers' model, as count_model_tokens(model.tokenizer, texts,
+        model.max_seq_length) does in-process, so texts longer than the model's limit count as truncated.
+
+        Args:
+            texts (list[str]): The texts to be encoded.
+            chunk_size (int, optional): The number of texts counted per task. Defaults to 10000.
+
+        Returns:
+            np.ndarray: The (n,) token counts.
+        """
+        chunks = [texts[chunk_start:chunk_start + chunk_size] for chunk_start in range(0, len(texts), chunk_size)]
+        if not chunks:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(list(self._executor.map(_count_tokens, chunks)))
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _init_worker(model_name, dtype, threads, pin, counter, model_kwargs):
+    global _model
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+
+    # give each worker its own slice of the cores so their thread pools do not compete
+    if pin and hasattr(os, "sched_setaffinity"):
+        cores = sorted(os.sched_getaffinity(0))
+        start = (index * threads) % len(cores)
+        os.sched_setaffinity(0, cores[start:start + threads] or cores)
+    torch.set_num_threads(threads)
+
+    _model = get_sentence_transformer(model_name, device="cpu", dtype=dtype, **model_kwargs)
+
+
+def _count_tokens(texts):
+    return count_model_tokens(_model.tokenizer, texts, _model.max_seq_length)
+
+
+def _encode(batch, encode_kwargs):
+    try:
+        embeddings = _model.encode(batch, batch_size=len(batch), convert_to_numpy=True, **encode_kwargs)
+        return np.asarray(embeddings, dtype=np.float32)
+    except Exception as e:
+        logger.warning("Batch of %d texts failed: %s", len(batch), e)
+        return None
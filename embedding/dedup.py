@@ -0,0 +1,225 @@
+#built-in modules
+import hashlib
+import re
+import time
+import unicodedata
+
+#third-party libraries
+import numpy as np
+
+#own libraries
+from embedding.chunking import load_tokenizer
+
+
+# Largest prime below 2**32, the modulus of the MinHash permutations
+_PRIME = (1 << 32) - 5
+
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Returns the form of a text used to detect duplicates: NFKC, case-folded, punctuation and repeated whitespace removed.
+    """
+    return " ".join(_NON_WORD.sub(" ", unicodedata.normalize("NFKC", text).casefold()).split())
+
+
+def minhash_signatures(texts: list[str], num_perm: int=128, shingle_size: int=5, seed: int=0) -> np.ndarray:
+    """
+    Computes the MinHash signature of each text over its word shingles.
+
+    The fraction of equal positions between two signatures estimates the Jaccard similarity of their
+    sets of shingle_size-word shingles.
+
+    Args:
+        texts (list[str]): The normalized texts (see normalize_text).
+        num_perm (int, optional): The length of the signatures. Defaults to 128.
+        shingle_size (int, optional): The number of words per shingle. Defaults to 5.
+        seed (int, optional): The random seed of the permutations. Defaults to 0.
+
+    Returns:
+        np.ndarray: The (n, num_perm) uint64 signatures.
+    """
+    rng = np.random.default_rng(seed)
+    # a, b < _PRIME and x < 2**32 keep a * x + b below 2**64, and the modulus wraps it many times, so each
+    # permutation orders the shingles differently (a modulus above a * x + b would leave them in the order of x)
+    a = rng.integers(1, _PRIME, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, _PRIME, size=num_perm, dtype=np.uint64)
+
+    signatures = np.full((len(texts), num_perm), np.iinfo(np.uint64).max, dtype=np.uint64)
+    for i, text in enumerate(texts):
+        words = text.split()
+        shingles = {" ".join(words[j:j + shingle_size]) for j in range(max(1, len(words) - shingle_size + 1))}
+        hashes = np.array([int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest(), "little")
+                           for shingle in shingles], dtype=np.uint64)
+        signatures[i] = ((hashes[:, None] * a + b) % _PRIME).min(axis=0)
+    return signatures
+
+
+def find_duplicates(texts: list[str], threshold: float=0.9, num_perm: int=128, bands: int=32,
+                    shingle_size: int=5, near: bool=True) -> np.ndarray:
+    """
+    Groups exact and near-duplicate texts.
+
+    Exact duplicates share the hash of their normalized text. Near-duplicates are found with MinHash and
+    locality-sensitive hashing: signatures are cut into bands, and each text joins the earliest
+    representative that shares a band with it and whose estimated Jaccard similarity reaches threshold.
+    Texts are compared with the representative itself, so every member of a group is similar to it.
+
+    Args:
+        texts (list[str]): The texts to group.
+        threshold (float, optional): The minimum estimated Jaccard similarity of near-duplicates. Defaults to 0.9.
+        num_perm (int, optional): The length of the MinHash signatures. Defaults to 128.
+        bands (int, optional): The number of LSH bands; num_perm must be divisible by it. Defaults to 32.
+        shingle_size (int, optional): The number of words per shingle. Defaults to 5.
+        near (bool, optional): Whether near-duplicates are grouped, not only exact ones. Defaults to True.
+
+    Returns:
+        np.ndarray: For each text, the position of the representative of its group (itself if unique).
+    """
+    normalized = [normalize_text(text) for text in texts]
+    representative = _exact_representatives(normalized)
+    if not near:
+        return representative
+    return _near_representatives(normalized, representative, threshold, num_perm, bands, shingle_size)
+
+
+class Deduplicator:
+    """
+    Embeds one representative per group of duplicate texts and copies its vector to the other members.
+
+    Used like EmbeddingCache, by wrapping the function that embeds a list of texts. Near-duplicates
+    receive the vector of their representative, which is close to (but not exactly) their own embedding;
+    pass near=False to only merge texts that are identical after normalization.
+
+    Args:
+        threshold (float, optional): The minimum estimated Jaccard similarity of near-duplicates. Defaults to 0.9.
+        near (bool, optional): Whether near-duplicates are merged, not only exact ones. Defaults to True.
+        num_perm (int, optional): The length of the MinHash signatures. Defaults to 128.
+        bands (int, optional): The number of LSH bands. Defaults to 32.
+        shingle_size (int, optional): The number of words per shingle. Defaults to 5.
+    """
+
+    def __init__(self, threshold: float=0.9, near: bool=True, num_perm: int=128, bands: int=32, shingle_size: int=5):
+        self.threshold = threshold
+        self.near = near
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle_size = shingle_size
+        self.texts = 0
+        self.embedded = 0
+        self.exact_duplicates = 0
+        self.near_duplicates = 0
+        self.tokens_embedded = 0
+        self.tokens_saved = 0
+        self.embed_seconds = 0.0
+
+    def compute(self, texts: list[str], model: str, embed_fn) -> list:
+        """
+        Returns the embeddings of texts, calling embed_fn only for one text per group of duplicates.
+
+        Args:
+            texts (list[str]): The texts to embed.
+            model (str): The name of the embedding model, used to count the tokens saved.
+            embed_fn: A function that takes a list of texts and returns their embeddings in order.
+
+        Returns:
+            list: The embeddings, in the same order as texts.
+        """
+        representative, unique = self._plan(texts, model)
+        start = time.perf_counter()
+        computed = embed_fn([texts[i] for i in unique])
+        self.embed_seconds += time.perf_counter() - start
+        return self._fan_out(representative, unique, computed)
+
+    async def acompute(self, texts: list[str], model: str, embed_fn) -> list:
+        """
+        Asynchronous counterpart of compute, where embed_fn is a coroutine function.
+        """
+        representative, unique = self._plan(texts, model)
+        start = time.perf_counter()
+        computed = await embed_fn([texts[i] for i in unique])
+        self.embed_seconds += time.perf_counter() - start
+        return self._fan_out(representative, unique, computed)
+
+    def stats(self) -> dict:
+        """
+        Returns what deduplication saved since the Deduplicator was created.
+
+        Returns:
+            dict: Texts seen and embedded, exact and near duplicates, tokens embedded and saved, and the
+            embedding time saved, estimated from the measured seconds per embedded token.
+        """
+        seconds_per_token = self.embed_seconds / self.tokens_embedded if self.tokens_embedded else 0.0
+        return {
+            "texts": self.texts,
+            "embedded": self.embedded,
+            "exact_duplicates": self.exact_duplicates,
+            "near_duplicates": self.near_duplicates,
+            "tokens_embedded": self.tokens_embedded,
+            "tokens_saved": self.tokens_saved,
+            "seconds_saved": self.tokens_saved * seconds_per_token,
+        }
+
+    def _plan(self, texts, model):
+        normalized = [normalize_text(text) for text in texts]
+        exact = _exact_representatives(normalized)
+        representative = exact
+        if self.near:
+            representative = _near_representatives(normalized, exact, self.threshold, self.num_perm, self.bands,
+                                                   self.shingle_size)
+        is_unique = representative == np.arange(len(texts))
+        unique = np.flatnonzero(is_unique)
+
+        token_counts = _count_tokens(load_tokenizer(model), texts) if texts else np.zeros(0, dtype=np.int64)
+        self.texts += len(texts)
+        self.embedded += len(unique)
+        self.exact_duplicates += int((exact != np.arange(len(texts))).sum())
+        self.near_duplicates += int((~is_unique).sum() - (exact != np.arange(len(texts))).sum())
+        self.tokens_embedded += int(token_counts[is_unique].sum())
+        self.tokens_saved += int(token_counts[~is_unique].sum())
+        return representative, unique
+
+    @staticmethod
+    def _fan_out(representative, unique, computed):
+        position = {i: j for j, i in enumerate(unique)}
+        return [computed[position[i]] for i in representative]
+
+
+def _exact_representatives(normalized):
+    # the first occurrence represents the group
+    first = {}
+    return np.array([first.setdefault(hashlib.sha256(text.encode("utf-8")).digest(), i)
+                     for i, text in enumerate(normalized)], dtype=np.int64)
+
+
+def _near_representatives(normalized, representative, threshold, num_perm, bands, shingle_size):
+    unique = np.flatnonzero(representative == np.arange(len(normalized)))
+    signatures = minhash_signatures([normalized[i] for i in unique], num_perm, shingle_size)
+
+    # greedy leaders: each text joins the earliest leader it is similar to, or becomes a leader itself;
+    # comparing with the leader rather than any member keeps groups from chaining (A~B, B~C but not A~C)
+    rows = num_perm // bands
+    buckets = [{} for _ in range(bands)]
+    leader = np.arange(len(unique))
+    for i in range(len(unique)):
+        keys = [bytes(signatures[i, band * rows:(band + 1) * rows]) for band in range(bands)]
+        candidates = sorted({j for band, key in enumerate(keys) for j in buckets[band].get(key, ())})
+        for j in candidates:
+            if np.mean(signatures[i] == signatures[j]) >= threshold:
+                leader[i] = j
+                break
+        else:
+            for band, key in enumerate(keys):
+                buckets[band].setdefault(key, []).append(i)
+
+    roots = unique[leader]
+    return roots[np.searchsorted(unique, representative)]
+
+
+def _count_tokens(tokenizer, texts):
+    if hasattr(tokenizer, "encode_ordinary_batch"):
+        return np.array([len(tokens) for tokens in tokenizer.encode_ordinary_batch(texts)], dtype=np.int64)
+    # imported here so OpenAI-only pipelines do not need transformers
+    from embedding.models import count_model_tokens
+    return count_model_tokens(tokenizer, texts)
@@ -1,19 +1,35 @@
 #built-in modules
+import asyncio
+import concurrent.futures
+import hashlib
 import os
 import json
 import io 
+import logging
+import time
 
 #third-party libraries
 from azure.identity import DefaultAzureCredential
-from azure.storage.blob import BlobServiceClient, ContainerClient, BlobBlock, BlobClient, StandardBlobTier
+from azure.storage.blob import BlobServiceClient, ContainerClient, BlobClient
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient
 import pandas as pd
 from sentence_transformers import SentenceTransformer
 import tiktoken
 import torch
 
-from embedding.openai_functions import get_embeddings, count_tokens_list
+from embedding.blob_transfer import blob_content_md5, download_blob_cached, iter_json_array_bytes, upload_blob_blocks
+from embedding.cache import EmbeddingCache
+from embedding.clients import get_blob_service_client
+from embedding.dedup import Deduplicator
+from embedding.cpu_pool import CPUEncoderPool
+from embedding.models import count_model_tokens, get_sentence_transformer, plan_length_batches, resolve_device
+from embedding.checkpoint import EmbeddingCheckpoint, job_fingerprint
+from embedding.chunking import iter_chunks
+from embedding.metrics import PipelineMetrics, get_metrics
+from embedding.storage import save_embeddings
+from embedding.streaming import iter_blob_records, iter_windows
+from embedding.openai_functions import get_embeddings, aget_embeddings, count_tokens_each, count_tokens_list, dimensions_kwargs, plan_token_batches, EMBEDDING_MAX_BATCH_TOKENS
 
 # Load the .env file
 load_dotenv()
@@ -21,10 +37,16 @@ load_dotenv()
 # Access the variables 
 openai_key = os.getenv('openai_key')
 
+# Batch progress is logged at DEBUG, failed batches at WARNING and failed blob transfers at ERROR;
+# the timings go to embedding.metrics
+logger = logging.getLogger(__name__)
+
 
 def generate_embeddings(client, data_source: list[str], 
                         embedding_model="text-embedding-3-small", 
-                        batch_size=1000):
+                        batch_size=1000,
+                        max_tokens_per_batch=EMBEDDING_MAX_BATCH_TOKENS,
+                        dimensions=None):
     """
     Generates embeddings for a list of queries using the specified model and batch size.
 
@@ -32,40 +54,53 @@ def generate_embeddings(client, data_source: list[str],
         client: The API client used to make the embedding requests.
         data_source: List of strings for which embeddings will be generated.
         embedding_model: The model used to generate the embeddings (default is "text-embedding-3-small").
-        batch_size: The number of queries processed in each batch (default is 1000).
+        batch_size: The maximum number of queries processed in each batch (default is 1000).
+        max_tokens_per_batch: The maximum number of tokens sent in each batch (default is EMBEDDING_MAX_BATCH_TOKENS).
+        dimensions: The size of the returned embeddings, for text-embedding-3 models (default is the model's full size).
 
     Returns:
         List of generated embeddings.
     """
 
+    metrics = get_metrics()
+    batches, token_counts = _plan_openai_batches(data_source, embedding_model, max_tokens_per_batch, batch_size)
+
     embeddings = []
-    for batch_start in range(0, len(data_source), batch_size):
-        batch_end = batch_start + batch_size
-        batch = data_source[batch_start:batch_end]
-        print(f"Processing Batch {batch_start} to {batch_end-1}")
-        response = client.embeddings.create(model=embedding_model, input=batch)
-
-        # Double check embeddings are in the same order as input
-        for i, be in enumerate(response.data):
-            assert i == be.index
-
-        # Extract embeddings and add to the list
-        batch_embeddings = [e.embedding for e in response.data]
-        embeddings.extend(batch_embeddings)
+    with metrics.stage('embed'):
+        for batch_start, batch_end in batches:
+            batch = data_source[batch_start:batch_end]
+            logger.debug("Processing batch %d to %d", batch_start, batch_end - 1)
+            start = time.perf_counter()
+            response = client.embeddings.create(model=embedding_model, input=batch, **dimensions_kwargs(dimensions))
+            metrics.record_batch('embed', time.perf_counter() - start, items=len(batch),
+                                 tokens=sum(token_counts[batch_start:batch_end]), batch_start=batch_start)
+
+            # Double check embeddings are in the same order as input
+            for i, be in enumerate(response.data):
+                assert i == be.index
+
+            # Extract embeddings and add to the list
+            batch_embeddings = [e.embedding for e in response.data]
+            embeddings.extend(batch_embeddings)
 
     return embeddings
 
 def load_data(path: str):
-    with open(path, 'r', encoding='utf-8') as file:
-        return json.load(file)
+    with get_metrics().stage('parse', bytes=os.path.getsize(path)) as stage:
+        with open(path, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+        stage.add(items=len(data))
+    return data
 
 def save_data(data, output_path):
     # output_path = os.path.join("..", "..", "..", "data", "docVectors-e5.json")
-    with open(output_path, "w") as f:
-        json.dump(data, f)
+    with get_metrics().stage('serialize', items=len(data)) as stage:
+        with open(output_path, "w") as f:
+            json.dump(data, f)
+        stage.add(bytes=os.path.getsize(output_path))
 
 
-def download_blob_content(account_url, container_name, blob_name):
+def download_blob_content(account_url, container_name, blob_name, max_concurrency=8, credential=None):
     """
     Downloads the content of a blob from Azure Blob Storage.
     
@@ -73,24 +108,27 @@ def download_blob_content(account_url, container_name, blob_name):
         account_url (str): The URL of the Azure storage account.
         container_name (str): The name of the container where the blob resides.
         blob_name (str): The name of the blob to download.
+        max_concurrency (int): The number of ranges downloaded in parallel (default is 8).
+        credential: The credential for the storage account (default is the shared credential from embedding.clients).
     
     Returns:
         bytes: The content of the blob as a bytes object.
     """
     try:
-        # Initialize the credential and BlobServiceClient
-        credential = DefaultAzureCredential()
-        blob_service_client = BlobServiceClient(account_url, credential=credential)
+        # Get the shared BlobServiceClient
+        blob_service_client = get_blob_service_client(account_url, credential)
         
         # Get the blob client
         blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
         
         # Download and return the blob content
-        blob_content = blob_client.download_blob().readall()
+        with get_metrics().stage('download') as stage:
+            blob_content = blob_client.download_blob(max_concurrency=max_concurrency).readall()
+            stage.add(bytes=len(blob_content))
         return blob_content
 
     except Exception as e:
-        print(f"An error occurred: {e}")
+        logger.error("Could not download %s: %s", blob_name, e)
         return None
 
 
@@ -105,48 +143,72 @@ def parse_blob_content_to_json(blob_content):
         dict: The parsed JSON data as a Python dictionary.
     """
     try:
-        # Create a file-like object from the bytes
-        data = io.BytesIO(blob_content)
-        
-        # Load and return JSON data
-        json_data = json.load(data)
+        with get_metrics().stage('parse', bytes=len(blob_content)) as stage:
+            # Create a file-like object from the bytes
+            data = io.BytesIO(blob_content)
+
+            # Load and return JSON data
+            json_data = json.load(data)
+            stage.add(items=len(json_data))
         return json_data
 
     except json.JSONDecodeError as e:
-        print(f"Error decoding JSON: {e}")
+        logger.error("Error decoding JSON: %s", e)
         return None
     except Exception as e:
-        print(f"An error occurred: {e}")
+        logger.error("Could not parse the blob content: %s", e)
         return None
 
 
-def populate_openai_embeddings(data_source: list[dict], model_name: str, key: str='text', batch_size: int=1000):
+def populate_openai_embeddings(data_source: list[dict], model_name: str, key: str='text', batch_size: int=1000, max_in_flight: int=8,
+                               max_tokens_per_batch: int=EMBEDDING_MAX_BATCH_TOKENS, cache: EmbeddingCache=None,
+                               checkpoint_dir: str=None, dimensions: int=None, dedup: Deduplicator=None):
     """
     Populates the initial JSON object with embeddings generated through the previous function.
 
+    Batches are sent concurrently through the asyncio engine (see agenerate_openai_embeddings),
+    keeping up to max_in_flight requests open at the same time.
+
     Args:
         data_source (list[dict]): A list of dictionaries containing the data for which embeddings will be generated.
-        model_name (str): The Hugging Face model used to generate the embeddings.
+        model_name (str): The OpenAI model used to generate the embeddings.
         key (str, optional): The key in the dictionaries whose corresponding values will be used for generating embeddings. Defaults to 'text'.
-        batch_size (int, optional): The number of items processed in each batch. Defaults to 1000.
+        batch_size (int, optional): The maximum number of items processed in each batch. Defaults to 1000.
+        max_in_flight (int, optional): The maximum number of batches awaiting a response at any time. Defaults to 8.
+        max_tokens_per_batch (int, optional): The maximum number of tokens sent in each batch. Defaults to EMBEDDING_MAX_BATCH_TOKENS.
+        cache (EmbeddingCache, optional): A cache consulted before calling the API. Defaults to None.
+        checkpoint_dir (str, optional): A directory where finished batches are checkpointed so an interrupted run can resume. Defaults to None.
+        dimensions (int, optional): The size of the returned embeddings, for text-embedding-3 models. Defaults to the model's full size.
+        dedup (Deduplicator, optional): Embeds one text per group of duplicates and copies its vector to the others. Defaults to None.
 
     Returns:
         list[dict]: The updated data source with embeddings.
     """
-    embeddings = generate_openai_embeddings(data_source, model_name, key, batch_size)
-    for i, embedding in enumerate(embeddings):
+    embeddings = run_async(agenerate_openai_embeddings(data_source, model_name, key, batch_size, max_in_flight,
+                                                       max_tokens_per_batch, cache, checkpoint_dir, dimensions, dedup))
+
+    # records without the key were skipped when extracting the texts
+    indices = [i for i, elem in enumerate(data_source) if key in elem]
+    for i, embedding in zip(indices, embeddings):
         data_source[i]['embedding'] = embedding
     return data_source
 
 
-def generate_openai_embeddings(data_source: list[dict], model_name: str, key: str='text', batch_size: int=1000):
+def generate_openai_embeddings(data_source: list[dict], model_name: str, key: str='text', batch_size: int=1000,
+                               max_tokens_per_batch: int=EMBEDDING_MAX_BATCH_TOKENS, cache: EmbeddingCache=None,
+                               checkpoint_dir: str=None, dimensions: int=None, dedup: Deduplicator=None):
     """         
     Function Signature:
 
     data_source: A list of dictionaries containing the data.
     model_name: The name of the model to be used for generating embeddings (though it is not used in the current implementation).
     key: The key in the dictionaries whose values are the text data to be embedded (default is 'text').
-    batch_size: The number of items to process in each batch (default is 1000).
+    batch_size: The maximum number of items to process in each batch (default is 1000).
+    max_tokens_per_batch: The maximum number of tokens to send in each batch (default is EMBEDDING_MAX_BATCH_TOKENS).
+    cache: An optional EmbeddingCache; when given, only the texts missing from it are sent to the API.
+    checkpoint_dir: An optional directory where each finished batch is checkpointed (see EmbeddingCheckpoint).
+    dimensions: The size of the returned embeddings for text-embedding-3 models (default is the model's full size).
+    dedup: An optional Deduplicator; when given, one text per group of duplicates is embedded and its vector copied to the others.
     Extract Texts:
 
     The function extracts the values corresponding to the specified key from each dictionary in the data_source. This is done using a list comprehension: [elem[key] for elem in data_source if key in elem].
@@ -155,85 +217,458 @@ def generate_openai_embeddings(data_source: list[dict], model_name: str, key: st
     An empty list embeddings is initialized to store the generated embeddings.
     Process in Batches:
 
-    The function processes the extracted texts in batches of size batch_size.
+    The function processes the extracted texts in batches planned by plan_token_batches, each holding
+    at most batch_size items and max_tokens_per_batch tokens.
     For each batch, it slices the extracted_texts list to get the current batch.
     It then attempts to generate embeddings for the current batch using a function get_embeddings(batch).
     If an error occurs during the embedding generation, it appends a list of None values (one for each item in the batch) to the embeddings list.
+    Blank texts (such as the empty chunk of an empty record) are not sent to the API and get None as well.
+    Checkpoints:
+
+    When checkpoint_dir is given, every successful batch is saved to disk and every failed batch is recorded.
+    Running the same job again loads the finished batches from disk and only retries the missing or failed ones.
     Return Embeddings:
 
     Finally, the function returns the list of embeddings.
     
     """
-    client = OpenAI(api_key=openai_key)
+    client = OpenAI(api_key=openai_key, http_client=_openai_http_client())
+    metrics = get_metrics()
     
     #Extract the values corresponding to the specified key
     extracted_texts = [elem[key] for elem in data_source if key in elem]
 
-    #store embeddings
+    def embed(texts):
+        checkpoint = None
+        if checkpoint_dir is not None:
+            checkpoint = EmbeddingCheckpoint(checkpoint_dir, job_fingerprint(texts, model_name, batch_size=batch_size,
+                                                                             max_tokens_per_batch=max_tokens_per_batch,
+                                                                             dimensions=dimensions))
+
+        #store embeddings
+        embeddings = []
+
+        #Process in batches
+        batches, token_counts = _plan_openai_batches(texts, model_name, max_tokens_per_batch, batch_size)
+        metrics.expect('embed', len(texts))
+        with metrics.stage('embed'):
+            for batch_start, batch_end in batches:
+                if checkpoint is not None and checkpoint.is_done(batch_start, batch_end):
+                    embeddings.extend(checkpoint.load(batch_start, batch_end))
+                    metrics.add('embed', items=batch_end - batch_start)
+                    continue
+                batch = texts[batch_start:batch_end]
+                start = time.perf_counter()
+                try: 
+                    batch_embeddings = get_embeddings(batch, client, model= model_name, **dimensions_kwargs(dimensions))
+                except Exception as e:
+                    logger.warning("Batch %d to %d failed: %s", batch_start, batch_end - 1, e)
+                    metrics.record_batch('embed', time.perf_counter() - start, items=len(batch), failed=True,
+                                         batch_start=batch_start, error=str(e))
+                    if checkpoint is not None:
+                        checkpoint.mark_failed(batch_start, batch_end)
+                    embeddings.extend([None] * len(batch))
+                    continue
+                metrics.record_batch('embed', time.perf_counter() - start, items=len(batch),
+                                     tokens=sum(token_counts[batch_start:batch_end]), batch_start=batch_start)
+                if checkpoint is not None:
+                    checkpoint.save(batch_start, batch_end, batch_embeddings)
+                embeddings.extend(batch_embeddings)
+        return embeddings
+
+    def embed_missing(texts):
+        # only cache misses are planned into batches and sent to the API
+        if cache is not None:
+            return cache.get_or_compute(texts, model_name, embed, dimensions)
+        return embed(texts)
+
+    def embed_all(texts):
+        if dedup is not None:
+            return dedup.compute(texts, model_name, embed_missing)
+        return embed_missing(texts)
+
+    return _embed_non_blank(extracted_texts, embed_all)
+
+
+async def agenerate_embeddings(client: AsyncOpenAI, data_source: list[str], 
+                               embedding_model="text-embedding-3-small", 
+                               batch_size=1000,
+                               max_in_flight=8,
+                               max_tokens_per_batch=EMBEDDING_MAX_BATCH_TOKENS,
+                               dimensions=None):
+    """
+    Asynchronous counterpart of generate_embeddings that keeps several batches in flight.
+
+    Args:
+        client (AsyncOpenAI): The async API client used to make the embedding requests.
+        data_source: List of strings for which embeddings will be generated.
+        embedding_model: The model used to generate the embeddings (default is "text-embedding-3-small").
+        batch_size: The maximum number of queries processed in each batch (default is 1000).
+        max_in_flight: The maximum number of batches awaiting a response at any time (default is 8).
+        max_tokens_per_batch: The maximum number of tokens sent in each batch (default is EMBEDDING_MAX_BATCH_TOKENS).
+        dimensions: The size of the returned embeddings, for text-embedding-3 models (default is the model's full size).
+
+    Returns:
+        List of generated embeddings, in the same order as data_source.
+    """
+    semaphore = asyncio.Semaphore(max_in_flight)
+    metrics = get_metrics()
+
+    async def embed_batch(batch_start, batch_end):
+        async with semaphore:
+            logger.debug("Processing batch %d to %d", batch_start, batch_end - 1)
+            start = time.perf_counter()
+            batch_embeddings = await aget_embeddings(data_source[batch_start:batch_end], model=embedding_model,
+                                                     client=client, **dimensions_kwargs(dimensions))
+            metrics.record_batch('embed', time.perf_counter() - start, items=batch_end - batch_start,
+                                 tokens=sum(token_counts[batch_start:batch_end]), batch_start=batch_start)
+            return batch_embeddings
+
+    # gather returns the results in submission order, whatever order the responses arrive in
+    batches, token_counts = _plan_openai_batches(data_source, embedding_model, max_tokens_per_batch, batch_size)
+    with metrics.stage('embed'):
+        results = await asyncio.gather(*[embed_batch(batch_start, batch_end) for batch_start, batch_end in batches])
+
     embeddings = []
+    for batch_embeddings in results:
+        embeddings.extend(batch_embeddings)
+    return embeddings
 
-    #Process in batches
-    for batch_start in range(0, len(data_source), batch_size):
-        batch_end = batch_start + batch_size
-        batch = extracted_texts[batch_start:batch_end]
-        try: 
-            embeddings.extend(get_embeddings(batch, client, model= model_name))
-        except: 
-            embeddings.extend([[None] for _ in range(batch_size)])
-    
+
+async def agenerate_openai_embeddings(data_source: list[dict], model_name: str, key: str='text', batch_size: int=1000, max_in_flight: int=8,
+                                      max_tokens_per_batch: int=EMBEDDING_MAX_BATCH_TOKENS, cache: EmbeddingCache=None,
+                                      checkpoint_dir: str=None, dimensions: int=None, dedup: Deduplicator=None):
+    """
+    Generates OpenAI embeddings for a list of dictionaries, keeping up to max_in_flight batches in flight.
+
+    A batch that fails (after the client's own retries) is replaced by one None per item, so the
+    output stays aligned with the input. Blank texts, such as the empty chunk of an empty record,
+    are not sent and get None as well. With checkpoint_dir, finished batches are saved to disk and
+    a restarted job only sends the batches that are missing or failed.
+
+    Args:
+        data_source (list[dict]): A list of dictionaries containing the data for which embeddings will be generated.
+        model_name (str): The OpenAI model used to generate the embeddings.
+        key (str, optional): The key in the dictionaries whose corresponding values will be embedded. Defaults to 'text'.
+        batch_size (int, optional): The maximum number of items processed in each batch. Defaults to 1000.
+        max_in_flight (int, optional): The maximum number of batches awaiting a response at any time. Defaults to 8.
+        max_tokens_per_batch (int, optional): The maximum number of tokens sent in each batch. Defaults to EMBEDDING_MAX_BATCH_TOKENS.
+        cache (EmbeddingCache, optional): A cache consulted before calling the API. Defaults to None.
+        checkpoint_dir (str, optional): A directory where finished batches are checkpointed. Defaults to None.
+        dimensions (int, optional): The size of the returned embeddings, for text-embedding-3 models. Defaults to the model's full size.
+        dedup (Deduplicator, optional): Embeds one text per group of duplicates and copies its vector to the others. Defaults to None.
+
+    Returns:
+        List of generated embeddings, in the same order as the records that contain key.
+    """
+    client = AsyncOpenAI(api_key=openai_key, max_retries=5, http_client=_openai_http_client(asynchronous=True))
+    metrics = get_metrics()
+
+    #Extract the values corresponding to the specified key
+    extracted_texts = [elem[key] for elem in data_source if key in elem]
+
+    semaphore = asyncio.Semaphore(max_in_flight)
+
+    async def embed_batch(texts, batch_start, batch_end, checkpoint, token_counts):
+        if checkpoint is not None and checkpoint.is_done(batch_start, batch_end):
+            metrics.add('embed', items=batch_end - batch_start)
+            return checkpoint.load(batch_start, batch_end)
+        batch = texts[batch_start:batch_end]
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                batch_embeddings = await aget_embeddings(batch, model=model_name, client=client,
+                                                         **dimensions_kwargs(dimensions))
+            except Exception as e:
+                logger.warning("Batch %d to %d failed: %s", batch_start, batch_end - 1, e)
+                metrics.record_batch('embed', time.perf_counter() - start, items=len(batch), failed=True,
+                                     batch_start=batch_start, error=str(e))
+                if checkpoint is not None:
+                    checkpoint.mark_failed(batch_start, batch_end)
+                return [None] * len(batch)
+            metrics.record_batch('embed', time.perf_counter() - start, items=len(batch),
+                                 tokens=sum(token_counts[batch_start:batch_end]), batch_start=batch_start)
+        if checkpoint is not None:
+            checkpoint.save(batch_start, batch_end, batch_embeddings)
+        return batch_embeddings
+
+    async def embed(texts):
+        checkpoint = None
+        if checkpoint_dir is not None:
+            checkpoint = EmbeddingCheckpoint(checkpoint_dir, job_fingerprint(texts, model_name, batch_size=batch_size,
+                                                                             max_tokens_per_batch=max_tokens_per_batch,
+                                                                             dimensions=dimensions))
+        batches, token_counts = _plan_openai_batches(texts, model_name, max_tokens_per_batch, batch_size)
+        metrics.expect('embed', len(texts))
+        with metrics.stage('embed'):
+            results = await asyncio.gather(*[embed_batch(texts, batch_start, batch_end, checkpoint, token_counts)
+                                             for batch_start, batch_end in batches])
+        embeddings = []
+        for batch_embeddings in results:
+            embeddings.extend(batch_embeddings)
+        return embeddings
+
+    async def embed_missing(texts):
+        # only cache misses are planned into batches and sent to the API
+        if cache is not None:
+            return await cache.aget_or_compute(texts, model_name, embed, dimensions)
+        return await embed(texts)
+
+    async def embed_all(texts):
+        if dedup is not None:
+            return await dedup.acompute(texts, model_name, embed_missing)
+        return await embed_missing(texts)
+
+    try:
+        return await _aembed_non_blank(extracted_texts, embed_all)
+    finally:
+        await client.close()
+
+
+def run_async(coroutine):
+    """
+    Runs a coroutine to completion from synchronous code.
+
+    When an event loop is already running in this thread (e.g. inside a Jupyter notebook) the
+    coroutine is run on a fresh loop in a worker thread instead.
+
+    Args:
+        coroutine: The coroutine to run.
+
+    Returns:
+        The value returned by the coroutine.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+
+def _plan_openai_batches(texts, model_name, max_tokens_per_batch, batch_size):
+    # the token counts are kept to report the tokens of each batch
+    with get_metrics().stage('tokenize', items=len(texts)) as stage:
+        token_counts = count_tokens_each(texts, model_name)
+        stage.add(tokens=sum(token_counts))
+    return plan_token_batches(texts, model_name, max_tokens_per_batch, batch_size, token_counts), token_counts
+
+
+def _embed_non_blank(texts, embed):
+    # blank texts, such as the placeholder chunk of an empty record (n_tokens 0), get a None embedding:
+    # the OpenAI endpoint rejects empty input, which would fail every record of the batch
+    indices = [i for i, text in enumerate(texts) if text.strip()]
+    embeddings = [None] * len(texts)
+    if indices:
+        for i, embedding in zip(indices, embed([texts[i] for i in indices])):
+            embeddings[i] = embedding
+    return embeddings
+
+
+async def _aembed_non_blank(texts, embed):
+    indices = [i for i, text in enumerate(texts) if text.strip()]
+    embeddings = [None] * len(texts)
+    if indices:
+        for i, embedding in zip(indices, await embed([texts[i] for i in indices])):
+            embeddings[i] = embedding
     return embeddings
 
 
-def generate_huggingface_embeddings(data_source: list[dict], model_name: str, key: str='text', batch_size: int=1000):
+def _openai_http_client(asynchronous=False):
+    # count the retried requests only while metrics are being recorded
+    metrics = get_metrics()
+    if not metrics.enabled:
+        return None
+    http_client = DefaultAsyncHttpxClient if asynchronous else DefaultHttpxClient
+    return http_client(event_hooks={'response': [metrics.response_hook('embed', asynchronous)]})
+
+
+def generate_huggingface_embeddings(data_source: list[dict], model_name: str, key: str='text', batch_size: int=1000,
+                                    cache: EmbeddingCache=None, model: SentenceTransformer=None, device: str=None,
+                                    n_workers: int=1, pool: CPUEncoderPool=None, max_tokens_per_batch: int=16384,
+                                    dedup: Deduplicator=None, model_kwargs: dict=None):
     """
     Generates embeddings for a list of dictionaries using a specified Hugging Face model and batch size.
+
+    Texts are grouped by token length into batches of at most max_tokens_per_batch padded tokens
+    (see plan_length_batches), so short chunks are not padded to the length of a long ruling, and
+    the embeddings are put back in the order of the input.
+
+    On CPU-only machines the batches can be spread over several worker processes (see CPUEncoderPool),
+    each pinned to its own cores; the weights default to bfloat16 or float32 there instead of float16.
+
     Args:
         data_source (list[dict]): A list of dictionaries containing the data for which embeddings will be generated.
         model_name (SentenceTransformer): The Hugging Face model used to generate the embeddings.
         key (str, optional): The key in the dictionaries whose corresponding values will be used for generating embeddings. Defaults to 'text'.
-        batch_size (int, optional): The number of items processed in each batch. Defaults to 1000.
+        batch_size (int, optional): The maximum number of items processed in each batch. Defaults to 1000.
+        cache (EmbeddingCache, optional): A cache consulted before running the model. Defaults to None.
+        model (SentenceTransformer, optional): An already loaded model to reuse instead of loading model_name. Defaults to None.
+        max_tokens_per_batch (int, optional): The maximum number of padded tokens in each batch. Defaults to 16384.
+        device (str, optional): 'cuda' or 'cpu'. Defaults to 'cuda' when available.
+        n_workers (int, optional): The number of CPU worker processes; values above 1 start a CPUEncoderPool for this call. Defaults to 1.
+        pool (CPUEncoderPool, optional): An already started pool to reuse, e.g. across the windows of a stream. Defaults to None.
+        dedup (Deduplicator, optional): Embeds one text per group of duplicates and copies its vector to the others. Defaults to None.
+        model_kwargs (dict, optional): Other SentenceTransformer arguments (e.g. trust_remote_code=True), used to load
+            the model here or in the CPUEncoderPool workers. Defaults to None.
         list: A list of generated embeddings. If an error occurs during processing, None is returned for the corresponding batch.
 
     Returns:
         List of generated embeddings.
     """
-    #Initialize the model 
-    model = SentenceTransformer(model_name, model_kwargs={"torch_dtype": torch.float16})
-    
+    device = resolve_device(device)
+    model_kwargs = model_kwargs or {}
+    own_pool = pool is None and n_workers > 1 and device == 'cpu'
+    if own_pool:
+        pool = CPUEncoderPool(model_name, n_workers=n_workers, **model_kwargs)
+
+    #Reuse the model if this process has already loaded it
+    if model is None and pool is None:
+        model = get_sentence_transformer(model_name, device=device, **model_kwargs)
+
 
     #Extract the values corresponding to the specified key
     extracted_texts = [elem[key] for elem in data_source if key in elem]
 
-    #store embeddings
-    embeddings = []
+    metrics = get_metrics()
+
+    def embed(texts):
+        #store embeddings at the original position of each text
+        embeddings = [None] * len(texts)
+
+        #Group texts of similar length
+        with metrics.stage('tokenize', items=len(texts)) as stage:
+            if pool is not None:
+                # the workers count with their model's tokenizer, truncated at its max_seq_length
+                token_counts = pool.count_tokens(texts)
+            else:
+                token_counts = count_model_tokens(model.tokenizer, texts, model.max_seq_length)
+            stage.add(tokens=int(token_counts.sum()))
+        batches = plan_length_batches(token_counts, max_tokens_per_batch, batch_size)
+        metrics.expect('embed', len(texts))
+
+        #Encode the batches in the worker processes
+        if pool is not None:
+            with metrics.stage('embed'):
+                start = time.perf_counter()
+                for batch_indices, response in zip(batches, pool.imap([[texts[i] for i in batch_indices] for batch_indices in batches])):
+                    logger.debug("Processing batch of %d texts of up to %d tokens", len(batch_indices),
+                                 token_counts[batch_indices[-1]])
+                    # the workers encode several batches at once, so this is the time between results
+                    metrics.record_batch('embed', time.perf_counter() - start, items=len(batch_indices),
+                                         tokens=int(token_counts[batch_indices].sum()), failed=response is None)
+                    start = time.perf_counter()
+                    if response is not None:
+                        for i, embedding in zip(batch_indices, response.tolist()):
+                            embeddings[i] = embedding
+            return embeddings
+
+        #Process in batches
+        with metrics.stage('embed'):
+            for batch_indices in batches:
+                batch = [texts[i] for i in batch_indices]
+                logger.debug("Processing batch of %d texts of up to %d tokens", len(batch), token_counts[batch_indices[-1]])
+                start = time.perf_counter()
+                try:
+                    response = model.encode(batch, batch_size=len(batch))
+                    batch_embeddings = response.tolist()
+                    for i, embedding in zip(batch_indices, batch_embeddings):
+                        embeddings[i] = embedding
+                    metrics.record_batch('embed', time.perf_counter() - start, items=len(batch),
+                                         tokens=int(token_counts[batch_indices].sum()))
+                except Exception as e:
+                    logger.warning("Batch of %d texts failed: %s", len(batch), e)
+                    metrics.record_batch('embed', time.perf_counter() - start, items=len(batch), failed=True,
+                                         indices=batch_indices.tolist(), error=str(e))
+                finally:
+                    #free GPU memory if applicable
+                    if model.device.type == 'cuda':
+                        torch.cuda.empty_cache()
+
+        return embeddings
+
+    def embed_missing(texts):
+        # only cache misses are encoded by the model
+        if cache is not None:
+            return cache.get_or_compute(texts, model_name, embed)
+        return embed(texts)
+
+    def embed_all(texts):
+        if dedup is not None:
+            return dedup.compute(texts, model_name, embed_missing)
+        return embed_missing(texts)
 
-    #Process in batches
-    for batch_start in range(0, len(data_source), batch_size):
-        batch_end = batch_start + batch_size
-        batch = extracted_texts[batch_start:batch_end]
-        print(f"Processing Batch {batch_start} to {batch_end-1}")
-        print(batch)
-        try:
-          response = model.encode(batch)
-          print('a')
-          batch_embeddings = response.tolist()
-          print('b')
-          embeddings.extend(batch_embeddings)
-          print('succeded encoding')
-        except:
-          print('error encoding')
-          embeddings.extend([None] * batch_size)
-        #   pending_indices.extend(range(batch_start, batch_end))
-          print('------',  range(batch_start, batch_end))
-        finally:
-            #free GPU memory if applicable
-            torch.cuda.empty_cache()
-            print('finally')
+    try:
+        return _embed_non_blank(extracted_texts, embed_all)
+    finally:
+        if own_pool:
+            pool.close()
 
-    return embeddings
+
+def stream_openai_embeddings(records, model_name: str, key: str='text', window_size: int=10000, **kwargs):
+    """
+    Embeds a stream of records with OpenAI, holding at most window_size records in memory.
+
+    Records are read in windows (for example from embedding.streaming.iter_blob_records), each window
+    is embedded with populate_openai_embeddings and its records are yielded before the next window is read.
+
+    Args:
+        records: An iterable of dictionaries, such as the output of iter_blob_records or iter_file_records.
+        model_name (str): The OpenAI model used to generate the embeddings.
+        key (str, optional): The key in the dictionaries whose values will be embedded. Defaults to 'text'.
+        window_size (int, optional): The number of records embedded and held in memory at a time. Defaults to 10000.
+        **kwargs: Any other argument accepted by populate_openai_embeddings (batch_size, max_in_flight, cache, dimensions...).
+
+    Yields:
+        dict: The records, in order, with their 'embedding' populated.
+    """
+    for window in iter_windows(records, window_size):
+        yield from populate_openai_embeddings(window, model_name, key, **kwargs)
 
 
-def upload_blob_content(data: json, account_url: str, container_name: str, blob_name: str):
+def stream_huggingface_embeddings(records, model_name: str, key: str='text', window_size: int=10000, **kwargs):
+    """
+    Embeds a stream of records with a Hugging Face model, holding at most window_size records in memory.
+
+    The model is taken from the process-wide registry (embedding.models) and reused for every window;
+    with n_workers above 1 on a CPU-only machine, one CPUEncoderPool is started for the whole stream.
+
+    Args:
+        records: An iterable of dictionaries, such as the output of iter_blob_records or iter_file_records.
+        model_name (str): The Hugging Face model used to generate the embeddings.
+        key (str, optional): The key in the dictionaries whose values will be embedded. Defaults to 'text'.
+        window_size (int, optional): The number of records embedded and held in memory at a time. Defaults to 10000.
+        **kwargs: Any other argument accepted by generate_huggingface_embeddings (batch_size, cache, device, n_workers, model_kwargs...).
+
+    Yields:
+        dict: The records, in order, with their 'embedding' populated.
+    """
+    device = resolve_device(kwargs.pop('device', None))
+    n_workers = kwargs.pop('n_workers', 1)
+    pool = kwargs.pop('pool', None)
+    model_kwargs = kwargs.get('model_kwargs') or {}
+    own_pool = pool is None and n_workers > 1 and device == 'cpu'
+    if own_pool:
+        pool = CPUEncoderPool(model_name, n_workers=n_workers, **model_kwargs)
+    model = kwargs.pop('model', None)
+    if model is None and pool is None:
+        model = get_sentence_transformer(model_name, device=device, **model_kwargs)
+
+    try:
+        for window in iter_windows(records, window_size):
+            embeddings = generate_huggingface_embeddings(window, model_name, key, model=model, device=device,
+                                                         pool=pool, **kwargs)
+            indices = [i for i, elem in enumerate(window) if key in elem]
+            for i, embedding in zip(indices, embeddings):
+                window[i]['embedding'] = embedding
+            yield from window
+    finally:
+        if own_pool:
+            pool.close()
+
+
+def upload_blob_content(data: json, account_url: str, container_name: str, blob_name: str, credential=None):
     """
     Downloads the content of a blob from Azure Blob Storage.
     
@@ -241,24 +676,37 @@ def upload_blob_content(data: json, account_url: str, container_name: str, blob_
         account_url (str): The URL of the Azure storage account.
         container_name (str): The name of the container where the blob resides.
         blob_name (str): The name of the blob to download.
+        credential: The credential for the storage account (default is the shared credential from embedding.clients).
     
     Returns:
         bytes: The content of the blob as a bytes object.
     """
     try:
-        # Initialize the credential and BlobServiceClient
-        credential = DefaultAzureCredential()
-        blob_service_client = BlobServiceClient(account_url, credential=credential)
+        # Get the shared BlobServiceClient
+        blob_service_client = get_blob_service_client(account_url, credential)
+
+        # Skip the upload when the blob already holds the same content
+        if not isinstance(data, (str, bytes)):
+            with get_metrics().stage('serialize', items=len(data)) as stage:
+                data = json.dumps(data)
+                stage.add(bytes=len(data))
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
+        if blob_content_md5(blob_client) == hashlib.md5(data).digest():
+            logger.info("%s is up to date, skipping upload", blob_name)
+            return None
 
         # Get the client for the container
         container_client = blob_service_client.get_container_client(container=container_name)
 
         # Upload  the blob content
-        container_client.upload_blob(name=blob_name, data=data, overwrite=True)
+        with get_metrics().stage('upload', bytes=len(data)):
+            container_client.upload_blob(name=blob_name, data=data, overwrite=True)
         
 
     except Exception as e:
-        print(f"An error occurred: {e}")
+        logger.error("Could not upload %s: %s", blob_name, e)
         return None
 
 
@@ -278,7 +726,7 @@ def main0():
 
     # ！The default dimension is 1024, if you need other dimensions, please clone the model and modify `modules.json` to replace `2_Dense_1024` with another dimension, e.g. `2_Dense_256` or `2_Dense_8192` !
     # on gpu
-    model = SentenceTransformer("dunzhang/stella_en_400M_v5", trust_remote_code=True).cuda()
+    model = get_sentence_transformer("dunzhang/stella_en_400M_v5", device="cuda", dtype="float32", trust_remote_code=True)
     # you can also use this model without the features of `use_memory_efficient_attention` and `unpad_inputs`. It can be worked in CPU.
     # model = SentenceTransformer(
     #     "dunzhang/stella_en_400M_v5",
@@ -340,47 +788,65 @@ def main3():
 
 
 def main4():
-    data = download_blob_content(account_url="https://lawgorithm.blob.core.windows.net", 
-                          container_name='jurisprudencia-chunked-text', 
-                          blob_name='jurisprudencia_2023_muestra.json')
-    print('1')
-    data=parse_blob_content_to_json(data)
-    print('2')
-    data=populate_embeddings(data_source=data, 
-                            model_name="BAAI/bge-multilingual-gemma2",
-                            key='text',
-                            batch_size=10)
-    print('3')
-    for elem in data:
-        print(elem.keys())
-    upload_blob_content(data,
-                        account_url="https://lawgorithm.blob.core.windows.net",
-                        container_name='jurisprudencia-embeddings', 
-                        blob_name='prueba')
+    # per-stage timings go to metrics.jsonl and metrics.prom
+    with PipelineMetrics(log_path='metrics.jsonl', prometheus_path='metrics.prom') as metrics:
+        path = download_blob_cached(account_url="https://lawgorithm.blob.core.windows.net", 
+                                    container_name='jurisprudencia-chunked-text', 
+                                    blob_name='jurisprudencia_2023_muestra.json')
+        data=load_data(path)
+        data=populate_embeddings(data_source=data, 
+                                model_name="BAAI/bge-multilingual-gemma2",
+                                key='text',
+                                batch_size=10)
+        upload_blob_content(data,
+                            account_url="https://lawgorithm.blob.core.windows.net",
+                            container_name='jurisprudencia-embeddings', 
+                            blob_name='prueba')
+    print(json.dumps(metrics.snapshot(), indent=2))
 
 def main5():
-    data = download_blob_content(account_url="https://lawgorithm.blob.core.windows.net", 
-                          container_name='jurisprudencia-chunked-text', 
-                          blob_name='jurisprudencia_2023.json')
-    print('1')
-    data=parse_blob_content_to_json(data)
-    print('2')
-    # extracted_texts = [elem['text'] for elem in data if 'text' in elem]
-    # print(count_tokens_list(extracted_texts)*(0.02/1000000))
-
-    # data = data[:100]
-    data=populate_openai_embeddings(data_source=data, 
-                            model_name="text-embedding-3-large",
-                            key='text',
-                            batch_size=200)
-    print('3')
-    # with open('output.json', 'w', encoding='utf-8') as f:
-    #     json.dump(data, f, ensure_ascii=False, indent=4)
-    data = json.dumps(data)
-    upload_blob_content(data,
-                        account_url="https://lawgorithm.blob.core.windows.net",
-                        container_name='jurisprudencia-embeddings', 
-                        blob_name='jurisprudencia-embeddings_openai_large-2023.json')
+    # reuse the local copy when the blob has not changed since the last run
+    # per-stage timings go to metrics.jsonl, and to http://localhost:9100/metrics while the job runs
+    with PipelineMetrics(log_path='metrics.jsonl', prometheus_path='metrics.prom') as metrics:
+        metrics.serve(9100)
+        path = download_blob_cached(account_url="https://lawgorithm.blob.core.windows.net", 
+                                    container_name='jurisprudencia-chunked-text', 
+                                    blob_name='jurisprudencia_2023.json')
+        data=load_data(path)
+        # extracted_texts = [elem['text'] for elem in data if 'text' in elem]
+        # print(count_tokens_list(extracted_texts)*(0.02/1000000))
+
+        # data = data[:100]
+        data=populate_openai_embeddings(data_source=data, 
+                                model_name="text-embedding-3-large",
+                                key='text',
+                                batch_size=200,
+                                checkpoint_dir='checkpoints')
+        # with open('output.json', 'w', encoding='utf-8') as f:
+        #     json.dump(data, f, ensure_ascii=False, indent=4)
+        # serialize record by record and stage the blocks in parallel instead of building one string
+        upload_blob_blocks(iter_json_array_bytes(data),
+                           account_url="https://lawgorithm.blob.core.windows.net",
+                           container_name='jurisprudencia-embeddings', 
+                           blob_name='jurisprudencia-embeddings_openai_large-2023.json',
+                           max_concurrency=8)
+    print(json.dumps(metrics.snapshot(), indent=2))
+
+def main6():
+    # stream the corpus, embed it window by window and store the vectors in the binary format
+    records = iter_blob_records(account_url="https://lawgorithm.blob.core.windows.net", 
+                                container_name='jurisprudencia-chunked-text', 
+                                blob_name='jurisprudencia_2023.json')
+    # split long rulings so every request fits the model's input limit
+    records = iter_chunks(records, model_name="text-embedding-3-large", max_tokens=1024, overlap=128, n_workers=4)
+    records = stream_openai_embeddings(records, 
+                                       model_name="text-embedding-3-large",
+                                       key='text',
+                                       batch_size=200,
+                                       checkpoint_dir='checkpoints')
+    count = save_embeddings(records, 'jurisprudencia-embeddings_openai_large-2023', dtype='float32')
+    print(f"Saved {count} embeddings")
+
 
 if __name__ == "__main__":
     print(openai_key)
@@ -0,0 +1,134 @@
+#built-in modules
+import concurrent.futures
+import json
+import os
+import threading
+import time
+
+#own libraries
+from embedding.compute import (list_azure_compute_instances, list_available_vm_sizes, list_dedicated_cores,
+                               list_remaining_cores, list_vm_skus)
+
+
+# Regions queried when none are given
+DEFAULT_REGIONS = ("westus2", "westus3", "eastus", "eastus2", "southcentralus")
+
+# Seconds a cached response stays valid; quota and VM sizes change rarely
+DEFAULT_TTL = 3600
+
+DEFAULT_CACHE_DIR = "inventory_cache"
+
+
+class AzureInventory:
+    """
+    Queries VM sizes, SKUs, quota and compute instances across several regions at once, with a disk cache.
+
+    Every region is queried in its own thread through the shared clients of embedding.clients, and each
+    response is cached on disk for ttl seconds, so repeated planning and scheduling calls are answered
+    from the cache in milliseconds. Pass refresh=True to any query to bypass the cache. Empty responses
+    are not cached, because the listing functions of embedding.compute also return them on errors.
+
+    Args:
+        subscription_id (str): Azure subscription ID.
+        regions (list[str], optional): The default regions of every query. Defaults to DEFAULT_REGIONS.
+        cache_dir (str, optional): The directory of the cache. Defaults to 'inventory_cache'.
+        ttl (float, optional): The seconds a cached response is valid. Defaults to 3600.
+        max_workers (int, optional): The number of regions queried at the same time. Defaults to 8.
+        compute_client (optional): The client to use, e.g. a fake in tests. Defaults to the shared ComputeManagementClient.
+    """
+
+    def __init__(self, subscription_id: str, regions: list[str]=DEFAULT_REGIONS, cache_dir: str=DEFAULT_CACHE_DIR,
+                 ttl: float=DEFAULT_TTL, max_workers: int=8, compute_client=None):
+        self.subscription_id = subscription_id
+        self.regions = list(regions)
+        self.cache_dir = os.path.join(cache_dir, subscription_id or "default")
+        self.ttl = ttl
+        self.max_workers = max_workers
+        self.compute_client = compute_client
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def vm_sizes(self, regions: list[str]=None, refresh: bool=False) -> dict:
+        """
+        Returns {region: list_available_vm_sizes(region)}.
+        """
+        return self._per_region("vm_sizes", list_available_vm_sizes, regions, refresh)
+
+    def vm_skus(self, regions: list[str]=None, refresh: bool=False) -> dict:
+        """
+        Returns {region: list_vm_skus(region)}, the deployable sizes with their family and GPUs.
+        """
+        return self._per_region("vm_skus", list_vm_skus, regions, refresh)
+
+    def dedicated_cores(self, regions: list[str]=None, refresh: bool=False) -> dict:
+        """
+        Returns {region: list_dedicated_cores(region)}.
+        """
+        return self._per_region("dedicated_cores", list_dedicated_cores, regions, refresh)
+
+    def remaining_cores(self, regions: list[str]=None, refresh: bool=False) -> dict:
+        """
+        Returns {region: list_remaining_cores(region)}, the free vCPUs of each quota.
+        """
+        return self._per_region("remaining_cores", list_remaining_cores, regions, refresh)
+
+    def compute_instances(self, regions: list[str]=None, refresh: bool=False) -> dict:
+        """
+        Returns {region: the VMs of the subscription in that region}; the listing covers the whole subscription in one call.
+        """
+        instances = self._cached("compute_instances", "all", refresh,
+                                 lambda: list_azure_compute_instances(self.subscription_id, self.compute_client))
+        by_region = {region: [] for region in regions or self.regions}
+        for instance in instances:
+            if instance["location"] in by_region:
+                by_region[instance["location"]].append(instance)
+        return by_region
+
+    def vm_size_regions(self, regions: list[str]=None, refresh: bool=False) -> dict:
+        """
+        Merges vm_sizes across regions.
+
+        Returns:
+            dict: {VM size name: the regions that offer it}.
+        """
+        merged = {}
+        for region, sizes in self.vm_sizes(regions, refresh).items():
+            for size in sizes:
+                merged.setdefault(size["name"], []).append(region)
+        return merged
+
+    def clear(self):
+        """
+        Deletes every cached response.
+        """
+        with self._lock:
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".json"):
+                    os.remove(os.path.join(self.cache_dir, name))
+
+    def _per_region(self, kind, query, regions, refresh):
+        regions = list(regions or self.regions)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.max_workers, len(regions)) or 1) as executor:
+            futures = [executor.submit(self._cached, kind, region, refresh,
+                                       lambda region=region: query(self.subscription_id, region, self.compute_client))
+                       for region in regions]
+            return {region: future.result() for region, future in zip(regions, futures)}
+
+    def _cached(self, kind, region, refresh, fetch):
+        path = os.path.join(self.cache_dir, f"{kind}-{region}.json")
+        if not refresh:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+                if time.time() - entry["fetched_at"] < self.ttl:
+                    return entry["data"]
+            except (OSError, ValueError, KeyError):
+                pass
+
+        data = fetch()
+        if data:
+            with self._lock:
+                with open(path + ".tmp", "w", encoding="utf-8") as f:
+                    json.dump({"fetched_at": time.time(), "data": data}, f)
+                os.replace(path + ".tmp", path)
+        return data
@@ -0,0 +1,344 @@
+#built-in modules
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# The stages of the pipeline, in order; other names are accepted too
+STAGES = ("download", "parse", "tokenize", "embed", "serialize", "upload")
+
+# Upper bounds in seconds of the batch latency histogram
+BATCH_SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Status codes the OpenAI client retries
+_RETRIED_STATUS = {408, 409, 429}
+
+_COUNTERS = ("calls", "seconds", "items", "tokens", "bytes", "batches", "batch_seconds", "retries", "failures")
+
+
+class PipelineMetrics:
+    """
+    Records where a pipeline run spends its time: wall time, items, tokens, bytes, retries and failures per stage.
+
+    Stages are timed with `with metrics.stage('embed') as stage: ...` and batches are recorded with
+    record_batch. Every finished stage and batch is appended as one JSON line to log_path, and the
+    totals can be exported in the Prometheus text format to a file (for the node exporter's textfile
+    collector) or served over HTTP with serve.
+
+    The pipeline functions report to the metrics returned by get_metrics, which do nothing until
+    PipelineMetrics is installed with set_metrics or used as a context manager:
+
+        with PipelineMetrics(log_path='run.jsonl', prometheus_path='run.prom') as metrics:
+            main5()
+        print(metrics.snapshot())
+
+    Args:
+        log_path (str, optional): A JSON Lines file the stage and batch events are appended to. Defaults to None.
+        prometheus_path (str, optional): A file rewritten with the Prometheus metrics after every stage. Defaults to None.
+        job (str, optional): The value of the 'job' label of the exported metrics. Defaults to 'embedding'.
+    """
+
+    enabled = True
+
+    def __init__(self, log_path: str=None, prometheus_path: str=None, job: str='embedding'):
+        self.log_path = log_path
+        self.prometheus_path = prometheus_path
+        self.job = job
+        self.started = time.time()
+        self._stages = {}
+        self._histograms = {}
+        self._expected = {}
+        self._lock = threading.Lock()
+        self._log = None
+        self._server = None
+        self._previous = None
+
+    def stage(self, name: str, items: int=0, tokens: int=0, bytes: int=0):
+        """
+        Returns a context manager that times one run of a stage.
+
+        The object it yields has add(items=..., tokens=..., bytes=..., retries=..., failures=...) to
+        report what the stage processed; an exception leaving the block counts as a failure.
+        """
+        return _StageTimer(self, name, items, tokens, bytes)
+
+    def record_batch(self, stage: str, seconds: float, items: int=0, tokens: int=0, bytes: int=0,
+                     retries: int=0, failed: bool=False, **fields):
+        """
+        Records one batch of a stage, e.g. one request to the embeddings endpoint.
+
+        Args:
+            stage (str): The name of the stage.
+            seconds (float): The time the batch took.
+            items (int, optional): The number of items in the batch. Defaults to 0.
+            tokens (int, optional): The number of tokens in the batch. Defaults to 0.
+            bytes (int, optional): The number of bytes in the batch. Defaults to 0.
+            retries (int, optional): The number of retried requests. Defaults to 0.
+            failed (bool, optional): Whether the batch failed. Defaults to False.
+            **fields: Anything else written to the log line, e.g. the batch position.
+        """
+        with self._lock:
+            self._add(stage, batches=1, batch_seconds=seconds, items=items, tokens=tokens, bytes=bytes,
+                      retries=retries, failures=int(failed))
+            histogram = self._histograms.setdefault(stage, [0] * (len(BATCH_SECONDS_BUCKETS) + 1))
+            histogram[next((i for i, bound in enumerate(BATCH_SECONDS_BUCKETS) if seconds <= bound),
+                           len(BATCH_SECONDS_BUCKETS))] += 1
+        self._write_event({"event": "batch", "stage": stage, "seconds": seconds, "items": items, "tokens": tokens,
+                           "bytes": bytes, "retries": retries, "failed": failed, **fields})
+
+    def add(self, stage: str, **counts):
+        """
+        Adds to the counters of a stage (items, tokens, bytes, retries or failures) outside of a timed block.
+        """
+        with self._lock:
+            self._add(stage, **counts)
+
+    def expect(self, stage: str, items: int):
+        """
+        Announces items a stage still has to process, so snapshot can estimate the time left.
+        """
+        with self._lock:
+            self._expected[stage] = self._expected.get(stage, 0) + items
+
+    def response_hook(self, stage: str='embed', asynchronous: bool=False):
+        """
+        Returns an httpx response hook that counts the responses the OpenAI client retries.
+
+        Pass it as http_client=DefaultHttpxClient(event_hooks={'response': [hook]}), or the
+        DefaultAsyncHttpxClient counterpart with asynchronous=True.
+        """
+        def hook(response):
+            if response.status_code in _RETRIED_STATUS or response.status_code >= 500:
+                self.add(stage, retries=1)
+
+        async def ahook(response):
+            hook(response)
+
+        return ahook if asynchronous else hook
+
+    def snapshot(self) -> dict:
+        """
+        Returns the totals of every stage.
+
+        Returns:
+            dict: For each stage, its calls, seconds, items, tokens, bytes, batches, retries and failures,
+            the items and tokens per second and, when expect was called, the estimated seconds left.
+        """
+        with self._lock:
+            stages = {name: dict(counters) for name, counters in self._stages.items()}
+            expected = dict(self._expected)
+        for name, counters in stages.items():
+            # concurrent batches overlap, so throughput is measured on the stage's wall time
+            seconds = counters["seconds"] or counters["batch_seconds"]
+            counters["items_per_second"] = counters["items"] / seconds if seconds else None
+            counters["tokens_per_second"] = counters["tokens"] / seconds if seconds else None
+            if name in expected and counters["items_per_second"]:
+                counters["expected_items"] = expected[name]
+                counters["eta_seconds"] = max(expected[name] - counters["items"], 0) / counters["items_per_second"]
+        return stages
+
+    def to_prometheus(self) -> str:
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        stages = self.snapshot()
+        with self._lock:
+            histograms = {name: list(counts) for name, counts in self._histograms.items()}
+
+        lines = []
+        for counter in _COUNTERS:
+            metric = f"embedding_stage_{counter}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.extend(f'{metric}{{job="{self.job}",stage="{name}"}} {counters[counter]}'
+                         for name, counters in stages.items())
+
+        lines.append("# TYPE embedding_stage_eta_seconds gauge")
+        lines.extend(f'embedding_stage_eta_seconds{{job="{self.job}",stage="{name}"}} {counters["eta_seconds"]}'
+                     for name, counters in stages.items() if "eta_seconds" in counters)
+
+        lines.append("# TYPE embedding_batch_seconds histogram")
+        for name, counts in histograms.items():
+            labels = f'job="{self.job}",stage="{name}"'
+            cumulative = 0
+            for bound, count in zip(BATCH_SECONDS_BUCKETS + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f'embedding_batch_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"embedding_batch_seconds_sum{{{labels}}} {stages[name]['batch_seconds']}")
+            lines.append(f"embedding_batch_seconds_count{{{labels}}} {cumulative}")
+
+        lines.append("# TYPE embedding_start_time_seconds gauge")
+        lines.append(f'embedding_start_time_seconds{{job="{self.job}"}} {self.started}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str=None):
+        """
+        Writes the Prometheus metrics to path (defaults to prometheus_path), replacing the file atomically.
+        """
+        path = path or self.prometheus_path
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        os.replace(path + ".tmp", path)
+
+    def serve(self, port: int=9100, host: str='127.0.0.1') -> int:
+        """
+        Serves the Prometheus metrics at http://host:port/metrics from a background thread.
+
+        Returns:
+            int: The port the server listens on (useful with port=0).
+        """
+        self._server = ThreadingHTTPServer((host, port), _handler(self))
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self._server.server_address[1]
+
+    def close(self):
+        """
+        Stops the HTTP server, writes the Prometheus file and closes the log.
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self.prometheus_path:
+            self.write_prometheus()
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+    def __enter__(self):
+        self._previous = set_metrics(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        set_metrics(self._previous)
+        self.close()
+
+    def _add(self, stage, **counts):
+        counters = self._stages.get(stage)
+        if counters is None:
+            counters = self._stages[stage] = dict.fromkeys(_COUNTERS, 0)
+        for name, value in counts.items():
+            counters[name] += value
+
+    def _finish_stage(self, name, seconds, counts, failed):
+        with self._lock:
+            self._add(name, calls=1, seconds=seconds, failures=int(failed), **counts)
+        self._write_event({"event": "stage", "stage": name, "seconds": seconds, "failed": failed, **counts})
+        if self.prometheus_path:
+            self.write_prometheus()
+
+    def _write_event(self, event):
+        if self.log_path is None:
+            return
+        line = json.dumps({"time": time.time(), **event}) + "\n"
+        with self._lock:
+            if self._log is None:
+                self._log = open(self.log_path, "a", encoding="utf-8")
+            self._log.write(line)
+            self._log.flush()
+
+
+def get_metrics():
+    """
+    Returns the metrics the pipeline reports to; they do nothing unless set_metrics installed a PipelineMetrics.
+    """
+    return _metrics
+
+
+def set_metrics(metrics: PipelineMetrics=None):
+    """
+    Installs the metrics the pipeline reports to, or disables reporting with None.
+
+    Returns:
+        The previously installed metrics.
+    """
+    global _metrics
+    previous, _metrics = _metrics, metrics if metrics is not None else _DISABLED
+    return previous
+
+
+class _StageTimer:
+
+    def __init__(self, metrics, name, items, tokens, bytes):
+        self._metrics = metrics
+        self.name = name
+        self.counts = {"items": items, "tokens": tokens, "bytes": bytes, "retries": 0, "failures": 0}
+
+    def add(self, **counts):
+        for name, value in counts.items():
+            self.counts[name] += value
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        failures = self.counts.pop("failures")
+        self._metrics._finish_stage(self.name, time.perf_counter() - self._start, self.counts,
+                                    failed=exc_type is not None or failures > 0)
+
+
+class _DisabledMetrics:
+    # the default: every call returns immediately
+
+    enabled = False
+
+    def stage(self, name, items=0, tokens=0, bytes=0):
+        return _DISABLED_STAGE
+
+    def record_batch(self, stage, seconds, items=0, tokens=0, bytes=0, retries=0, failed=False, **fields):
+        pass
+
+    def add(self, stage, **counts):
+        pass
+
+    def expect(self, stage, items):
+        pass
+
+    def response_hook(self, stage='embed', asynchronous=False):
+        return None
+
+    def snapshot(self):
+        return {}
+
+
+class _DisabledStage:
+
+    def add(self, **counts):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_DISABLED = _DisabledMetrics()
+_DISABLED_STAGE = _DisabledStage()
+_metrics = _DISABLED
+
+
+def _handler(metrics):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.rstrip("/") not in ("", "/metrics"):
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = metrics.to_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
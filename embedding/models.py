@@ -0,0 +1,190 @@
+#built-in modules
+from collections import OrderedDict
+import functools
+import os
+import threading
+
+#third-party libraries
+import numpy as np
+from sentence_transformers import SentenceTransformer
+import torch
+from transformers import AutoTokenizer
+
+
+# Models kept loaded at the same time; the least recently used one is released beyond this
+MAX_RESIDENT_MODELS = 2
+
+_lock = threading.RLock()
+_models = OrderedDict()
+_loading = {}
+
+
+def resolve_device(device: str=None) -> str:
+    """
+    Returns device, or 'cuda' when a GPU is available and 'cpu' otherwise.
+    """
+    return device or ("cuda" if torch.cuda.is_available() else "cpu")
+
+
+def default_dtype(device: str) -> str:
+    """
+    Picks the dtype of the weights for a device.
+
+    float16 on GPUs; on CPUs, where float16 matrix multiplies are slow or unsupported, bfloat16 when
+    the processor has native bfloat16 instructions (AVX512-BF16 or AMX) and float32 otherwise.
+
+    Args:
+        device (str): 'cuda', 'cpu'...
+
+    Returns:
+        str: 'float16', 'bfloat16' or 'float32'.
+    """
+    if not device.startswith("cpu"):
+        return "float16"
+    return "bfloat16" if _cpu_flags() & {"avx512_bf16", "amx_bf16"} else "float32"
+
+
+def get_sentence_transformer(model_name: str, device: str=None, dtype: str=None, **kwargs):
+    """
+    Returns a shared SentenceTransformer, loading it only the first time it is requested.
+
+    Each (model, device, dtype, options) combination is loaded once per process and kept warm, up to
+    MAX_RESIDENT_MODELS models; requesting another one releases the least recently used. Weights are
+    loaded with low_cpu_mem_usage, so safetensors checkpoints are memory-mapped instead of being
+    copied into a temporary state dict first.
+
+    Args:
+        model_name (str): The Hugging Face model id or local path.
+        device (str, optional): 'cuda', 'cpu'... Defaults to 'cuda' when available.
+        dtype (str, optional): The torch dtype of the weights, e.g. 'float16', 'bfloat16' or 'float32'. Defaults to default_dtype(device).
+        **kwargs: Other SentenceTransformer arguments, e.g. trust_remote_code=True or config_kwargs.
+
+    Returns:
+        SentenceTransformer: The same model object for the same arguments.
+    """
+    device = resolve_device(device)
+    dtype = dtype or default_dtype(device)
+    key = (model_name, device, dtype, repr(sorted(kwargs.items())))
+    with _lock:
+        model = _models.get(key)
+        if model is not None:
+            _models.move_to_end(key)
+            return model
+        # concurrent callers of the same model wait for a single load
+        event = _loading.get(key)
+        owner = event is None
+        if owner:
+            event = _loading[key] = threading.Event()
+
+    if not owner:
+        event.wait()
+        return get_sentence_transformer(model_name, device, dtype, **kwargs)
+
+    try:
+        model_kwargs = dict(kwargs.pop('model_kwargs', None) or {})
+        model_kwargs.setdefault("torch_dtype", getattr(torch, dtype) if isinstance(dtype, str) else dtype)
+        model_kwargs.setdefault("low_cpu_mem_usage", True)
+        model = SentenceTransformer(model_name, device=device, model_kwargs=model_kwargs, **kwargs)
+        with _lock:
+            _models[key] = model
+            while len(_models) > MAX_RESIDENT_MODELS:
+                _models.popitem(last=False)
+                _release_memory()
+        return model
+    finally:
+        with _lock:
+            _loading.pop(key).set()
+
+
+@functools.lru_cache(maxsize=MAX_RESIDENT_MODELS)
+def get_tokenizer(model_name: str, **kwargs):
+    """
+    Returns the tokenizer of a Hugging Face model without loading its weights, e.g. to plan batches in a
+    process whose encoding happens in CPUEncoderPool workers.
+    """
+    return AutoTokenizer.from_pretrained(model_name, **kwargs)
+
+
+def count_model_tokens(tokenizer, texts: list[str], max_length: int=None, chunk_size: int=10000) -> np.ndarray:
+    """
+    Counts the tokens of each text as the model sees them, special tokens included.
+
+    Args:
+        tokenizer: A Hugging Face tokenizer, e.g. model.tokenizer or get_tokenizer(model_name).
+        texts (list[str]): The texts to be encoded.
+        max_length (int, optional): The length at which the model truncates its input, e.g. model.max_seq_length.
+        chunk_size (int, optional): The number of texts tokenized at a time. Defaults to 10000.
+
+    Returns:
+        np.ndarray: The (n,) token counts.
+    """
+    counts = np.zeros(len(texts), dtype=np.int64)
+    for chunk_start in range(0, len(texts), chunk_size):
+        input_ids = tokenizer(texts[chunk_start:chunk_start + chunk_size], add_special_tokens=True,
+                              return_attention_mask=False, return_token_type_ids=False)["input_ids"]
+        counts[chunk_start:chunk_start + len(input_ids)] = [len(ids) for ids in input_ids]
+    return np.minimum(counts, max_length) if max_length else counts
+
+
+def plan_length_batches(token_counts, max_tokens: int=16384, max_items: int=1000) -> list:
+    """
+    Groups texts of similar length into batches that fit a budget of padded tokens.
+
+    A batch is padded to its longest text, so it costs len(batch) * longest tokens. Texts are sorted by
+    length and packed greedily, which puts short chunks together in large batches and long rulings in
+    small ones instead of padding every short chunk to the length of its longest neighbor.
+
+    Args:
+        token_counts: The (n,) token count of each text, e.g. from count_model_tokens.
+        max_tokens (int, optional): The maximum padded tokens per batch. Defaults to 16384.
+        max_items (int, optional): The maximum number of texts per batch. Defaults to 1000.
+
+    Returns:
+        list[np.ndarray]: The original positions of the texts of each batch, shortest batches first.
+    """
+    token_counts = np.asarray(token_counts)
+    order = np.argsort(token_counts, kind="stable")
+
+    batches = []
+    batch_start = 0
+    for i, position in enumerate(order):
+        # sorted ascending, so the current text is the longest of the batch
+        if i > batch_start and ((i - batch_start + 1) * token_counts[position] > max_tokens
+                                or i - batch_start >= max_items):
+            batches.append(order[batch_start:i])
+            batch_start = i
+    if batch_start < len(order):
+        batches.append(order[batch_start:])
+    return batches
+
+
+def resident_models() -> list:
+    """
+    Returns the keys of the loaded models, least recently used first.
+    """
+    with _lock:
+        return list(_models)
+
+
+def clear_models():
+    """
+    Releases every loaded model, e.g. before a job that needs the GPU memory.
+    """
+    with _lock:
+        _models.clear()
+    _release_memory()
+
+
+def _cpu_flags():
+    if not os.path.exists("/proc/cpuinfo"):
+        return set()
+    with open("/proc/cpuinfo", "r", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("flags"):
+                return set(line.split(":", 1)[1].split())
+    return set()
+
+
+def _release_memory():
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
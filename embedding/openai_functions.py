@@ -9,7 +9,7 @@ from typing import List, Optional
 # from sklearn.manifold import TSNE
 # from sklearn.metrics import average_precision_score, precision_recall_curve
 
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 from dotenv import load_dotenv
 import numpy as np
 import pandas as pd
@@ -23,6 +23,11 @@ openai_key = os.getenv('openai_key')
 
 
 client = OpenAI(api_key=openai_key, max_retries=5)
+async_client = AsyncOpenAI(api_key=openai_key, max_retries=5)
+
+# Per-request limits of the embeddings endpoint
+EMBEDDING_MAX_BATCH_ITEMS = 2048
+EMBEDDING_MAX_BATCH_TOKENS = 300000
 
 
 def count_tokens_list(strings, model="text-embedding-ada-002"):
@@ -45,6 +50,74 @@ def count_tokens_list(strings, model="text-embedding-ada-002"):
     return total_tokens
 
 
+def count_tokens_each(strings, model="text-embedding-3-small"):
+    """
+    Counts the tokens of each string as it is sent to the embeddings endpoint, with newlines replaced.
+
+    Parameters:
+        strings (list of str): The strings to be embedded.
+        model (str): The OpenAI embedding model whose tokenizer is used to count tokens.
+
+    Returns:
+        list of int: The number of tokens of each string.
+    """
+    tokenizer = tiktoken.encoding_for_model(model)
+    return [len(tokens) for tokens in tokenizer.encode_ordinary_batch([s.replace("\n", " ") for s in strings])]
+
+
+def plan_token_batches(strings, model="text-embedding-3-small", 
+                       max_tokens=EMBEDDING_MAX_BATCH_TOKENS, 
+                       max_items=EMBEDDING_MAX_BATCH_ITEMS,
+                       token_counts=None):
+    """
+    Splits a list of strings into consecutive batches that fit a per-request token budget.
+
+    Each batch is filled greedily until adding the next string would exceed max_tokens or
+    max_items. A string that is longer than max_tokens on its own gets a batch to itself.
+
+    Parameters:
+        strings (list of str): The strings to be embedded, in order.
+        model (str): The OpenAI embedding model whose tokenizer is used to count tokens.
+        max_tokens (int): The maximum number of tokens per batch (default is EMBEDDING_MAX_BATCH_TOKENS).
+        max_items (int): The maximum number of strings per batch, capped at EMBEDDING_MAX_BATCH_ITEMS.
+        token_counts (list of int): The tokens of each string, if already counted with count_tokens_each.
+
+    Returns:
+        list of tuple: (start, end) index ranges, one per batch, covering all the strings.
+    """
+    max_items = min(max_items, EMBEDDING_MAX_BATCH_ITEMS)
+
+    if token_counts is None:
+        token_counts = count_tokens_each(strings, model)
+
+    batches = []
+    batch_start, batch_tokens = 0, 0
+    for i, n_tokens in enumerate(token_counts):
+        if i > batch_start and (batch_tokens + n_tokens > max_tokens or i - batch_start >= max_items):
+            batches.append((batch_start, i))
+            batch_start, batch_tokens = i, 0
+        batch_tokens += n_tokens
+    if batch_start < len(token_counts):
+        batches.append((batch_start, len(token_counts)))
+
+    return batches
+
+
+def dimensions_kwargs(dimensions: Optional[int]) -> dict:
+    """
+    Returns the keyword arguments requesting embeddings of a given size from the embeddings endpoint.
+
+    Only text-embedding-3 models accept the dimensions parameter, so nothing is sent when it is None.
+
+    Parameters:
+        dimensions (int or None): The number of dimensions of the returned embeddings.
+
+    Returns:
+        dict: {'dimensions': dimensions}, or an empty dictionary.
+    """
+    return {"dimensions": dimensions} if dimensions else {}
+
+
 def get_embedding(text: str, model="text-embedding-3-small", **kwargs) -> List[float]:
     # replace newlines, which can negatively affect performance.
     text = text.replace("\n", " ")
@@ -60,15 +133,22 @@ async def aget_embedding(
     # replace newlines, which can negatively affect performance.
     text = text.replace("\n", " ")
 
-    return (await client.embeddings.create(input=[text], model=model, **kwargs))[
-        "data"
-    ][0]["embedding"]
+    response = await async_client.embeddings.create(input=[text], model=model, **kwargs)
+
+    return response.data[0].embedding
 
 
 def get_embeddings(
-    list_of_text: List[str], client, model="text-embedding-3-small", **kwargs
+    list_of_text: List[str], client, model="text-embedding-3-small", cache=None, **kwargs
 ) -> List[List[float]]:
-    assert len(list_of_text) <= 2048, "The batch size should not be larger than 2048."
+    assert len(list_of_text) <= EMBEDDING_MAX_BATCH_ITEMS, "The batch size should not be larger than 2048."
+
+    # only cache misses reach the API
+    if cache is not None:
+        return cache.get_or_compute(
+            list_of_text, model, lambda texts: get_embeddings(texts, client, model, **kwargs),
+            dimensions=kwargs.get("dimensions"),
+        )
 
     # replace newlines, which can negatively affect performance.
     list_of_text = [text.replace("\n", " ") for text in list_of_text]
@@ -78,9 +158,19 @@ def get_embeddings(
 
 
 async def aget_embeddings(
-    list_of_text: List[str], model="text-embedding-3-small", **kwargs
+    list_of_text: List[str], model="text-embedding-3-small", client=None, cache=None, **kwargs
 ) -> List[List[float]]:
-    assert len(list_of_text) <= 2048, "The batch size should not be larger than 2048."
+    assert len(list_of_text) <= EMBEDDING_MAX_BATCH_ITEMS, "The batch size should not be larger than 2048."
+
+    # only cache misses reach the API
+    if cache is not None:
+        return await cache.aget_or_compute(
+            list_of_text, model, lambda texts: aget_embeddings(texts, model, client, **kwargs),
+            dimensions=kwargs.get("dimensions"),
+        )
+
+    # fall back to the module-level async client
+    client = client or async_client
 
     # replace newlines, which can negatively affect performance.
     list_of_text = [text.replace("\n", " ") for text in list_of_text]
@@ -88,6 +178,9 @@ async def aget_embeddings(
     data = (
         await client.embeddings.create(input=list_of_text, model=model, **kwargs)
     ).data
+
+    # put the embeddings back in input order
+    data = sorted(data, key=lambda d: d.index)
     return [d.embedding for d in data]
 
 
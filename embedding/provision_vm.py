@@ -1,33 +1,20 @@
-# Import the needed credential and management objects from the libraries.
+#built-in modules
+import concurrent.futures
 import os
+import time
 
-from azure.identity import DefaultAzureCredential
-from azure.mgmt.compute import ComputeManagementClient
-from azure.mgmt.network import NetworkManagementClient
-from azure.mgmt.resource import ResourceManagementClient
-
+#third-party libraries
+from azure.core.exceptions import ResourceNotFoundError
 from dotenv import load_dotenv
 
+#own libraries
+from embedding.clients import get_compute_client, get_network_client, get_resource_client
+
 # Load the .env file
 load_dotenv()
 
-print(
-    "Provisioning a virtual machine...some operations might take a \
-minute or two."
-)
-
-
-# Acquire a credential object.
-credential = DefaultAzureCredential()
-
 # Retrieve subscription ID from environment variable.
-subscription_id = os.environ["AZURE_SUBSCRIPTION_ID"]
-subscription_id = os.getenv('subscription_id')
-
-# Step 1: Provision a resource group
-
-# Obtain the management object for resources.
-resource_client = ResourceManagementClient(credential, subscription_id)
+subscription_id_env = os.getenv('subscription_id') or os.getenv('AZURE_SUBSCRIPTION_ID')
 
 # Constants we need in multiple places: the resource group name and
 # the region in which we provision resources. You can change these
@@ -35,27 +22,6 @@ resource_client = ResourceManagementClient(credential, subscription_id)
 RESOURCE_GROUP_NAME = "Lawgoritm_group"
 LOCATION = "westus2"
 
-# Provision the resource group.
-rg_result = resource_client.resource_groups.create_or_update(
-    RESOURCE_GROUP_NAME, {"location": LOCATION}
-)
-
-print(
-    f"Provisioned resource group {rg_result.name} in the \
-{rg_result.location} region"
-)
-
-# For details on the previous code, see Example: Provision a resource
-# group at https://learn.microsoft.com/azure/developer/python/
-# azure-sdk-example-resource-group
-
-# Step 2: provision a virtual network
-
-# A virtual machine requires a network interface client (NIC). A NIC
-# requires a virtual network and subnet along with an IP address.
-# Therefore we must provision these downstream components first, then
-# provision the NIC, after which we can provision the VM.
-
 # Network and IP address names
 VNET_NAME = "python-example-vnet"
 SUBNET_NAME = "python-example-subnet"
@@ -63,126 +29,241 @@ IP_NAME = "python-example-ip"
 IP_CONFIG_NAME = "python-example-ip-config"
 NIC_NAME = "python-example-nic"
 
-# Obtain the management object for networks
-network_client = NetworkManagementClient(credential, subscription_id)
-
-# Provision the virtual network and wait for completion
-poller = network_client.virtual_networks.begin_create_or_update(
-    RESOURCE_GROUP_NAME,
-    VNET_NAME,
-    {
-        "location": LOCATION,
-        "address_space": {"address_prefixes": ["10.0.0.0/16"]},
-    },
-)
-
-vnet_result = poller.result()
-
-print(
-    f"Provisioned virtual network {vnet_result.name} with address \
-prefixes {vnet_result.address_space.address_prefixes}"
-)
-
-# Step 3: Provision the subnet and wait for completion
-poller = network_client.subnets.begin_create_or_update(
-    RESOURCE_GROUP_NAME,
-    VNET_NAME,
-    SUBNET_NAME,
-    {"address_prefix": "10.0.0.0/24"},
-)
-subnet_result = poller.result()
-
-print(
-    f"Provisioned virtual subnet {subnet_result.name} with address \
-prefix {subnet_result.address_prefix}"
-)
-
-# Step 4: Provision an IP address and wait for completion
-poller = network_client.public_ip_addresses.begin_create_or_update(
-    RESOURCE_GROUP_NAME,
-    IP_NAME,
-    {
-        "location": LOCATION,
-        "sku": {"name": "Standard"},
-        "public_ip_allocation_method": "Static",
-        "public_ip_address_version": "IPV4",
-    },
-)
-
-ip_address_result = poller.result()
-
-print(
-    f"Provisioned public IP address {ip_address_result.name} \
-with address {ip_address_result.ip_address}"
-)
-
-# Step 5: Provision the network interface client
-poller = network_client.network_interfaces.begin_create_or_update(
-    RESOURCE_GROUP_NAME,
-    NIC_NAME,
-    {
-        "location": LOCATION,
-        "ip_configurations": [
-            {
-                "name": IP_CONFIG_NAME,
-                "subnet": {"id": subnet_result.id},
-                "public_ip_address": {"id": ip_address_result.id},
-            }
-        ],
-    },
-)
-
-nic_result = poller.result()
-
-print(f"Provisioned network interface client {nic_result.name}")
-
-# Step 6: Provision the virtual machine
-
-# Obtain the management object for virtual machines
-compute_client = ComputeManagementClient(credential, subscription_id)
+VNET_ADDRESS_PREFIX = "10.0.0.0/16"
+SUBNET_ADDRESS_PREFIX = "10.0.0.0/24"
 
 VM_NAME = "ExampleVM"
+VM_SIZE = "Standard_DS1_v2"
 USERNAME = "azureuser"
-PASSWORD = "ChangePa$$w0rd24"
-
-print(
-    f"Provisioning virtual machine {VM_NAME}; this operation might \
-take a few minutes."
-)
-
-# Provision the VM specifying only minimal arguments, which defaults
-# to an Ubuntu 18.04 VM on a Standard DS1 v2 plan with a public IP address
-# and a default virtual network/subnet.
-
-poller = compute_client.virtual_machines.begin_create_or_update(
-    RESOURCE_GROUP_NAME,
-    VM_NAME,
-    {
-        "location": LOCATION,
-        "storage_profile": {
-            "image_reference": {
-                "publisher": "Canonical",
-                "offer": "UbuntuServer",
-                "sku": "16.04.0-LTS",
-                "version": "latest",
-            }
-        },
-        "hardware_profile": {"vm_size": "Standard_DS1_v2"},
-        "os_profile": {
-            "computer_name": VM_NAME,
-            "admin_username": USERNAME,
-            "admin_password": PASSWORD,
-        },
-        "network_profile": {
-            "network_interfaces": [
-                {
-                    "id": nic_result.id,
-                }
-            ]
-        },
-    },
-)
 
-vm_result = poller.result()
 
-print(f"Provisioned virtual machine {vm_result.name}")
\ No newline at end of file
+class ProvisioningStep:
+    """
+    One resource to provision once the steps it depends on are done.
+
+    Args:
+        name (str): The name of the step, used by other steps in depends_on.
+        create: A function taking the results of the previous steps ({name: resource}) and returning
+            the resource, or a poller whose result() is the resource.
+        depends_on (tuple[str], optional): The steps that must finish first. Defaults to ().
+        get (optional): A function taking the same results and returning the existing resource, or None if it does not exist.
+        is_desired (optional): A function taking the existing resource and the results, returning whether it
+            already matches what create would make; such resources are skipped. Defaults to always True.
+    """
+
+    def __init__(self, name: str, create, depends_on: tuple=(), get=None, is_desired=None):
+        self.name = name
+        self.create = create
+        self.depends_on = tuple(depends_on)
+        self.get = get
+        self.is_desired = is_desired or (lambda existing, results: True)
+
+
+def run_steps(steps: list[ProvisioningStep], max_workers: int=4) -> tuple[dict, dict]:
+    """
+    Runs provisioning steps as a dependency graph, starting every step as soon as its dependencies are done.
+
+    Independent steps (e.g. the public IP and the virtual network) run concurrently. A step whose
+    dependency failed is not started.
+
+    Args:
+        steps (list[ProvisioningStep]): The steps to run.
+        max_workers (int, optional): The number of steps running at the same time. Defaults to 4.
+
+    Returns:
+        tuple: The resources ({name: resource}) and the timings ({name: {'status', 'seconds'}}), where status
+        is 'created', 'updated', 'skipped', 'failed' or 'cancelled'.
+    """
+    names = {step.name for step in steps}
+    for step in steps:
+        unknown = set(step.depends_on) - names
+        if unknown:
+            raise ValueError(f"Step {step.name} depends on unknown steps {sorted(unknown)}")
+
+    results, timings = {}, {}
+    pending = {step.name: step for step in steps}
+    futures = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or futures:
+            for name, step in list(pending.items()):
+                if any(timings.get(dependency, {}).get("status") in ("failed", "cancelled")
+                       for dependency in step.depends_on):
+                    timings[name] = {"status": "cancelled", "seconds": 0.0}
+                    del pending[name]
+                elif all(dependency in results for dependency in step.depends_on):
+                    futures[executor.submit(_run_step, step, dict(results))] = name
+                    del pending[name]
+
+            if not futures:
+                # only steps in a dependency cycle are left
+                for name in pending:
+                    timings[name] = {"status": "cancelled", "seconds": 0.0}
+                break
+
+            done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                name = futures.pop(future)
+                try:
+                    results[name], timings[name] = future.result()
+                except Exception as e:
+                    print(f"An error occurred provisioning {name}: {e}")
+                    timings[name] = {"status": "failed", "seconds": getattr(e, "seconds", None), "error": str(e)}
+
+    return results, timings
+
+
+def provision_vm(subscription_id: str=subscription_id_env, resource_group: str=RESOURCE_GROUP_NAME,
+                 location: str=LOCATION, vm_name: str=VM_NAME, vm_size: str=VM_SIZE, username: str=USERNAME,
+                 password: str=None, max_workers: int=4, resource_client=None, network_client=None,
+                 compute_client=None) -> dict:
+    """
+    Provisions a resource group, virtual network, subnet, public IP, network interface and VM.
+
+    The public IP is created while the virtual network and subnet are, and resources that already
+    exist in the desired state are skipped, so running it again only creates what is missing.
+
+    Args:
+        subscription_id (str, optional): Azure subscription ID. Defaults to the subscription_id environment variable.
+        resource_group (str, optional): The resource group. Defaults to RESOURCE_GROUP_NAME.
+        location (str, optional): Azure location. Defaults to LOCATION.
+        vm_name (str, optional): The name of the VM. Defaults to VM_NAME.
+        vm_size (str, optional): The size of the VM, e.g. the one recommended by compute.recommend_vm_size. Defaults to VM_SIZE.
+        username (str, optional): The admin user of the VM. Defaults to USERNAME.
+        password (str, optional): The admin password of the VM. Defaults to the vm_password environment variable;
+            one of them is required.
+        max_workers (int, optional): The number of steps running at the same time. Defaults to 4.
+        resource_client (optional): Defaults to the shared ResourceManagementClient from embedding.clients.
+        network_client (optional): Defaults to the shared NetworkManagementClient from embedding.clients.
+        compute_client (optional): Defaults to the shared ComputeManagementClient from embedding.clients.
+
+    Returns:
+        dict: 'resources' ({step: resource}), 'timings' ({step: {'status', 'seconds'}}) and the total 'seconds'.
+    """
+    password = password or os.getenv('vm_password')
+    if not password:
+        raise ValueError("No admin password for the VM: pass password or set the vm_password environment variable")
+
+    resource_client = resource_client or get_resource_client(subscription_id)
+    network_client = network_client or get_network_client(subscription_id)
+    compute_client = compute_client or get_compute_client(subscription_id)
+    nic_name = NIC_NAME if vm_name == VM_NAME else f"{vm_name}-nic"
+    ip_name = IP_NAME if vm_name == VM_NAME else f"{vm_name}-ip"
+
+    steps = [
+        ProvisioningStep(
+            "resource_group",
+            create=lambda results: resource_client.resource_groups.create_or_update(resource_group, {"location": location}),
+            get=lambda results: _get_or_none(resource_client.resource_groups.get, resource_group),
+            is_desired=lambda existing, results: existing.location == location,
+        ),
+        ProvisioningStep(
+            "virtual_network",
+            depends_on=("resource_group",),
+            create=lambda results: network_client.virtual_networks.begin_create_or_update(
+                resource_group, VNET_NAME,
+                {"location": location, "address_space": {"address_prefixes": [VNET_ADDRESS_PREFIX]}}),
+            get=lambda results: _get_or_none(network_client.virtual_networks.get, resource_group, VNET_NAME),
+            is_desired=lambda existing, results: VNET_ADDRESS_PREFIX in existing.address_space.address_prefixes,
+        ),
+        ProvisioningStep(
+            "subnet",
+            depends_on=("virtual_network",),
+            create=lambda results: network_client.subnets.begin_create_or_update(
+                resource_group, VNET_NAME, SUBNET_NAME, {"address_prefix": SUBNET_ADDRESS_PREFIX}),
+            get=lambda results: _get_or_none(network_client.subnets.get, resource_group, VNET_NAME, SUBNET_NAME),
+            is_desired=lambda existing, results: existing.address_prefix == SUBNET_ADDRESS_PREFIX,
+        ),
+        ProvisioningStep(
+            "public_ip",
+            depends_on=("resource_group",),
+            create=lambda results: network_client.public_ip_addresses.begin_create_or_update(
+                resource_group, ip_name,
+                {"location": location, "sku": {"name": "Standard"}, "public_ip_allocation_method": "Static",
+                 "public_ip_address_version": "IPV4"}),
+            get=lambda results: _get_or_none(network_client.public_ip_addresses.get, resource_group, ip_name),
+            is_desired=lambda existing, results: (existing.sku.name == "Standard"
+                                                  and existing.public_ip_allocation_method == "Static"),
+        ),
+        ProvisioningStep(
+            "network_interface",
+            depends_on=("subnet", "public_ip"),
+            create=lambda results: network_client.network_interfaces.begin_create_or_update(
+                resource_group, nic_name,
+                {"location": location,
+                 "ip_configurations": [{"name": IP_CONFIG_NAME, "subnet": {"id": results["subnet"].id},
+                                        "public_ip_address": {"id": results["public_ip"].id}}]}),
+            get=lambda results: _get_or_none(network_client.network_interfaces.get, resource_group, nic_name),
+            is_desired=lambda existing, results: any(
+                _same_id(configuration.subnet, results["subnet"])
+                and _same_id(configuration.public_ip_address, results["public_ip"])
+                for configuration in existing.ip_configurations or []),
+        ),
+        ProvisioningStep(
+            "virtual_machine",
+            depends_on=("network_interface",),
+            create=lambda results: compute_client.virtual_machines.begin_create_or_update(
+                resource_group, vm_name,
+                {
+                    "location": location,
+                    "storage_profile": {
+                        "image_reference": {
+                            "publisher": "Canonical",
+                            "offer": "UbuntuServer",
+                            "sku": "16.04.0-LTS",
+                            "version": "latest",
+                        }
+                    },
+                    "hardware_profile": {"vm_size": vm_size},
+                    "os_profile": {"computer_name": vm_name, "admin_username": username, "admin_password": password},
+                    "network_profile": {"network_interfaces": [{"id": results["network_interface"].id}]},
+                }),
+            get=lambda results: _get_or_none(compute_client.virtual_machines.get, resource_group, vm_name),
+            is_desired=lambda existing, results: (
+                existing.hardware_profile.vm_size == vm_size
+                and any(_same_id(nic, results["network_interface"])
+                        for nic in existing.network_profile.network_interfaces or [])),
+        ),
+    ]
+
+    print(f"Provisioning virtual machine {vm_name} in {location}; some operations might take a minute or two.")
+    start = time.perf_counter()
+    resources, timings = run_steps(steps, max_workers)
+    return {"resources": resources, "timings": timings, "seconds": time.perf_counter() - start}
+
+
+def _run_step(step, results):
+    start = time.perf_counter()
+    try:
+        existing = step.get(results) if step.get is not None else None
+        if existing is not None and step.is_desired(existing, results):
+            print(f"{step.name} already exists, skipping")
+            return existing, {"status": "skipped", "seconds": time.perf_counter() - start}
+
+        resource = step.create(results)
+        if hasattr(resource, "result"):
+            resource = resource.result()
+    except Exception as e:
+        e.seconds = time.perf_counter() - start
+        raise
+    seconds = time.perf_counter() - start
+    print(f"Provisioned {step.name} {getattr(resource, 'name', '')} in {seconds:.1f}s")
+    return resource, {"status": "updated" if existing is not None else "created", "seconds": seconds}
+
+
+def _get_or_none(get, *args):
+    try:
+        return get(*args)
+    except ResourceNotFoundError:
+        return None
+
+
+def _same_id(reference, resource):
+    # resource ids differ in case depending on the API that returns them
+    return reference is not None and (reference.id or "").lower() == (resource.id or "").lower()
+
+
+if __name__ == "__main__":
+    provisioned = provision_vm()
+    for name, timing in provisioned["timings"].items():
+        print(f"  {name}: {timing['status']} in {timing['seconds'] or 0:.1f}s")
+    print(f"Done in {provisioned['seconds']:.1f}s")
@@ -0,0 +1,335 @@
+#built-in modules
+import json
+import os
+import time
+
+#third-party libraries
+import numpy as np
+
+#own libraries
+from embedding.ann import kmeans, recall_at_k
+from embedding.search import METRICS, ExactIndex, finalize_top_k, merge_top_k, normalize
+
+
+class ScalarQuantizer:
+    """
+    int8 scalar quantization: each dimension is mapped linearly from its trained [min, max] range to 0..255.
+
+    Storage is 1 byte per dimension (4x smaller than float32).
+
+    Args:
+        minimum: The (d,) per-dimension minimum.
+        scale: The (d,) per-dimension step between consecutive codes.
+    """
+
+    def __init__(self, minimum, scale):
+        self.minimum = np.asarray(minimum, dtype=np.float32)
+        self.scale = np.asarray(scale, dtype=np.float32)
+
+    @classmethod
+    def train(cls, vectors, sample_size: int=100000, seed: int=0):
+        """
+        Learns the per-dimension range on a random sample of the vectors (NaN rows are ignored).
+        """
+        sample = _sample(vectors, sample_size, seed)
+        minimum, maximum = sample.min(axis=0), sample.max(axis=0)
+        return cls(minimum, np.maximum(maximum - minimum, 1e-12) / 255)
+
+    def encode(self, vectors) -> np.ndarray:
+        codes = np.rint((np.asarray(vectors, dtype=np.float32) - self.minimum) / self.scale)
+        return np.clip(np.nan_to_num(codes), 0, 255).astype(np.uint8)
+
+    def decode(self, codes) -> np.ndarray:
+        return self.minimum + codes.astype(np.float32) * self.scale
+
+    def inner_products(self, queries, codes) -> np.ndarray:
+        """
+        Asymmetric inner products between float queries and a block of codes, without decoding the block.
+        """
+        # q . (min + code * scale) = q . min + (q * scale) . code
+        return (queries * self.scale) @ codes.T.astype(np.float32) + (queries @ self.minimum)[:, None]
+
+    def squared_norms(self, codes) -> np.ndarray:
+        decoded = self.decode(codes)
+        return np.einsum("ij,ij->i", decoded, decoded)
+
+    def state(self) -> dict:
+        return {"minimum": self.minimum, "scale": self.scale}
+
+
+class ProductQuantizer:
+    """
+    Product quantization: the vector is split into m sub-vectors, each replaced by the id of its closest of
+    256 trained sub-centroids. Storage is m bytes per vector (e.g. 96 bytes instead of 12 KB for 3072
+    float32 dimensions with m=96, a 128x reduction).
+
+    Args:
+        codebooks: The (m, 256, d / m) sub-centroids.
+    """
+
+    def __init__(self, codebooks):
+        self.codebooks = np.asarray(codebooks, dtype=np.float32)
+
+    @classmethod
+    def train(cls, vectors, m: int=64, n_iter: int=20, sample_size: int=65536, seed: int=0):
+        """
+        Learns 256 sub-centroids for each of the m sub-spaces with k-means on a random sample.
+
+        Args:
+            vectors: A (n, d) array of vectors, with d divisible by m.
+            m (int, optional): The number of sub-spaces, i.e. bytes per code. Defaults to 64.
+            n_iter (int, optional): The number of k-means iterations. Defaults to 20.
+            sample_size (int, optional): The number of vectors used for training. Defaults to 65536.
+            seed (int, optional): The random seed. Defaults to 0.
+        """
+        sample = _sample(vectors, sample_size, seed)
+        if sample.shape[1] % m:
+            raise ValueError(f"The dimension {sample.shape[1]} is not divisible by m={m}")
+        sub_dimensions = sample.shape[1] // m
+        codebooks = [kmeans(sample[:, j * sub_dimensions:(j + 1) * sub_dimensions], 256, n_iter,
+                            len(sample), "l2", seed + j)
+                     for j in range(m)]
+        return cls(np.stack(codebooks))
+
+    @property
+    def m(self):
+        return self.codebooks.shape[0]
+
+    def encode(self, vectors) -> np.ndarray:
+        vectors = np.nan_to_num(np.asarray(vectors, dtype=np.float32))
+        sub_vectors = vectors.reshape(len(vectors), self.m, -1)
+        codes = np.empty((len(vectors), self.m), dtype=np.uint8)
+        for j, codebook in enumerate(self.codebooks):
+            _, nearest = ExactIndex(codebook, "l2", normalized=True).search(sub_vectors[:, j], 1)
+            codes[:, j] = nearest[:, 0]
+        return codes
+
+    def decode(self, codes) -> np.ndarray:
+        return np.concatenate([self.codebooks[j][codes[:, j]] for j in range(self.m)], axis=1)
+
+    def inner_products(self, queries, codes) -> np.ndarray:
+        """
+        Asymmetric inner products between float queries and a block of codes, from per-query lookup tables.
+        """
+        # tables[q, j, c] = sub-query j of q . sub-centroid c of sub-space j
+        tables = np.einsum("qjd,jcd->qjc", queries.reshape(len(queries), self.m, -1), self.codebooks)
+        scores = np.zeros((len(queries), len(codes)), dtype=np.float32)
+        for j in range(self.m):
+            scores += tables[:, j, codes[:, j]]
+        return scores
+
+    def squared_norms(self, codes) -> np.ndarray:
+        codebook_norms = np.einsum("jcd,jcd->jc", self.codebooks, self.codebooks)
+        return sum(codebook_norms[j, codes[:, j]] for j in range(self.m))
+
+    def state(self) -> dict:
+        return {"codebooks": self.codebooks}
+
+
+QUANTIZERS = {"scalar": ScalarQuantizer, "product": ProductQuantizer}
+
+
+class QuantizedIndex:
+    """
+    Similarity search over quantized codes, with optional exact rescoring.
+
+    The codes are scanned in blocks with asymmetric distance computation (float queries against codes),
+    keeping rescore_factor * k candidates per query. When the full-precision vectors are available
+    (for example memory-mapped from embedding.storage), those candidates are re-ranked exactly.
+
+    Args:
+        quantizer (ScalarQuantizer or ProductQuantizer): The trained quantizer.
+        codes: The (n, code_size) uint8 codes.
+        metric (str, optional): 'cosine', 'dot' or 'l2'. Defaults to 'cosine'.
+        vectors (optional): The (n, d) full-precision vectors used for rescoring. Defaults to None.
+        rescore_factor (int, optional): Candidates kept per result when rescoring. Defaults to 4.
+        block_size (int, optional): The number of codes scored at a time. Defaults to 65536.
+        valid (optional): A (n,) boolean mask of the rows that may be returned (False for failed embeddings).
+    """
+
+    def __init__(self, quantizer, codes, metric: str="cosine", vectors=None, rescore_factor: int=4,
+                 block_size: int=65536, valid=None):
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric {metric!r}, expected one of {METRICS}")
+        self.quantizer = quantizer
+        self.codes = codes
+        self.metric = metric
+        self.vectors = vectors
+        self.rescore_factor = rescore_factor
+        self.block_size = block_size
+        self.valid = valid
+        self._squared_norms = quantizer.squared_norms(codes) if metric == "l2" else None
+
+    @classmethod
+    def build(cls, vectors, kind: str="scalar", metric: str="cosine", keep_vectors: bool=True,
+              block_size: int=65536, **train_kwargs):
+        """
+        Trains a quantizer on the vectors and encodes them in blocks.
+
+        Args:
+            vectors: A (n, d) array of vectors, e.g. a memory-mapped matrix from embedding.storage.load_vectors.
+            kind (str, optional): 'scalar' (int8) or 'product'. Defaults to 'scalar'.
+            metric (str, optional): 'cosine', 'dot' or 'l2'. Defaults to 'cosine'.
+            keep_vectors (bool, optional): Whether to keep a reference to vectors for rescoring. Defaults to True.
+            block_size (int, optional): The number of vectors encoded at a time. Defaults to 65536.
+            **train_kwargs: Arguments for the quantizer's train method (e.g. m for product quantization).
+
+        Returns:
+            QuantizedIndex: The built index.
+        """
+        prepare = normalize if metric == "cosine" else (lambda block: np.asarray(block, dtype=np.float32))
+        quantizer = QUANTIZERS[kind].train(prepare(_sample(vectors, train_kwargs.pop("sample_size", 100000),
+                                                           train_kwargs.get("seed", 0))), **train_kwargs)
+        codes = np.concatenate([quantizer.encode(prepare(vectors[block_start:block_start + block_size]))
+                                for block_start in range(0, len(vectors), block_size)])
+        # failed embeddings must never be returned
+        valid = ~np.isnan(np.asarray(vectors[:, 0], dtype=np.float32))
+        return cls(quantizer, codes, metric, vectors if keep_vectors else None, block_size=block_size, valid=valid)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def memory_bytes(self) -> int:
+        """
+        Returns the size of the codes, the part of the index that is scanned for every query.
+        """
+        return self.codes.nbytes
+
+    def search(self, queries, k: int=10, rescore: bool=True):
+        """
+        Returns the k best matches of each query.
+
+        Args:
+            queries: A (q, d) array-like of query vectors, or a single (d,) vector.
+            k (int, optional): The number of neighbors returned per query. Defaults to 10.
+            rescore (bool, optional): Whether to re-rank candidates with the full vectors, when available.
+
+        Returns:
+            tuple: (scores, indices), two (q, k) arrays sorted best first, with the same score
+            convention as embedding.search.ExactIndex.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if self.metric == "cosine":
+            queries = normalize(queries)
+        rescore = rescore and self.vectors is not None
+        n_candidates = k * self.rescore_factor if rescore else k
+
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_indices = np.full((len(queries), 0), -1, dtype=np.int64)
+        for block_start in range(0, len(self.codes), self.block_size):
+            codes = np.asarray(self.codes[block_start:block_start + self.block_size])
+            scores = self.quantizer.inner_products(queries, codes)
+            if self.metric == "l2":
+                block_norms = self._squared_norms[block_start:block_start + len(codes)]
+                scores = -(np.einsum("ij,ij->i", queries, queries)[:, None] - 2 * scores + block_norms[None, :])
+            if self.valid is not None:
+                scores[:, ~self.valid[block_start:block_start + len(codes)]] = -np.inf
+
+            if scores.shape[1] > n_candidates:
+                candidates = np.argpartition(-scores, n_candidates - 1, axis=1)[:, :n_candidates]
+                scores = np.take_along_axis(scores, candidates, axis=1)
+            else:
+                candidates = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+            best_scores, best_indices = merge_top_k(best_scores, best_indices, scores,
+                                                    candidates + block_start, n_candidates)
+
+        if rescore:
+            best_scores, best_indices = self._rescore(queries, best_indices, k)
+        return finalize_top_k(best_scores, best_indices, k, self.metric)
+
+    def save(self, directory: str):
+        """
+        Saves the quantizer and the codes as .npy files plus a JSON manifest (full vectors are not copied).
+        """
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "codes.npy"), self.codes)
+        if self.valid is not None:
+            np.save(os.path.join(directory, "valid.npy"), self.valid)
+        for name, array in self.quantizer.state().items():
+            np.save(os.path.join(directory, name + ".npy"), array)
+        kind = next(kind for kind, quantizer in QUANTIZERS.items() if isinstance(self.quantizer, quantizer))
+        with open(os.path.join(directory, "index.json"), "w", encoding="utf-8") as f:
+            json.dump({"type": kind, "metric": self.metric, "rescore_factor": self.rescore_factor,
+                       "state": list(self.quantizer.state())}, f)
+
+    @classmethod
+    def load(cls, directory: str, vectors=None, mmap: bool=True):
+        """
+        Loads an index saved with save; pass the full-precision vectors to enable rescoring.
+        """
+        with open(os.path.join(directory, "index.json"), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        state = {name: np.load(os.path.join(directory, name + ".npy")) for name in manifest["state"]}
+        codes = np.load(os.path.join(directory, "codes.npy"), mmap_mode="r" if mmap else None)
+        valid_path = os.path.join(directory, "valid.npy")
+        valid = np.load(valid_path) if os.path.exists(valid_path) else None
+        return cls(QUANTIZERS[manifest["type"]](**state), codes, manifest["metric"], vectors,
+                   manifest["rescore_factor"], valid=valid)
+
+    def _rescore(self, queries, candidates, k):
+        scores = np.full(candidates.shape, -np.inf, dtype=np.float32)
+        for row, (query, row_candidates) in enumerate(zip(queries, candidates)):
+            valid = row_candidates >= 0
+            ids = row_candidates[valid]
+            # read the candidate rows in file order from a memory-mapped matrix
+            order = np.argsort(ids)
+            vectors = np.empty((len(ids), queries.shape[1]), dtype=np.float32)
+            vectors[order] = np.asarray(self.vectors[ids[order]], dtype=np.float32)
+            if self.metric == "cosine":
+                vectors = normalize(vectors)
+            if self.metric == "l2":
+                scores[row, valid] = -((vectors - query) ** 2).sum(axis=1)
+            else:
+                scores[row, valid] = vectors @ query
+        keep = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(scores, keep, axis=1), np.take_along_axis(candidates, keep, axis=1)
+
+
+def evaluate_quantization(vectors, queries, k: int=10, metric: str="cosine", configurations=None) -> list:
+    """
+    Compares quantized indexes with the unquantized baseline: memory, latency and recall@k, with and without rescoring.
+
+    Args:
+        vectors: The (n, d) full-precision vectors.
+        queries: A (q, d) array of query vectors.
+        k (int, optional): The number of neighbors. Defaults to 10.
+        metric (str, optional): 'cosine', 'dot' or 'l2'. Defaults to 'cosine'.
+        configurations (list[dict], optional): Arguments for QuantizedIndex.build. Defaults to int8 and
+            product quantization with d/32 and d/8 bytes per vector.
+
+    Returns:
+        list[dict]: One dictionary per configuration and rescoring setting.
+    """
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+    dimensions = vectors.shape[1]
+    configurations = configurations or [
+        {"kind": "scalar"},
+        {"kind": "product", "m": max(1, dimensions // 32)},
+        {"kind": "product", "m": max(1, dimensions // 8)},
+    ]
+
+    start = time.perf_counter()
+    _, exact_indices = ExactIndex(vectors, metric).search(queries, k)
+    baseline_bytes = len(vectors) * dimensions * 4
+    results = [{"kind": "float32", "bytes": baseline_bytes, "compression": 1.0, "rescore": False, "recall": 1.0,
+                "ms_per_query": 1000 * (time.perf_counter() - start) / len(queries)}]
+
+    for configuration in configurations:
+        configuration = dict(configuration)
+        index = QuantizedIndex.build(vectors, metric=metric, **configuration)
+        for rescore in (False, True):
+            start = time.perf_counter()
+            _, indices = index.search(queries, k, rescore=rescore)
+            elapsed = time.perf_counter() - start
+            results.append({**configuration, "bytes": index.memory_bytes(),
+                            "compression": baseline_bytes / index.memory_bytes(), "rescore": rescore,
+                            "recall": recall_at_k(indices, exact_indices),
+                            "ms_per_query": 1000 * elapsed / len(queries)})
+    return results
+
+
+def _sample(vectors, sample_size, seed):
+    rng = np.random.default_rng(seed)
+    valid = np.flatnonzero(~np.isnan(np.asarray(vectors[:, 0], dtype=np.float32)))
+    sample = np.sort(rng.choice(valid, size=min(sample_size, len(valid)), replace=False))
+    return np.asarray(vectors[sample], dtype=np.float32)
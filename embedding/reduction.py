@@ -0,0 +1,261 @@
+#built-in modules
+import json
+import os
+import shutil
+import time
+
+#third-party libraries
+import numpy as np
+
+#own libraries
+from embedding.ann import recall_at_k
+from embedding.search import ExactIndex, normalize
+from embedding.storage import load_vectors
+
+
+# Native output size of the OpenAI embedding models
+MODEL_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+
+def truncate(vectors, dimensions: int) -> np.ndarray:
+    """
+    Keeps the first dimensions coordinates of each vector and rescales it to unit norm.
+
+    text-embedding-3-* models are trained so that their leading coordinates carry most of the
+    information (Matryoshka representation learning); this is what the API does when the
+    dimensions parameter is passed, so vectors already embedded at full size can be reduced locally.
+
+    Args:
+        vectors: A (n, d) array-like, or a single (d,) vector.
+        dimensions (int): The number of leading coordinates kept, at most d.
+
+    Returns:
+        np.ndarray: The (n, dimensions) float32 unit vectors (NaN rows stay NaN).
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dimensions > vectors.shape[-1]:
+        raise ValueError(f"Cannot truncate {vectors.shape[-1]} dimensions to {dimensions}")
+    return normalize(vectors[..., :dimensions])
+
+
+def truncate_stored(path_prefix: str, output_prefix: str, dimensions: int, dtype: str=None,
+                    block_size: int=65536) -> int:
+    """
+    Writes a truncated and re-normalized copy of vectors stored by embedding.storage.EmbeddingWriter.
+
+    The matrix is processed in blocks from a memory map and the metadata sidecar is copied as is.
+
+    Args:
+        path_prefix (str): The path of the stored vectors, without extension.
+        output_prefix (str): The path of the reduced copy, without extension.
+        dimensions (int): The number of leading coordinates kept.
+        dtype (str, optional): The dtype of the copy, e.g. 'float16'. Defaults to the dtype of the input.
+        block_size (int, optional): The number of vectors processed at a time. Defaults to 65536.
+
+    Returns:
+        int: The number of vectors written.
+    """
+    return _transform_stored(path_prefix, output_prefix, lambda block: truncate(block, dimensions), dimensions,
+                             dtype, block_size)
+
+
+def benchmark_dimensions(vectors, queries, dimensions=(256, 512, 1024, 3072), k: int=10, dtype: str='float32') -> list:
+    """
+    Measures storage size, search latency and recall@k of truncated embeddings against the full vectors.
+
+    Recall is computed against an exact cosine search at the full dimension of vectors, so the
+    largest setting equal to that dimension is the baseline with a recall of 1.
+
+    Args:
+        vectors: The (n, d) full-size document embeddings, e.g. from load_vectors.
+        queries: The (q, d) full-size query embeddings.
+        dimensions (optional): The sizes to evaluate; sizes above d are skipped. Defaults to (256, 512, 1024, 3072).
+        k (int, optional): The number of neighbors. Defaults to 10.
+        dtype (str, optional): The storage dtype used to report sizes. Defaults to 'float32'.
+
+    Returns:
+        list[dict]: One dictionary per size with dimensions, bytes, ms_per_query and recall.
+    """
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+    _, exact_indices = ExactIndex(vectors, "cosine").search(queries, k)
+
+    results = []
+    for size in dimensions:
+        if size > vectors.shape[1]:
+            continue
+        index = ExactIndex(truncate(vectors, size), "cosine", normalized=True)
+        reduced_queries = truncate(queries, size)
+
+        start = time.perf_counter()
+        _, indices = index.search(reduced_queries, k)
+        elapsed = time.perf_counter() - start
+
+        results.append({"dimensions": size, "bytes": len(vectors) * size * np.dtype(dtype).itemsize,
+                        "ms_per_query": 1000 * elapsed / len(queries),
+                        "recall": recall_at_k(indices, exact_indices)})
+    return results
+
+
+class PCAReducer:
+    """
+    Linear dimensionality reduction learned from the corpus, for models without native truncation.
+
+    The mean and covariance are accumulated block by block (partial_fit), so the projection can be fitted
+    on a stream or a memory-mapped matrix without loading it. The same projection must then be applied
+    to the stored document vectors and to every query vector.
+
+    Args:
+        n_components (int): The number of dimensions after reduction.
+        normalize_output (bool, optional): Whether reduced vectors are rescaled to unit norm, as needed
+            for cosine search. Defaults to True.
+    """
+
+    def __init__(self, n_components: int, normalize_output: bool=True):
+        self.n_components = n_components
+        self.normalize_output = normalize_output
+        self.mean = None
+        self.components = None
+        self.explained_variance_ratio = None
+        self.count = 0
+        self._sum = None
+        self._outer = None
+
+    def partial_fit(self, vectors):
+        """
+        Adds a block of vectors to the statistics (NaN rows are ignored).
+        """
+        block = np.asarray(vectors, dtype=np.float64)
+        block = block[~np.isnan(block).any(axis=1)]
+        if self._sum is None:
+            self._sum = np.zeros(block.shape[1])
+            self._outer = np.zeros((block.shape[1], block.shape[1]))
+        self._sum += block.sum(axis=0)
+        self._outer += block.T @ block
+        self.count += len(block)
+        self.components = None
+        return self
+
+    def fit(self, vectors, sample_size: int=200000, block_size: int=65536, seed: int=0):
+        """
+        Fits the projection on a random sample of a (possibly memory-mapped) matrix, read in blocks.
+
+        Args:
+            vectors: A (n, d) array, e.g. from embedding.storage.load_vectors.
+            sample_size (int, optional): The number of vectors used. Defaults to 200000.
+            block_size (int, optional): The number of vectors read at a time. Defaults to 65536.
+            seed (int, optional): The random seed. Defaults to 0.
+
+        Returns:
+            PCAReducer: self.
+        """
+        rows = np.arange(len(vectors))
+        if len(vectors) > sample_size:
+            rows = np.sort(np.random.default_rng(seed).choice(len(vectors), size=sample_size, replace=False))
+        for block_start in range(0, len(rows), block_size):
+            self.partial_fit(vectors[rows[block_start:block_start + block_size]])
+        return self._solve()
+
+    def fit_records(self, records, key: str='embedding', sample_rate: float=1.0, window_size: int=10000, seed: int=0):
+        """
+        Fits the projection on a stream of embedded records, e.g. from stream_huggingface_embeddings.
+
+        Args:
+            records: An iterable of dictionaries holding an embedding under key.
+            key (str, optional): The key of the embedding. Defaults to 'embedding'.
+            sample_rate (float, optional): The fraction of records used. Defaults to 1.0.
+            window_size (int, optional): The number of vectors accumulated at a time. Defaults to 10000.
+            seed (int, optional): The random seed. Defaults to 0.
+
+        Returns:
+            PCAReducer: self.
+        """
+        rng = np.random.default_rng(seed)
+        window = []
+        for record in records:
+            embedding = record.get(key)
+            # failed records hold None, [] or [None]
+            if embedding is None or len(embedding) == 0 or embedding[0] is None or rng.random() >= sample_rate:
+                continue
+            window.append(embedding)
+            if len(window) >= window_size:
+                self.partial_fit(window)
+                window = []
+        if window:
+            self.partial_fit(window)
+        return self._solve()
+
+    def transform(self, vectors) -> np.ndarray:
+        """
+        Projects document or query vectors onto the fitted components.
+
+        Args:
+            vectors: A (n, d) array-like, or a single (d,) vector.
+
+        Returns:
+            np.ndarray: The (n, n_components) float32 vectors (NaN rows stay NaN).
+        """
+        if self.components is None:
+            self._solve()
+        reduced = (np.asarray(vectors, dtype=np.float32) - self.mean) @ self.components.T
+        return normalize(reduced) if self.normalize_output else reduced
+
+    def transform_stored(self, path_prefix: str, output_prefix: str, dtype: str=None, block_size: int=65536) -> int:
+        """
+        Writes a reduced copy of vectors stored by embedding.storage.EmbeddingWriter (see truncate_stored).
+        """
+        return _transform_stored(path_prefix, output_prefix, self.transform, self.n_components, dtype, block_size)
+
+    def save(self, directory: str):
+        """
+        Saves the projection as .npy files plus a JSON manifest in directory.
+        """
+        if self.components is None:
+            self._solve()
+        os.makedirs(directory, exist_ok=True)
+        for name in ("mean", "components", "explained_variance_ratio"):
+            np.save(os.path.join(directory, name + ".npy"), getattr(self, name))
+        with open(os.path.join(directory, "reducer.json"), "w", encoding="utf-8") as f:
+            json.dump({"type": "pca", "n_components": self.n_components, "normalize_output": self.normalize_output,
+                       "count": self.count}, f)
+
+    @classmethod
+    def load(cls, directory: str):
+        """
+        Loads a projection saved with save.
+        """
+        with open(os.path.join(directory, "reducer.json"), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        reducer = cls(manifest["n_components"], manifest["normalize_output"])
+        reducer.count = manifest["count"]
+        for name in ("mean", "components", "explained_variance_ratio"):
+            setattr(reducer, name, np.load(os.path.join(directory, name + ".npy")))
+        return reducer
+
+    def _solve(self):
+        if not self.count:
+            raise ValueError("The reducer has not seen any vector")
+        mean = self._sum / self.count
+        covariance = self._outer / self.count - np.outer(mean, mean)
+        # eigh returns the eigenvalues in ascending order
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+        order = np.argsort(eigenvalues)[::-1][:self.n_components]
+        self.mean = mean.astype(np.float32)
+        self.components = eigenvectors[:, order].T.astype(np.float32)
+        self.explained_variance_ratio = (np.maximum(eigenvalues[order], 0) / max(eigenvalues.clip(0).sum(), 1e-12)).astype(np.float32)
+        return self
+
+
+def _transform_stored(path_prefix, output_prefix, transform, dimensions, dtype, block_size):
+    vectors = load_vectors(path_prefix, mmap=True)
+    output = np.lib.format.open_memmap(output_prefix + ".npy", mode="w+", dtype=dtype or vectors.dtype,
+                                       shape=(len(vectors), dimensions))
+    for block_start in range(0, len(vectors), block_size):
+        output[block_start:block_start + block_size] = transform(vectors[block_start:block_start + block_size])
+    output.flush()
+    del output
+    shutil.copyfile(path_prefix + ".meta.jsonl", output_prefix + ".meta.jsonl")
+    return len(vectors)
@@ -0,0 +1,187 @@
+#third-party libraries
+import numpy as np
+
+#own libraries
+from embedding.storage import load_vectors
+
+
+METRICS = ("cosine", "dot", "l2")
+
+# Number of corpus vectors scored per matrix multiply
+DEFAULT_BLOCK_SIZE = 65536
+
+
+def normalize(vectors) -> np.ndarray:
+    """
+    Scales each row to unit L2 norm (rows of zeros are left as they are).
+
+    Args:
+        vectors: A (n, d) array-like, or a single (d,) vector.
+
+    Returns:
+        np.ndarray: The normalized float32 vectors.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def top_k(queries, vectors, k: int=10, metric: str="cosine", block_size: int=DEFAULT_BLOCK_SIZE):
+    """
+    Exact top-k search of a batch of queries over a matrix of vectors, scanned in blocks.
+
+    Args:
+        queries: A (q, d) array-like of query vectors, or a single (d,) vector.
+        vectors: A (n, d) array of corpus vectors, e.g. a memory-mapped matrix from load_vectors.
+        k (int, optional): The number of neighbors returned per query. Defaults to 10.
+        metric (str, optional): 'cosine', 'dot' or 'l2'. Defaults to 'cosine'.
+        block_size (int, optional): The number of corpus vectors scored at a time. Defaults to 65536.
+
+    Returns:
+        tuple: (scores, indices), two (q, k) arrays sorted best first. Scores are similarities for
+        'cosine' and 'dot' and squared distances for 'l2'.
+    """
+    return ExactIndex(vectors, metric, block_size).search(queries, k)
+
+
+class ExactIndex:
+    """
+    Exhaustive similarity search over one float32 matrix.
+
+    Queries are scored a batch at a time with a single matrix multiply per block of the corpus, and the
+    best k of each block are selected with argpartition and merged, so memory stays bounded by
+    queries x block_size whatever the corpus size. Rows of NaN (failed embeddings) are never returned.
+
+    Args:
+        vectors: A (n, d) array of corpus vectors.
+        metric (str, optional): 'cosine', 'dot' or 'l2'. Defaults to 'cosine'.
+        block_size (int, optional): The number of corpus vectors scored at a time. Defaults to 65536.
+        normalized (bool, optional): For 'cosine', whether vectors already have unit norm (as OpenAI
+            embeddings do), in which case a memory-mapped matrix is used as is instead of being copied.
+    """
+
+    def __init__(self, vectors, metric: str="cosine", block_size: int=DEFAULT_BLOCK_SIZE, normalized: bool=False):
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric {metric!r}, expected one of {METRICS}")
+        self.metric = metric
+        self.block_size = block_size
+
+        if metric == "cosine" and not normalized:
+            vectors = normalize(vectors)
+        elif not isinstance(vectors, np.ndarray) or vectors.dtype != np.float32:
+            vectors = np.asarray(vectors, dtype=np.float32)
+        self.vectors = vectors
+
+        self._squared_norms = None
+        if metric == "l2":
+            self._squared_norms = np.concatenate([
+                np.einsum("ij,ij->i", block, block)
+                for block in self._blocks()
+            ]) if len(vectors) else np.zeros(0, dtype=np.float32)
+
+    @classmethod
+    def from_storage(cls, path_prefix: str, metric: str="cosine", **kwargs):
+        """
+        Builds an index over the matrix written by embedding.storage.EmbeddingWriter.
+        """
+        return cls(load_vectors(path_prefix, mmap=True), metric, **kwargs)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def search(self, queries, k: int=10):
+        """
+        Returns the k best matches of each query.
+
+        Args:
+            queries: A (q, d) array-like of query vectors, or a single (d,) vector.
+            k (int, optional): The number of neighbors returned per query. Defaults to 10.
+
+        Returns:
+            tuple: (scores, indices), two (q, k) arrays sorted best first (indices are -1 where
+            fewer than k valid vectors exist).
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if self.metric == "cosine":
+            queries = normalize(queries)
+        n_queries = len(queries)
+
+        # keep results as "higher is better" internally and flip the sign back for l2
+        best_scores = np.full((n_queries, 0), -np.inf, dtype=np.float32)
+        best_indices = np.full((n_queries, 0), -1, dtype=np.int64)
+
+        for block_start, block in zip(range(0, len(self.vectors), self.block_size), self._blocks()):
+            scores = self.score_block(queries, block, block_start)
+            np.nan_to_num(scores, copy=False, nan=-np.inf)
+
+            if scores.shape[1] > k:
+                candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, candidates, axis=1)
+            else:
+                candidates = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+
+            best_scores, best_indices = merge_top_k(best_scores, best_indices, scores, candidates + block_start, k)
+
+        return finalize_top_k(best_scores, best_indices, k, self.metric)
+
+    def score_block(self, queries, block, block_start: int=0) -> np.ndarray:
+        """
+        Scores queries against one block of the corpus, higher is better (negated squared distance for 'l2').
+        """
+        scores = queries @ block.T
+        if self.metric == "l2":
+            block_norms = self._squared_norms[block_start:block_start + len(block)]
+            query_norms = np.einsum("ij,ij->i", queries, queries)[:, None]
+            scores = -(query_norms - 2 * scores + block_norms[None, :])
+        return scores
+
+    def _blocks(self):
+        for block_start in range(0, len(self.vectors), self.block_size):
+            yield np.asarray(self.vectors[block_start:block_start + self.block_size], dtype=np.float32)
+
+
+def merge_top_k(scores_a, indices_a, scores_b, indices_b, k: int):
+    """
+    Merges two sets of per-query candidates and keeps the k highest scores of each row (unsorted).
+
+    Args:
+        scores_a, indices_a: (q, m) arrays of scores and indices.
+        scores_b, indices_b: (q, n) arrays of scores and indices.
+        k (int): The number of candidates kept per query.
+
+    Returns:
+        tuple: (scores, indices), two (q, min(k, m + n)) arrays.
+    """
+    scores = np.concatenate([scores_a, scores_b], axis=1)
+    indices = np.concatenate([indices_a, indices_b], axis=1)
+    if scores.shape[1] <= k:
+        return scores, indices
+    keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(scores, keep, axis=1), np.take_along_axis(indices, keep, axis=1)
+
+
+def finalize_top_k(scores, indices, k: int, metric: str):
+    """
+    Sorts merged candidates best first, pads them to k columns and converts scores back to the metric's scale.
+
+    Args:
+        scores: A (q, m) array of "higher is better" scores (negated squared distances for 'l2').
+        indices: The (q, m) array of matching indices.
+        k (int): The number of columns of the result.
+        metric (str): 'cosine', 'dot' or 'l2'.
+
+    Returns:
+        tuple: (scores, indices), two (q, k) arrays sorted best first; indices are -1 where no candidate exists.
+    """
+    order = np.argsort(-scores, axis=1, kind="stable")
+    scores = np.take_along_axis(scores, order, axis=1)
+    indices = np.take_along_axis(indices, order, axis=1)
+
+    # pad when fewer than k valid candidates exist
+    indices = np.where(np.isneginf(scores), -1, indices)
+    if scores.shape[1] < k:
+        padding = k - scores.shape[1]
+        scores = np.pad(scores, ((0, 0), (0, padding)), constant_values=-np.inf)
+        indices = np.pad(indices, ((0, 0), (0, padding)), constant_values=-1)
+
+    return (-scores if metric == "l2" else scores), indices
@@ -0,0 +1,449 @@
+#built-in modules
+import concurrent.futures
+import importlib
+import itertools
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+
+#third-party libraries
+import numpy as np
+
+#own libraries
+from embedding.checkpoint import job_fingerprint
+from embedding.storage import merge_embeddings
+from embedding.streaming import (detect_format, iter_blob_chunks, iter_file_chunks, iter_json_array, iter_json_lines,
+                                 iter_records, iter_windows)
+
+
+# Printed by a worker before the JSON result, so executors can find it in the command output
+RESULT_MARKER = "SHARD_RESULT "
+
+# Shard progress is logged at INFO, retried failures at WARNING and shards that gave up at ERROR
+logger = logging.getLogger(__name__)
+
+
+def plan_record_shards(n_records: int, n_shards: int) -> list[tuple[int, int]]:
+    """
+    Splits n_records records into n_shards consecutive ranges of (almost) the same number of records.
+
+    Returns:
+        list[tuple[int, int]]: The (start, end) range of each non-empty shard.
+    """
+    bounds = np.linspace(0, n_records, min(n_shards, n_records) + 1).round().astype(int)
+    return [(int(start), int(end)) for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def plan_token_shards(token_counts, n_shards: int) -> list[tuple[int, int]]:
+    """
+    Splits records into n_shards consecutive ranges holding about the same number of tokens.
+
+    Embedding time grows with tokens rather than records, so a shard of long rulings is not left
+    running long after the others have finished.
+
+    Args:
+        token_counts: The number of tokens of each record, in order.
+        n_shards (int): The number of shards.
+
+    Returns:
+        list[tuple[int, int]]: The (start, end) range of each non-empty shard.
+    """
+    cumulative = np.cumsum(np.asarray(token_counts, dtype=np.int64))
+    if not len(cumulative):
+        return []
+    targets = cumulative[-1] * np.arange(1, n_shards) / n_shards
+    # cut after the record that reaches each target
+    cuts = np.searchsorted(cumulative, targets, side="left") + 1
+    bounds = np.unique(np.concatenate([[0], np.minimum(cuts, len(cumulative)), [len(cumulative)]]))
+    return [(int(start), int(end)) for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def plan_shards(source: dict, n_shards: int, by: str='tokens', model_name: str='text-embedding-3-small',
+                key: str='text', window_size: int=10000) -> list[dict]:
+    """
+    Reads a corpus once and splits it into shards by record count or by token count.
+
+    Every shard also gets the byte range of its records, so its worker reads only that range
+    instead of parsing all the records before it.
+
+    Args:
+        source (dict): Where the records are: {'path': ...} for a local JSON/JSON Lines file, or
+            {'account_url': ..., 'container_name': ..., 'blob_name': ...} for a blob.
+        n_shards (int): The number of shards, usually the number of workers.
+        by (str, optional): 'records' or 'tokens'. Defaults to 'tokens'.
+        model_name (str, optional): The OpenAI model whose tokenizer counts the tokens. Defaults to 'text-embedding-3-small'.
+        key (str, optional): The key of the text in each record. Defaults to 'text'.
+        window_size (int, optional): The number of records tokenized at a time. Defaults to 10000.
+
+    Returns:
+        list[dict]: One shard per range, with 'index', 'start', 'end', 'records', 'tokens', 'offset' and
+        'end_offset' (the byte range of its records, end_offset None for the last shard) and 'format' ('array' or 'lines').
+    """
+    if by not in ("records", "tokens"):
+        raise ValueError(f"Unknown shard criterion {by!r}, expected 'records' or 'tokens'")
+
+    if by == "tokens":
+        # imported here because openai_functions creates the OpenAI clients when it is imported
+        from embedding.openai_functions import count_tokens_each
+
+    format, chunks = detect_format(iter_source_chunks(source))
+    records = iter_json_array(chunks, offsets=True) if format == "array" else iter_json_lines(chunks, offsets=True)
+    token_counts, offsets = [], []
+    for window in iter_windows(records, window_size):
+        offsets.extend(offset for offset, _ in window)
+        texts = [record.get(key, "") for _, record in window]
+        token_counts.extend(count_tokens_each(texts, model_name) if by == "tokens" else [0] * len(texts))
+
+    if by == "tokens":
+        ranges = plan_token_shards(token_counts, n_shards)
+    else:
+        ranges = plan_record_shards(len(token_counts), n_shards)
+    return [{"index": index, "start": start, "end": end, "records": end - start,
+             "tokens": int(sum(token_counts[start:end])), "offset": offsets[start],
+             "end_offset": offsets[end] if end < len(offsets) else None, "format": format}
+            for index, (start, end) in enumerate(ranges)]
+
+
+def iter_source_chunks(source: dict, offset: int=0, end_offset: int=None):
+    """
+    Streams the bytes [offset:end_offset] of a local file ({'path': ...}) or of a blob
+    ({'account_url', 'container_name', 'blob_name'}).
+    """
+    length = end_offset - offset if end_offset is not None else None
+    if "path" in source:
+        return iter_file_chunks(source["path"], offset=offset, length=length)
+    return iter_blob_chunks(source["account_url"], source["container_name"], source["blob_name"],
+                            credential=source.get("credential"), offset=offset, length=length)
+
+
+def iter_source_records(source: dict, start: int=0, end: int=None, offset: int=None, end_offset: int=None,
+                        format: str=None):
+    """
+    Streams records[start:end] of a local file or of a blob (see iter_source_chunks).
+
+    Args:
+        source (dict): Where the records are (see plan_shards).
+        start (int, optional): The index of the first record. Defaults to 0.
+        end (int, optional): The index after the last record, or None for the end. Defaults to None.
+        offset (int, optional): The byte offset of records[start], as planned by plan_shards. Without it the
+            records before start are read and skipped. Defaults to None.
+        end_offset (int, optional): The byte offset of records[end], or None to read to the end. Defaults to None.
+        format (str, optional): 'array' or 'lines', needed with offset. Defaults to None.
+
+    Yields:
+        dict: The records, in order.
+    """
+    if offset is None:
+        return itertools.islice(iter_records(iter_source_chunks(source)), start, end)
+
+    chunks = iter_source_chunks(source, offset, end_offset)
+    records = iter_json_array(chunks, resume=True) if format == "array" else iter_json_lines(chunks)
+    return itertools.islice(records, None if end is None else end - start)
+
+
+def run_shard(spec: dict) -> dict:
+    """
+    Embeds one shard and saves it with save_embeddings; this is what every worker runs.
+
+    Args:
+        spec (dict): The shard, as built by ShardCoordinator: 'index', 'start', 'end', 'source',
+            'output_prefix', 'provider' (see load_provider), 'model_name', 'key',
+            'options' (passed on to the stream of the provider),
+            and optionally 'dtype', 'metrics_log' and 'upload' ({'account_url', 'container_name'}
+            to copy the outputs to blob storage, for workers that do not share a disk with the coordinator).
+
+    Returns:
+        dict: The shard index, the number of records written, the seconds spent and the output prefix.
+    """
+    # imported here so the coordinator does not load the models or the OpenAI clients
+    from embedding.blob_transfer import upload_file_if_changed
+    from embedding.metrics import PipelineMetrics, set_metrics
+    from embedding.storage import save_embeddings
+
+    start = time.perf_counter()
+    metrics = PipelineMetrics(log_path=spec["metrics_log"]) if spec.get("metrics_log") else None
+    previous = set_metrics(metrics)
+    try:
+        records = iter_source_records(spec["source"], spec["start"], spec["end"], spec.get("offset"),
+                                      spec.get("end_offset"), spec.get("format"))
+        stream = load_provider(spec.get("provider", "openai"))
+        records = stream(records, spec["model_name"], spec.get("key", "text"), **spec.get("options", {}))
+
+        os.makedirs(os.path.dirname(os.path.abspath(spec["output_prefix"])), exist_ok=True)
+        count = save_embeddings(records, spec["output_prefix"], spec.get("dtype", "float32"))
+    finally:
+        set_metrics(previous)
+        if metrics is not None:
+            metrics.close()
+
+    upload = spec.get("upload")
+    if upload:
+        for extension in (".npy", ".meta.jsonl"):
+            blob_name = os.path.basename(spec["output_prefix"]) + extension
+            if upload_file_if_changed(spec["output_prefix"] + extension, upload["account_url"],
+                                      upload["container_name"], blob_name) is None:
+                raise RuntimeError(f"Could not upload {blob_name}")
+
+    return {"index": spec["index"], "count": count, "seconds": time.perf_counter() - start,
+            "output_prefix": spec["output_prefix"]}
+
+
+def load_provider(provider: str):
+    """
+    Returns the function that embeds a stream of records for a provider.
+
+    Args:
+        provider (str): 'openai' (stream_openai_embeddings), 'huggingface' (stream_huggingface_embeddings), or
+            'package.module:function' for any function with their signature, (records, model_name, key, **options),
+            yielding the records with their embedding; the module must be importable by the workers.
+
+    Returns:
+        The stream function.
+    """
+    if provider in ("openai", "huggingface"):
+        from embedding.embedding import stream_huggingface_embeddings, stream_openai_embeddings
+
+        return stream_openai_embeddings if provider == "openai" else stream_huggingface_embeddings
+
+    module_name, _, function_name = provider.partition(":")
+    if not function_name:
+        raise ValueError(f"Unknown provider {provider!r}, expected 'openai', 'huggingface' or 'package.module:function'")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def parse_shard_result(output: str) -> dict:
+    """
+    Returns the result a worker printed after RESULT_MARKER, or None if there is none.
+    """
+    for line in reversed(output.splitlines()):
+        if line.startswith(RESULT_MARKER):
+            return json.loads(line[len(RESULT_MARKER):])
+    return None
+
+
+class ShardExecutor:
+    """
+    Where the shards run. Subclasses implement submit, which starts one shard and returns a
+    concurrent.futures.Future resolving to the result of run_shard, or raising if the shard failed.
+    """
+
+    def submit(self, spec: dict) -> concurrent.futures.Future:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class LocalSubprocessExecutor(ShardExecutor):
+    """
+    Runs each shard in a separate Python process on this machine (`python -m embedding.sharding <spec>`).
+
+    Args:
+        max_workers (int, optional): The number of shards running at the same time. Defaults to 2.
+        python (str, optional): The Python interpreter. Defaults to the current one.
+        env (dict, optional): Extra environment variables of the workers. Defaults to None.
+        timeout (float, optional): The seconds after which a shard is killed and counted as failed. Defaults to None.
+    """
+
+    def __init__(self, max_workers: int=2, python: str=sys.executable, env: dict=None, timeout: float=None):
+        self.python = python
+        self.env = {**os.environ, **(env or {})}
+        self.timeout = timeout
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+
+    def submit(self, spec: dict) -> concurrent.futures.Future:
+        return self._executor.submit(self._run, spec)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def _run(self, spec):
+        completed = subprocess.run([self.python, "-m", "embedding.sharding", json.dumps(spec)], env=self.env,
+                                   capture_output=True, text=True, timeout=self.timeout)
+        result = parse_shard_result(completed.stdout)
+        if completed.returncode != 0 or result is None:
+            raise RuntimeError(f"Shard {spec['index']} exited with code {completed.returncode}: "
+                               f"{completed.stderr.strip()[-2000:]}")
+        return result
+
+
+class ShardCoordinator:
+    """
+    Dispatches shards to an executor, retries failed shards and merges the outputs in order.
+
+    The state of every shard (pending, running, done or failed, attempts, seconds) is kept in
+    state_path, so running the same job again only dispatches the shards that are not done.
+    The state also records the fingerprint of the job (model, source, provider, key, dtype and options);
+    when it changes, every shard starts over instead of reusing outputs of another job.
+    A failed shard is submitted again, which lets the executor hand it to another worker, until
+    it has failed max_attempts times.
+
+    Args:
+        executor (ShardExecutor): Runs the shards.
+        work_dir (str): The directory of the shard outputs and of the state file.
+        max_attempts (int, optional): The number of times a shard is tried before giving up. Defaults to 3.
+    """
+
+    def __init__(self, executor: ShardExecutor, work_dir: str, max_attempts: int=3):
+        self.executor = executor
+        self.work_dir = work_dir
+        self.max_attempts = max_attempts
+        self.state_path = os.path.join(work_dir, "shards.json")
+        os.makedirs(work_dir, exist_ok=True)
+
+    def make_specs(self, shards: list[dict], source: dict, model_name: str, provider: str='openai',
+                   key: str='text', dtype: str='float32', upload: dict=None, **options) -> list[dict]:
+        """
+        Turns planned shards into the specs run by run_shard, writing to work_dir/shard-00000.
+
+        Args:
+            shards (list[dict]): The shards returned by plan_shards.
+            source (dict): Where the records are (see plan_shards).
+            model_name (str): The embedding model.
+            provider (str, optional): 'openai', 'huggingface' or 'package.module:function' (see load_provider). Defaults to 'openai'.
+            key (str, optional): The key of the text in each record. Defaults to 'text'.
+            dtype (str, optional): The dtype of the stored vectors. Defaults to 'float32'.
+            upload (dict, optional): {'account_url', 'container_name'} where remote workers copy their outputs. Defaults to None.
+            **options: Passed on to stream_openai_embeddings or stream_huggingface_embeddings (batch_size, checkpoint_dir...).
+
+        Returns:
+            list[dict]: One spec per shard.
+        """
+        return [{**shard, "source": source, "model_name": model_name, "provider": provider, "key": key,
+                 "dtype": dtype, "options": options, "upload": upload,
+                 "output_prefix": os.path.join(self.work_dir, f"shard-{shard['index']:05d}"),
+                 "metrics_log": os.path.join(self.work_dir, f"shard-{shard['index']:05d}.metrics.jsonl")}
+                for shard in shards]
+
+    def run(self, specs: list[dict]) -> list[dict]:
+        """
+        Runs every shard that is not done yet and waits for all of them.
+
+        Returns:
+            list[dict]: The state of each shard, in shard order; 'result' holds what run_shard returned.
+        """
+        state = self._load_state(specs)
+        futures = {}
+        for spec in specs:
+            if state[spec["index"]]["status"] != "done":
+                futures[self._submit(spec, state)] = spec
+        self._save_state(state)
+
+        while futures:
+            done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                spec = futures.pop(future)
+                shard = state[spec["index"]]
+                shard["seconds"] = time.time() - shard.pop("started")
+                try:
+                    shard["result"] = future.result()
+                    shard["status"] = "done"
+                    shard.pop("error", None)
+                    logger.info("Shard %d done: %d records in %.1fs", spec["index"], shard["result"]["count"],
+                                shard["seconds"])
+                except Exception as e:
+                    shard["error"] = str(e)
+                    if shard["attempts"] < self.max_attempts:
+                        logger.warning("Shard %d failed (attempt %d), retrying: %s", spec["index"], shard["attempts"], e)
+                        futures[self._submit(spec, state)] = spec
+                    else:
+                        logger.error("Shard %d failed (attempt %d), giving up: %s", spec["index"], shard["attempts"], e)
+                        shard["status"] = "failed"
+                self._save_state(state)
+
+        return [state[spec["index"]] for spec in specs]
+
+    def merge(self, specs: list[dict], output_prefix: str) -> int:
+        """
+        Concatenates the outputs of the shards, in shard order, with merge_embeddings.
+
+        Returns:
+            int: The number of records written, or None if some shard is not done.
+        """
+        state = self._load_state(specs)
+        missing = [spec["index"] for spec in specs if state[spec["index"]]["status"] != "done"]
+        if missing:
+            logger.error("Cannot merge, shards not done: %s", missing)
+            return None
+        return merge_embeddings([spec["output_prefix"] for spec in specs], output_prefix)
+
+    def _submit(self, spec, state):
+        shard = state[spec["index"]]
+        shard["status"] = "running"
+        shard["attempts"] += 1
+        shard["started"] = time.time()
+        return self.executor.submit(spec)
+
+    def _load_state(self, specs):
+        self.fingerprint = _specs_fingerprint(specs)
+        state = {}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            # outputs of a job with another model, source or options are not reused
+            if isinstance(saved, dict) and saved.get("fingerprint") == self.fingerprint:
+                state = {shard["index"]: shard for shard in saved["shards"]}
+        for spec in specs:
+            shard = state.get(spec["index"])
+            # a shard planned differently since the last run starts over
+            if shard is None or (shard["start"], shard["end"]) != (spec["start"], spec["end"]):
+                state[spec["index"]] = {"index": spec["index"], "start": spec["start"], "end": spec["end"],
+                                        "status": "pending", "attempts": 0}
+        return state
+
+    def _save_state(self, state):
+        shards = [{k: v for k, v in shard.items() if k != "started"} for _, shard in sorted(state.items())]
+        with open(self.state_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"fingerprint": self.fingerprint, "shards": shards}, f, indent=2)
+        os.replace(self.state_path + ".tmp", self.state_path)
+
+
+def run_sharded(source: dict, model_name: str, output_prefix: str, executor: ShardExecutor, n_shards: int,
+                work_dir: str='shards', by: str='tokens', provider: str='openai', key: str='text',
+                max_attempts: int=3, **options) -> int:
+    """
+    Plans the shards of a corpus, runs them on executor and merges the outputs in order.
+
+    Args:
+        source (dict): Where the records are (see plan_shards).
+        model_name (str): The embedding model.
+        output_prefix (str): The path of the merged output, without extension (see save_embeddings).
+        executor (ShardExecutor): Runs the shards, e.g. LocalSubprocessExecutor or compute.RunCommandExecutor.
+        n_shards (int): The number of shards.
+        work_dir (str, optional): The directory of the shard outputs and state. Defaults to 'shards'.
+        by (str, optional): Shard by 'tokens' or by 'records'. Defaults to 'tokens'.
+        provider (str, optional): 'openai', 'huggingface' or 'package.module:function' (see load_provider). Defaults to 'openai'.
+        key (str, optional): The key of the text in each record. Defaults to 'text'.
+        max_attempts (int, optional): The number of times a shard is tried. Defaults to 3.
+        **options: Passed on to ShardCoordinator.make_specs (dtype, upload, batch_size, checkpoint_dir...).
+
+    Returns:
+        int: The number of records written, or None if some shard failed.
+    """
+    tokenizer_model = model_name if provider == "openai" else "text-embedding-3-small"
+    shards = plan_shards(source, n_shards, by, tokenizer_model, key)
+    coordinator = ShardCoordinator(executor, work_dir, max_attempts)
+    specs = coordinator.make_specs(shards, source, model_name, provider, key, **options)
+    coordinator.run(specs)
+    return coordinator.merge(specs, output_prefix)
+
+
+def _specs_fingerprint(specs):
+    # everything the shards share that changes their vectors; the ranges are compared shard by shard
+    job = specs[0] if specs else {}
+    return job_fingerprint([], job.get("model_name"), source=job.get("source"), provider=job.get("provider"),
+                           key=job.get("key"), dtype=job.get("dtype"), options=job.get("options"))
+
+
+if __name__ == "__main__":
+    # worker entry point: python -m embedding.sharding '<spec as JSON>'
+    print(RESULT_MARKER + json.dumps(run_shard(json.loads(sys.argv[1]))), flush=True)
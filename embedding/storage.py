@@ -0,0 +1,237 @@
+#built-in modules
+import json
+
+#third-party libraries
+import numpy as np
+
+#own libraries
+from embedding.streaming import iter_blob_records, iter_file_records
+
+
+# Fixed size of the .npy header, so the shape can be rewritten in place once the row count is known
+_NPY_HEADER_SIZE = 128
+
+
+class EmbeddingWriter:
+    """
+    Writes embedded records incrementally as a contiguous .npy matrix plus a JSON Lines metadata sidecar.
+
+    Row i of <path_prefix>.npy holds the embedding of line i of <path_prefix>.meta.jsonl, which holds
+    every field of the record except the embedding. Records whose embedding failed (None, [] or [None])
+    are written as a row of NaN so rows and metadata stay aligned.
+
+    Args:
+        path_prefix (str): The path of the output files, without extension.
+        dtype (str, optional): The dtype of the stored vectors, 'float32' or 'float16'. Defaults to 'float32'.
+        key (str, optional): The key of the embedding in each record. Defaults to 'embedding'.
+    """
+
+    def __init__(self, path_prefix: str, dtype: str='float32', key: str='embedding'):
+        self.path_prefix = path_prefix
+        self.dtype = np.dtype(dtype)
+        self.key = key
+        self.dimensions = None
+        self.count = 0
+        self._pending = []
+
+        self._vectors = open(path_prefix + ".npy", "wb")
+        self._vectors.write(_npy_header(self.dtype, 0, 0))
+        self._metadata = open(path_prefix + ".meta.jsonl", "w", encoding="utf-8")
+
+    def write(self, record: dict):
+        """
+        Appends one record.
+        """
+        embedding = record.get(self.key)
+        if embedding is not None and (len(embedding) == 0 or embedding[0] is None):
+            embedding = None
+
+        metadata = {k: v for k, v in record.items() if k != self.key}
+        self._metadata.write(json.dumps(metadata, ensure_ascii=False) + "\n")
+
+        # the width of the matrix is only known once a valid embedding has been seen
+        if self.dimensions is None:
+            if embedding is None:
+                self._pending.append(None)
+                return
+            self.dimensions = len(embedding)
+            for _ in self._pending:
+                self._write_row(None)
+            self._pending = []
+        self._write_row(embedding)
+
+    def write_many(self, records):
+        """
+        Appends every record of an iterable.
+        """
+        for record in records:
+            self.write(record)
+
+    def close(self):
+        """
+        Flushes the files and writes the final shape into the .npy header.
+        """
+        if self._vectors.closed:
+            return
+        # only failed records: store them with zero width
+        self.count += len(self._pending)
+        self._vectors.seek(0)
+        self._vectors.write(_npy_header(self.dtype, self.count, self.dimensions or 0))
+        self._vectors.close()
+        self._metadata.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _write_row(self, embedding):
+        if embedding is None:
+            row = np.full(self.dimensions, np.nan, dtype=self.dtype)
+        else:
+            row = np.asarray(embedding, dtype=self.dtype)
+            if row.shape != (self.dimensions,):
+                raise ValueError(f"Expected an embedding of {self.dimensions} dimensions, got {row.shape}")
+        self._vectors.write(row.tobytes())
+        self.count += 1
+
+
+def save_embeddings(records, path_prefix: str, dtype: str='float32', key: str='embedding'):
+    """
+    Saves embedded records as a .npy matrix plus a JSON Lines metadata sidecar.
+
+    Args:
+        records: An iterable of dictionaries holding an embedding under key.
+        path_prefix (str): The path of the output files, without extension.
+        dtype (str, optional): The dtype of the stored vectors, 'float32' or 'float16'. Defaults to 'float32'.
+        key (str, optional): The key of the embedding in each record. Defaults to 'embedding'.
+
+    Returns:
+        int: The number of records written.
+    """
+    with EmbeddingWriter(path_prefix, dtype, key) as writer:
+        writer.write_many(records)
+    return writer.count
+
+
+def load_vectors(path_prefix: str, mmap: bool=True) -> np.ndarray:
+    """
+    Opens the embedding matrix written by EmbeddingWriter.
+
+    Args:
+        path_prefix (str): The path of the files, without extension.
+        mmap (bool, optional): Whether to memory-map the matrix instead of reading it. Defaults to True.
+
+    Returns:
+        np.ndarray: A (records, dimensions) matrix; failed records are rows of NaN.
+    """
+    return np.load(path_prefix + ".npy", mmap_mode="r" if mmap else None)
+
+
+def iter_metadata(path_prefix: str):
+    """
+    Yields the metadata of each record written by EmbeddingWriter, in row order.
+    """
+    with open(path_prefix + ".meta.jsonl", "r", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def load_embeddings(path_prefix: str, mmap: bool=True):
+    """
+    Loads the embedding matrix and the metadata written by EmbeddingWriter.
+
+    Args:
+        path_prefix (str): The path of the files, without extension.
+        mmap (bool, optional): Whether to memory-map the matrix instead of reading it. Defaults to True.
+
+    Returns:
+        tuple: The (records, dimensions) matrix and the list of metadata dictionaries.
+    """
+    return load_vectors(path_prefix, mmap), list(iter_metadata(path_prefix))
+
+
+def convert_json_embeddings(json_path: str, path_prefix: str, dtype: str='float32', key: str='embedding'):
+    """
+    Converts a local JSON (or JSON Lines) embedding file to the binary format, streaming it record by record.
+
+    Args:
+        json_path (str): The path of the JSON embedding file, as written by save_data.
+        path_prefix (str): The path of the output files, without extension.
+        dtype (str, optional): The dtype of the stored vectors, 'float32' or 'float16'. Defaults to 'float32'.
+        key (str, optional): The key of the embedding in each record. Defaults to 'embedding'.
+
+    Returns:
+        int: The number of records converted.
+    """
+    return save_embeddings(iter_file_records(json_path), path_prefix, dtype, key)
+
+
+def convert_json_embeddings_blob(account_url: str, container_name: str, blob_name: str, path_prefix: str,
+                                 dtype: str='float32', key: str='embedding', credential=None):
+    """
+    Converts a JSON embedding blob (e.g. jurisprudencia-embeddings_openai_large-2023.json) to the binary format,
+    streaming it record by record.
+
+    Args:
+        account_url (str): The URL of the Azure storage account.
+        container_name (str): The name of the container where the blob resides.
+        blob_name (str): The name of the JSON embedding blob.
+        path_prefix (str): The path of the output files, without extension.
+        dtype (str, optional): The dtype of the stored vectors, 'float32' or 'float16'. Defaults to 'float32'.
+        key (str, optional): The key of the embedding in each record. Defaults to 'embedding'.
+        credential (optional): The credential for the storage account. Defaults to the shared credential from embedding.clients.
+
+    Returns:
+        int: The number of records converted.
+    """
+    records = iter_blob_records(account_url, container_name, blob_name, credential=credential)
+    return save_embeddings(records, path_prefix, dtype, key)
+
+
+def merge_embeddings(path_prefixes: list[str], output_prefix: str, block_size: int=65536) -> int:
+    """
+    Concatenates files written by EmbeddingWriter, in the given order, into one matrix and metadata sidecar.
+
+    The matrices are copied block by block, so the inputs do not need to fit in memory. An input with
+    only failed records (zero width) contributes rows of NaN.
+
+    Args:
+        path_prefixes (list[str]): The paths of the input files, without extension, in output order.
+        output_prefix (str): The path of the output files, without extension.
+        block_size (int, optional): The number of rows copied at a time. Defaults to 65536.
+
+    Returns:
+        int: The number of records written.
+    """
+    matrices = [load_vectors(path_prefix) for path_prefix in path_prefixes]
+    dtypes = {matrix.dtype for matrix in matrices}
+    dimensions = {matrix.shape[1] for matrix in matrices if matrix.shape[1]}
+    if len(dtypes) > 1 or len(dimensions) > 1:
+        raise ValueError(f"Cannot merge embeddings of dtypes {sorted(map(str, dtypes))} and dimensions {sorted(dimensions)}")
+    dtype = dtypes.pop() if dtypes else np.dtype("float32")
+    columns = dimensions.pop() if dimensions else 0
+    rows = sum(len(matrix) for matrix in matrices)
+
+    with open(output_prefix + ".npy", "wb") as f:
+        f.write(_npy_header(dtype, rows, columns))
+        for matrix in matrices:
+            for start in range(0, len(matrix), block_size):
+                block = matrix[start:start + block_size]
+                if block.shape[1] != columns:
+                    block = np.full((len(block), columns), np.nan, dtype=dtype)
+                f.write(np.ascontiguousarray(block).tobytes())
+
+    with open(output_prefix + ".meta.jsonl", "w", encoding="utf-8") as f:
+        for path_prefix in path_prefixes:
+            with open(path_prefix + ".meta.jsonl", "r", encoding="utf-8") as shard:
+                for line in shard:
+                    f.write(line)
+    return rows
+
+
+def _npy_header(dtype, rows, columns):
+    header = repr({"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": (rows, columns)})
+    prefix = b"\x93NUMPY\x01\x00" + (_NPY_HEADER_SIZE - 10).to_bytes(2, "little")
+    return prefix + header.encode("latin1").ljust(_NPY_HEADER_SIZE - 11) + b"\n"
@@ -0,0 +1,280 @@
+#built-in modules
+import codecs
+import json
+import re
+import time
+
+#own libraries
+from embedding.clients import get_blob_service_client
+from embedding.metrics import get_metrics
+
+
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+
+_WHITESPACE = re.compile(r"\s*")
+_DELIMITERS = {",", "]", " ", "\t", "\r", "\n"}
+
+
+def iter_blob_chunks(account_url: str, container_name: str, blob_name: str,
+                     chunk_size: int=DEFAULT_CHUNK_SIZE, credential=None, offset: int=0, length: int=None):
+    """
+    Downloads a blob from Azure Blob Storage in chunks, without holding the whole blob in memory.
+
+    Args:
+        account_url (str): The URL of the Azure storage account (or of a local emulator such as Azurite).
+        container_name (str): The name of the container where the blob resides.
+        blob_name (str): The name of the blob to download.
+        chunk_size (int, optional): The size in bytes of each downloaded chunk. Defaults to 4 MiB.
+        credential (optional): The credential for the storage account. Defaults to the shared credential from embedding.clients.
+        offset (int, optional): The byte of the blob the download starts at. Defaults to 0.
+        length (int, optional): The number of bytes to download, or None for the rest of the blob. Defaults to None.
+
+    Yields:
+        bytes: Consecutive chunks of the blob content.
+    """
+    blob_service_client = get_blob_service_client(account_url, credential,
+                                                  max_single_get_size=chunk_size, max_chunk_get_size=chunk_size)
+    blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
+
+    # the chunks are consumed lazily, so each download is recorded as a batch of the stage
+    metrics = get_metrics()
+    start = time.perf_counter()
+    for chunk in blob_client.download_blob(offset=offset or None, length=length).chunks():
+        metrics.record_batch('download', time.perf_counter() - start, bytes=len(chunk))
+        yield chunk
+        start = time.perf_counter()
+
+
+def iter_file_chunks(path: str, chunk_size: int=DEFAULT_CHUNK_SIZE, offset: int=0, length: int=None):
+    """
+    Reads a local file in chunks.
+
+    Args:
+        path (str): The path of the file.
+        chunk_size (int, optional): The size in bytes of each chunk. Defaults to 4 MiB.
+        offset (int, optional): The byte of the file the reading starts at. Defaults to 0.
+        length (int, optional): The number of bytes to read, or None for the rest of the file. Defaults to None.
+
+    Yields:
+        bytes: Consecutive chunks of the file content.
+    """
+    remaining = length if length is not None else float("inf")
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while remaining and (chunk := f.read(int(min(chunk_size, remaining)))):
+            remaining -= len(chunk)
+            yield chunk
+
+
+def iter_json_array(chunks, offsets: bool=False, resume: bool=False):
+    """
+    Incrementally parses a JSON array split across byte chunks, yielding one element at a time.
+
+    Only the current chunk and the element being parsed are kept in memory.
+
+    Args:
+        chunks: An iterable of bytes holding a UTF-8 encoded JSON array.
+        offsets (bool, optional): Whether (byte offset, element) pairs are yielded, the offset being where
+            the element starts in the chunks. Defaults to False.
+        resume (bool, optional): Whether the chunks start at an element inside the array (e.g. at an offset
+            yielded before) rather than at the opening '['. Defaults to False.
+
+    Yields:
+        The elements of the array, in order.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buffer, position, eof = "", 0, False
+    started, expect_value = resume, True
+    # the byte offset of buffer[mark], moved forward with the position so offsets cost linear time
+    mark, mark_offset = 0, 0
+
+    def read_more():
+        nonlocal buffer, position, eof, mark, mark_offset
+        if offsets:
+            mark_offset += len(buffer[mark:position].encode("utf-8"))
+        buffer, position, eof = _read_more(chunks, text_decoder, buffer, position)
+        mark = 0
+
+    while True:
+        position = _WHITESPACE.match(buffer, position).end()
+
+        if position == len(buffer):
+            if eof:
+                raise json.JSONDecodeError("Unterminated JSON array", buffer, position)
+            read_more()
+            continue
+
+        if not started:
+            # a leading byte order mark
+            if buffer[position] == "\ufeff":
+                position += 1
+                continue
+            if buffer[position] != "[":
+                raise json.JSONDecodeError("Expecting '['", buffer, position)
+            started, position = True, position + 1
+            continue
+
+        if buffer[position] == "]":
+            return
+
+        if not expect_value:
+            if buffer[position] != ",":
+                raise json.JSONDecodeError("Expecting ',' delimiter", buffer, position)
+            position, expect_value = position + 1, True
+            continue
+
+        try:
+            value, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            read_more()
+            continue
+
+        # a number may continue in the next chunk ("-1" of "-1.5"), so it needs a delimiter after it
+        if not eof and not isinstance(value, (dict, list, str)) and buffer[end:end + 1] not in _DELIMITERS:
+            read_more()
+            continue
+
+        if offsets:
+            mark_offset += len(buffer[mark:position].encode("utf-8"))
+            mark = position
+            yield mark_offset, value
+        else:
+            yield value
+        position, expect_value = end, False
+
+
+def iter_json_lines(chunks, offsets: bool=False):
+    """
+    Parses JSON Lines split across byte chunks, yielding one record per non-empty line.
+
+    Args:
+        chunks: An iterable of bytes holding UTF-8 encoded JSON Lines.
+        offsets (bool, optional): Whether (byte offset, record) pairs are yielded, the offset being where
+            the line of the record starts in the chunks. Defaults to False.
+
+    Yields:
+        The parsed records, in order.
+    """
+    pending, offset = b"", 0
+    for chunk in chunks:
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            if _strip_bom(line, offset).strip():
+                yield (offset, json.loads(line)) if offsets else json.loads(line)
+            offset += len(line) + 1
+    if _strip_bom(pending, offset).strip():
+        yield (offset, json.loads(pending)) if offsets else json.loads(pending)
+
+
+def detect_format(chunks) -> tuple:
+    """
+    Detects whether chunks hold a JSON array or JSON Lines from their first non-blank byte.
+
+    Args:
+        chunks: An iterable of bytes, as returned by iter_blob_chunks or iter_file_chunks.
+
+    Returns:
+        tuple: 'array' or 'lines', and an iterator over the same chunks (the ones read to detect the format included).
+    """
+    chunks = iter(chunks)
+    head = b""
+    for chunk in chunks:
+        head += chunk
+        if head.lstrip(b"\xef\xbb\xbf \t\r\n"):
+            break
+
+    def replay():
+        yield head
+        yield from chunks
+
+    return ("array" if head.lstrip(b"\xef\xbb\xbf \t\r\n").startswith(b"[") else "lines"), replay()
+
+
+def iter_records(chunks, offsets: bool=False):
+    """
+    Yields the records of a JSON array or of JSON Lines, detecting the format from the first byte.
+
+    Args:
+        chunks: An iterable of bytes, as returned by iter_blob_chunks or iter_file_chunks.
+        offsets (bool, optional): Whether (byte offset, record) pairs are yielded (see iter_json_array). Defaults to False.
+
+    Yields:
+        dict: The records, in order.
+    """
+    format, chunks = detect_format(chunks)
+    if format == "array":
+        yield from iter_json_array(chunks, offsets)
+    else:
+        yield from iter_json_lines(chunks, offsets)
+
+
+def iter_blob_records(account_url: str, container_name: str, blob_name: str,
+                      chunk_size: int=DEFAULT_CHUNK_SIZE, credential=None):
+    """
+    Streams the records of a JSON array or JSON Lines blob, one at a time.
+
+    Args:
+        account_url (str): The URL of the Azure storage account (or of a local emulator such as Azurite).
+        container_name (str): The name of the container where the blob resides.
+        blob_name (str): The name of the blob to read.
+        chunk_size (int, optional): The size in bytes of each downloaded chunk. Defaults to 4 MiB.
+        credential (optional): The credential for the storage account. Defaults to the shared credential from embedding.clients.
+
+    Yields:
+        dict: The records of the blob, in order.
+    """
+    yield from iter_records(iter_blob_chunks(account_url, container_name, blob_name, chunk_size, credential))
+
+
+def iter_file_records(path: str, chunk_size: int=DEFAULT_CHUNK_SIZE):
+    """
+    Streams the records of a local JSON array or JSON Lines file, one at a time.
+
+    Args:
+        path (str): The path of the file.
+        chunk_size (int, optional): The size in bytes of each chunk read. Defaults to 4 MiB.
+
+    Yields:
+        dict: The records of the file, in order.
+    """
+    yield from iter_records(iter_file_chunks(path, chunk_size))
+
+
+def iter_windows(records, window_size: int):
+    """
+    Groups an iterable of records into lists of at most window_size records.
+
+    Args:
+        records: An iterable of records.
+        window_size (int): The maximum number of records per window.
+
+    Yields:
+        list: Consecutive windows of records.
+    """
+    window = []
+    for record in records:
+        window.append(record)
+        if len(window) == window_size:
+            yield window
+            window = []
+    if window:
+        yield window
+
+
+def _read_more(chunks, text_decoder, buffer, position):
+    # drop what has already been parsed so the buffer stays bounded
+    buffer = buffer[position:]
+    chunk = next(chunks, None)
+    if chunk is None:
+        return buffer + text_decoder.decode(b"", final=True), 0, True
+    return buffer + text_decoder.decode(chunk), 0, False
+
+
+def _strip_bom(line, offset):
+    # a byte order mark can only start the first line; json.loads drops it from a line with a record
+    return line[len(codecs.BOM_UTF8):] if offset == 0 and line.startswith(codecs.BOM_UTF8) else line
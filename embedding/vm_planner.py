@@ -0,0 +1,260 @@
+#built-in modules
+import json
+import math
+import os
+import re
+import time
+
+#third-party libraries
+import requests
+
+
+# Public endpoint of the Azure retail prices, no authentication needed
+RETAIL_PRICES_URL = "https://prices.azure.com/api/retail/prices"
+
+# GPU model of the GPU VM families, matched against the SKU name
+GPU_MODELS = (
+    (r"_T4_", "T4"),
+    (r"_A10_", "A10"),
+    (r"A100", "A100"),
+    (r"H100", "H100"),
+    (r"^Standard_NC\d+s_v3$", "V100"),
+    (r"^Standard_NV\d+s_v3$", "M60"),
+)
+
+
+def calibrate_cpu_throughput(model_name: str, texts: list[str], core_counts: list[int]=None, batch_size: int=32,
+                             max_tokens_per_batch: int=16384, **model_kwargs) -> dict:
+    """
+    Measures how many tokens per second one CPUEncoderPool worker encodes with each number of cores.
+
+    Run it on a sample of the corpus (a few hundred chunks is enough). The result feeds plan_vm_size,
+    which scales it to the core counts of the Azure VM sizes.
+
+    Args:
+        model_name (str): The Hugging Face model id or local path.
+        texts (list[str]): A representative sample of the texts to embed.
+        core_counts (list[int], optional): The thread counts to measure. Defaults to the powers of two up to the local cores.
+        batch_size (int, optional): The maximum number of texts per batch. Defaults to 32.
+        max_tokens_per_batch (int, optional): The maximum number of padded tokens per batch. Defaults to 16384.
+        **model_kwargs: Other SentenceTransformer arguments, e.g. trust_remote_code=True.
+
+    Returns:
+        dict: {cores: tokens per second}.
+    """
+    # imported here so planning from a saved calibration does not need torch
+    from embedding.cpu_pool import CPUEncoderPool
+    from embedding.models import count_model_tokens, get_tokenizer, plan_length_batches
+
+    if core_counts is None:
+        cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+        core_counts = [2 ** i for i in range(int(math.log2(cores)) + 1)]
+
+    token_counts = count_model_tokens(get_tokenizer(model_name), texts)
+    batches = [[texts[i] for i in batch] for batch in plan_length_batches(token_counts, max_tokens_per_batch, batch_size)]
+
+    throughput = {}
+    for cores in core_counts:
+        with CPUEncoderPool(model_name, n_workers=1, threads_per_worker=cores, **model_kwargs) as pool:
+            # the first batch also loads the model
+            list(pool.imap(batches[:1]))
+            start = time.perf_counter()
+            list(pool.imap(batches))
+            throughput[cores] = float(token_counts.sum()) / (time.perf_counter() - start)
+        print(f"{cores} cores: {throughput[cores]:.0f} tokens/s")
+    return throughput
+
+
+def calibrate_gpu_throughput(model_name: str, texts: list[str], batch_size: int=64,
+                             max_tokens_per_batch: int=65536, **model_kwargs) -> float:
+    """
+    Measures how many tokens per second the local GPU encodes, to fill the gpu_throughput of plan_vm_size.
+
+    Returns:
+        float: Tokens per second.
+    """
+    from embedding.models import count_model_tokens, get_sentence_transformer, plan_length_batches
+
+    model = get_sentence_transformer(model_name, device="cuda", **model_kwargs)
+    token_counts = count_model_tokens(model.tokenizer, texts, model.max_seq_length)
+    batches = plan_length_batches(token_counts, max_tokens_per_batch, batch_size)
+    model.encode([texts[i] for i in batches[0]])
+    start = time.perf_counter()
+    for batch in batches:
+        model.encode([texts[i] for i in batch], batch_size=len(batch))
+    return float(token_counts.sum()) / (time.perf_counter() - start)
+
+
+def save_calibration(path: str, cpu_throughput: dict, gpu_throughput: dict=None, **details):
+    """
+    Saves calibration results (and anything else worth keeping, such as the model name) as JSON.
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"cpu": cpu_throughput, "gpu": gpu_throughput or {}, **details}, f, indent=2)
+
+
+def load_calibration(path: str) -> dict:
+    """
+    Loads a file written by save_calibration, with the core counts as integers again.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        calibration = json.load(f)
+    calibration["cpu"] = {int(cores): tps for cores, tps in calibration["cpu"].items()}
+    return calibration
+
+
+def fetch_vm_prices(location: str, spot: bool=False, session=requests) -> dict:
+    """
+    Returns the hourly pay-as-you-go price of every Linux VM size in a region, from the Azure retail prices API.
+
+    Args:
+        location (str): Azure location (e.g., 'westus3').
+        spot (bool, optional): Whether Spot prices are returned instead of regular ones. Defaults to False.
+        session (optional): Anything with requests.get's interface, e.g. a requests.Session or a fake. Defaults to requests.
+
+    Returns:
+        dict: {VM size name: USD per hour}.
+    """
+    query = (f"serviceName eq 'Virtual Machines' and armRegionName eq '{location}' "
+             f"and priceType eq 'Consumption'")
+    url, params = RETAIL_PRICES_URL, {"$filter": query}
+    prices = {}
+    while url:
+        response = session.get(url, params=params, timeout=30)
+        response.raise_for_status()
+        page = response.json()
+        for item in page.get("Items", []):
+            if "Windows" in item.get("productName", "") or item.get("unitOfMeasure") != "1 Hour":
+                continue
+            is_spot = "Spot" in item.get("skuName", "")
+            if is_spot != spot or "Low Priority" in item.get("skuName", ""):
+                continue
+            name = item["armSkuName"]
+            prices[name] = min(prices.get(name, math.inf), item["retailPrice"])
+        # the next page link already carries the filter
+        url, params = page.get("NextPageLink"), None
+    return prices
+
+
+def estimate_vm_throughput(sku: dict, cpu_throughput: dict, gpu_throughput: dict=None,
+                           model_memory_gb: float=2.0) -> dict:
+    """
+    Estimates the tokens per second of one VM size from calibration results.
+
+    GPU sizes run one worker per GPU at the throughput measured for their GPU model. CPU sizes are
+    split into CPUEncoderPool workers of one of the calibrated core counts, as many as the cores and
+    the memory (one model copy per worker) allow, and the best layout is kept.
+
+    Args:
+        sku (dict): A VM size, as returned by compute.list_vm_skus ('name', 'vcpus', 'memory_gb', 'gpus').
+        cpu_throughput (dict): {cores: tokens per second} from calibrate_cpu_throughput.
+        gpu_throughput (dict, optional): {GPU model: tokens per second}, e.g. {'T4': 6000}. Defaults to None.
+        model_memory_gb (float, optional): The memory used by one worker. Defaults to 2.
+
+    Returns:
+        dict: 'tokens_per_second', 'workers' and 'threads_per_worker' (None for GPU sizes);
+        tokens_per_second is 0 when the size cannot run the job.
+    """
+    if sku.get("gpus"):
+        gpu = gpu_model(sku["name"])
+        tokens_per_second = (gpu_throughput or {}).get(gpu, 0.0) * sku["gpus"]
+        return {"tokens_per_second": tokens_per_second, "workers": sku["gpus"], "threads_per_worker": None, "gpu": gpu}
+
+    best = {"tokens_per_second": 0.0, "workers": 0, "threads_per_worker": None}
+    max_workers = int(sku["memory_gb"] // model_memory_gb) if model_memory_gb else sku["vcpus"]
+    for cores, tokens_per_second in cpu_throughput.items():
+        workers = min(sku["vcpus"] // cores, max_workers)
+        if workers and workers * tokens_per_second > best["tokens_per_second"]:
+            best = {"tokens_per_second": workers * tokens_per_second, "workers": workers, "threads_per_worker": cores}
+    return best
+
+
+def plan_vm_size(total_tokens: int, deadline_hours: float, skus: list[dict], prices: dict, remaining_cores: dict,
+                 cpu_throughput: dict, gpu_throughput: dict=None, max_vms: int=None, startup_hours: float=0.25,
+                 model_memory_gb: float=2.0, top: int=5) -> dict:
+    """
+    Recommends the VM size and count that embed a corpus before a deadline at the lowest cost.
+
+    For every size with a price and a throughput estimate, the number of VMs needed to finish within
+    deadline_hours is compared with what the remaining quota of its family and of the region allows.
+    Feasible plans are ranked by cost, then by wall time. When no plan meets the deadline the fastest
+    one is recommended and marked infeasible.
+
+    Args:
+        total_tokens (int): The tokens of the corpus, counted with the model's tokenizer (see corpus_tokens).
+        deadline_hours (float): The wall time the job must finish in.
+        skus (list[dict]): The VM sizes, as returned by compute.list_vm_skus.
+        prices (dict): {VM size name: USD per hour}, e.g. from fetch_vm_prices.
+        remaining_cores (dict): {quota name: free vCPUs}, as returned by compute.list_remaining_cores;
+            'cores' is the regional total and the other names are VM families.
+        cpu_throughput (dict): {cores: tokens per second} from calibrate_cpu_throughput.
+        gpu_throughput (dict, optional): {GPU model: tokens per second}. Defaults to None.
+        max_vms (int, optional): An upper bound on the number of VMs. Defaults to None.
+        startup_hours (float, optional): Provisioning and model loading time, billed and added to the wall time. Defaults to 0.25.
+        model_memory_gb (float, optional): The memory used by one worker. Defaults to 2.
+        top (int, optional): The number of alternatives returned with the recommendation. Defaults to 5.
+
+    Returns:
+        dict: The recommended plan ('sku', 'vms', 'workers_per_vm', 'threads_per_worker', 'tokens_per_second',
+        'wall_hours', 'cost', 'feasible'), with the next best plans under 'alternatives'; None if no size can run the job.
+    """
+    plans = []
+    for sku in skus:
+        price = prices.get(sku["name"])
+        throughput = estimate_vm_throughput(sku, cpu_throughput, gpu_throughput, model_memory_gb)
+        if price is None or not throughput["tokens_per_second"]:
+            continue
+
+        allowed = min(remaining_cores.get("cores", math.inf), remaining_cores.get(sku.get("family"), math.inf)) // sku["vcpus"]
+        allowed = min(allowed, max_vms or math.inf)
+        if not allowed:
+            continue
+
+        compute_hours = total_tokens / throughput["tokens_per_second"] / 3600
+        needed = max(1, math.ceil(compute_hours / max(deadline_hours - startup_hours, 1e-9)))
+        vms = int(min(needed, allowed))
+        wall_hours = startup_hours + compute_hours / vms
+        plans.append({
+            "sku": sku["name"],
+            "vms": vms,
+            "workers_per_vm": throughput["workers"],
+            "threads_per_worker": throughput["threads_per_worker"],
+            "tokens_per_second": throughput["tokens_per_second"] * vms,
+            "wall_hours": wall_hours,
+            "cost": vms * price * wall_hours,
+            "price_per_hour": price,
+            "feasible": wall_hours <= deadline_hours,
+        })
+
+    if not plans:
+        return None
+    plans.sort(key=lambda plan: (not plan["feasible"], plan["cost"] if plan["feasible"] else plan["wall_hours"],
+                                 plan["wall_hours"], plan["cost"]))
+    return {**plans[0], "alternatives": plans[1:top + 1]}
+
+
+def gpu_model(sku_name: str) -> str:
+    """
+    Returns the GPU model of a GPU VM size (see GPU_MODELS), or None if it is not known.
+    """
+    for pattern, gpu in GPU_MODELS:
+        if re.search(pattern, sku_name):
+            return gpu
+    return None
+
+
+def corpus_tokens(texts, model_name: str, window_size: int=10000) -> int:
+    """
+    Counts the tokens of a stream of texts with the tokenizer of the Hugging Face model, as calibration does.
+    """
+    from embedding.models import count_model_tokens, get_tokenizer
+
+    tokenizer = get_tokenizer(model_name)
+    total = 0
+    window = []
+    for text in texts:
+        window.append(text)
+        if len(window) == window_size:
+            total += int(count_model_tokens(tokenizer, window).sum())
+            window = []
+    return total + (int(count_model_tokens(tokenizer, window).sum()) if window else 0)
@@ -0,0 +1,11 @@
+#built-in modules
+import os
+import sys
+
+# the tests import the embedding package from the repository, without installing it
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# openai_functions creates its OpenAI clients on import, which needs a key; the tests never call the API
+os.environ.setdefault("openai_key", "test-key")
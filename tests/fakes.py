@@ -0,0 +1,116 @@
+#built-in modules
+import os
+import re
+import subprocess
+import threading
+import time
+from types import SimpleNamespace
+
+
+class FakeComputeClient:
+    """
+    Stands in for ComputeManagementClient in the listing functions of embedding.compute.
+
+    Args:
+        regions (dict): {location: {'sizes': [(name, cores, memory_mb)], 'usage': [(quota name, current, limit)],
+            'skus': [(name, family, vcpus, memory_gb, gpus)]}}.
+        vms (list, optional): (name, location, resource group) of the VMs of the subscription. Defaults to None.
+        latency (float, optional): Seconds every call takes. Defaults to 0.
+    """
+
+    def __init__(self, regions: dict, vms: list=None, latency: float=0.0):
+        self.regions = regions
+        self.latency = latency
+        self.calls = []
+        self._lock = threading.Lock()
+        self.virtual_machine_sizes = SimpleNamespace(list=lambda location: self._call("sizes", location, [
+            SimpleNamespace(name=name, number_of_cores=cores, memory_in_mb=memory_mb, max_data_disk_count=4)
+            for name, cores, memory_mb in regions.get(location, {}).get("sizes", [])]))
+        self.usage = SimpleNamespace(list=lambda location: self._call("usage", location, [
+            SimpleNamespace(name=SimpleNamespace(value=name, localized_value=f"{name} vCPUs"), current_value=current,
+                            limit=limit)
+            for name, current, limit in regions.get(location, {}).get("usage", [])]))
+        self.resource_skus = SimpleNamespace(list=lambda filter: self._call("skus", filter.split("'")[1], [
+            SimpleNamespace(name=name, family=family, resource_type="virtualMachines", restrictions=[],
+                            capabilities=[SimpleNamespace(name="vCPUs", value=str(vcpus)),
+                                          SimpleNamespace(name="MemoryGB", value=str(memory_gb)),
+                                          SimpleNamespace(name="GPUs", value=str(gpus))])
+            for name, family, vcpus, memory_gb, gpus in regions.get(filter.split("'")[1], {}).get("skus", [])]))
+        self.virtual_machines = SimpleNamespace(list_all=lambda: self._call("vms", None, [
+            SimpleNamespace(name=name, location=location,
+                            id=f"/subscriptions/sub/resourceGroups/{group}/providers/Microsoft.Compute/virtualMachines/{name}")
+            for name, location, group in vms or []]))
+
+    def count(self, kind: str, location: str=None) -> int:
+        """
+        Returns the number of calls of a kind ('sizes', 'usage', 'skus' or 'vms'), optionally for one location.
+        """
+        with self._lock:
+            return sum(1 for call in self.calls if call[0] == kind and location in (None, call[1]))
+
+    def _call(self, kind, location, result):
+        with self._lock:
+            self.calls.append((kind, location, time.perf_counter()))
+        time.sleep(self.latency)
+        return result
+
+
+class FakeResponse:
+
+    def __init__(self, payload: dict, status_code: int=200):
+        self.payload = payload
+        self.status_code = status_code
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+    def json(self):
+        return self.payload
+
+
+class FakeSession:
+    """
+    Stands in for requests in vm_planner.fetch_vm_prices, answering each URL with a prepared page.
+
+    Args:
+        pages (dict): {url: payload}.
+    """
+
+    def __init__(self, pages: dict):
+        self.pages = pages
+        self.requests = []
+
+    def get(self, url, params=None, timeout=None):
+        self.requests.append((url, params))
+        return FakeResponse(self.pages[url])
+
+
+class WordTokenizer:
+    """
+    A Hugging Face style tokenizer with one token per word, so the tests do not download a vocabulary.
+    """
+
+    def __call__(self, text, add_special_tokens=False, return_offsets_mapping=True):
+        return {"offset_mapping": [match.span() for match in re.finditer(r"\S+", text)]}
+
+
+class FakeRunCommandClient:
+    """
+    Stands in for ComputeManagementClient in RunCommandExecutor: every Run Command script runs in a local shell.
+
+    Args:
+        env (dict, optional): Extra environment variables of the scripts. Defaults to None.
+    """
+
+    def __init__(self, env: dict=None):
+        self.env = {**os.environ, **(env or {})}
+        self.scripts = []
+        self.virtual_machines = SimpleNamespace(begin_run_command=self._begin_run_command)
+
+    def _begin_run_command(self, resource_group_name, vm_name, parameters):
+        script = "\n".join(parameters.script)
+        self.scripts.append((vm_name, script))
+        completed = subprocess.run(["sh", "-c", script], env=self.env, capture_output=True, text=True, timeout=60)
+        result = SimpleNamespace(value=[SimpleNamespace(message=completed.stdout)])
+        return SimpleNamespace(result=lambda: result)
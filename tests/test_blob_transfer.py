@@ -0,0 +1,128 @@
+#built-in modules
+import hashlib
+import json
+import os
+
+#third-party libraries
+import pytest
+
+#own libraries
+from embedding.benchmarks.mock_blob import MockBlobServer
+from embedding.blob_transfer import (download_blob_cached, download_blob_to_file, iter_blocks, iter_json_array_bytes,
+                                     iter_json_lines_bytes, upload_blob_blocks, upload_file_if_changed)
+from embedding.clients import get_blob_service_client
+
+CONTAINER_NAME = "corpus"
+
+
+@pytest.fixture
+def server():
+    with MockBlobServer() as server:
+        get_blob_service_client(server.account_url, server.credential).create_container(CONTAINER_NAME)
+        yield server
+
+
+def download(server, cache_dir, blob_name="corpus.json"):
+    return download_blob_cached(server.account_url, CONTAINER_NAME, blob_name, str(cache_dir), max_concurrency=4,
+                                chunk_size=1024, credential=server.credential)
+
+
+def test_cached_download_is_reused_while_the_etag_matches(server, tmp_path):
+    data = os.urandom(10_000)
+    server.put(CONTAINER_NAME, "corpus.json", data)
+
+    path = download(server, tmp_path)
+    with open(path, "rb") as f:
+        assert f.read() == data
+    downloaded = server.stats()["bytes_out"]
+    assert downloaded == len(data)
+
+    # only the properties are requested the second time
+    assert download(server, tmp_path) == path
+    assert server.stats()["bytes_out"] == downloaded
+
+
+def test_changed_blob_is_downloaded_again(server, tmp_path):
+    server.put(CONTAINER_NAME, "corpus.json", b"[1, 2, 3]")
+    path = download(server, tmp_path)
+
+    server.put(CONTAINER_NAME, "corpus.json", b"[4, 5, 6]")
+    assert download(server, tmp_path) == path
+    with open(path, "rb") as f:
+        assert f.read() == b"[4, 5, 6]"
+    with open(path + ".meta.json", "r", encoding="utf-8") as f:
+        assert json.load(f)["etag"] == server.containers[CONTAINER_NAME]["corpus.json"]["etag"]
+
+
+def test_damaged_cached_copy_is_downloaded_again(server, tmp_path):
+    server.put(CONTAINER_NAME, "corpus.json", b"[1, 2, 3]")
+    path = download(server, tmp_path)
+    with open(path, "wb") as f:
+        f.write(b"[1,")
+
+    download(server, tmp_path)
+    with open(path, "rb") as f:
+        assert f.read() == b"[1, 2, 3]"
+
+
+def test_missing_blob_returns_none(server, tmp_path):
+    assert download(server, tmp_path, "missing.json") is None
+
+
+def test_ranged_download_matches_the_blob(server, tmp_path):
+    data = os.urandom(50_000)
+    server.put(CONTAINER_NAME, "large.bin", data)
+    path = str(tmp_path / "large.bin")
+    size = download_blob_to_file(server.account_url, CONTAINER_NAME, "large.bin", path, max_concurrency=4,
+                                 chunk_size=4096, credential=server.credential)
+    assert size == len(data)
+    with open(path, "rb") as f:
+        assert f.read() == data
+    assert not os.path.exists(path + ".tmp")
+
+
+def test_unchanged_upload_is_skipped(server, tmp_path, caplog):
+    path = tmp_path / "embeddings.npy"
+    path.write_bytes(os.urandom(20_000))
+
+    uploaded = upload_file_if_changed(str(path), server.account_url, CONTAINER_NAME, "embeddings.npy",
+                                      block_size=4096, credential=server.credential)
+    assert uploaded == 20_000
+    assert server.get(CONTAINER_NAME, "embeddings.npy") == path.read_bytes()
+    sent = server.stats()["bytes_in"]
+
+    with caplog.at_level("INFO", logger="embedding.blob_transfer"):
+        assert upload_file_if_changed(str(path), server.account_url, CONTAINER_NAME, "embeddings.npy",
+                                      block_size=4096, credential=server.credential) == 0
+    assert server.stats()["bytes_in"] == sent
+    assert "embeddings.npy is up to date, skipping upload" in caplog.messages
+
+    # a changed file is uploaded again
+    path.write_bytes(os.urandom(5_000))
+    assert upload_file_if_changed(str(path), server.account_url, CONTAINER_NAME, "embeddings.npy",
+                                  block_size=4096, credential=server.credential) == 5_000
+    assert server.get(CONTAINER_NAME, "embeddings.npy") == path.read_bytes()
+
+
+def test_block_upload_stores_the_content_md5(server):
+    records = [{"id": i, "text": "ñ" * i} for i in range(200)]
+    uploaded = upload_blob_blocks(iter_json_array_bytes(records), server.account_url, CONTAINER_NAME, "records.json",
+                                  block_size=1000, max_concurrency=3, credential=server.credential)
+    data = server.get(CONTAINER_NAME, "records.json")
+    assert uploaded == len(data)
+    assert json.loads(data) == records
+    assert server.containers[CONTAINER_NAME]["records.json"]["content_md5"] == hashlib.md5(data).digest()
+
+
+def test_serializers_and_blocks():
+    records = [{"id": 0}, {"id": 1, "text": "é"}]
+    assert json.loads(b"".join(iter_json_array_bytes(records))) == records
+    assert json.loads(b"".join(iter_json_array_bytes([]))) == []
+    assert [json.loads(line) for line in b"".join(iter_json_lines_bytes(records)).splitlines()] == records
+    assert list(iter_blocks([b"abc", "dé", b"", b"fghij"], 4)) == [b"abcd", "é".encode() + b"fg", b"hij"]
+
+
+def test_failed_download_is_logged(server, tmp_path, caplog):
+    assert download(server, tmp_path / "cache", "missing.json") is None
+    assert [record.levelname for record in caplog.records] == ["ERROR"]
+    assert caplog.messages[0].startswith("Could not download missing.json")
@@ -0,0 +1,17 @@
+#own libraries
+from embedding.cache import EmbeddingCache
+
+
+def test_failed_embeddings_are_returned_but_not_cached(tmp_path):
+    calls = []
+
+    def embed(texts):
+        calls.append(list(texts))
+        return [{"ok": [1.0, 2.0], "empty": [], "none": None, "padded": [None]}[text] for text in texts]
+
+    with EmbeddingCache(str(tmp_path / "cache.sqlite")) as cache:
+        texts = ["ok", "empty", "none", "padded"]
+        assert cache.get_or_compute(texts, "model", embed) == [[1.0, 2.0], [], None, [None]]
+        # only the successful embedding was cached, the failed ones are sent again
+        assert cache.get_or_compute(texts, "model", embed)[0] == [1.0, 2.0]
+        assert calls == [texts, ["empty", "none", "padded"]]
@@ -0,0 +1,68 @@
+#built-in modules
+import re
+
+#third-party libraries
+import pytest
+
+#own libraries
+import embedding.chunking
+from embedding.chunking import chunk_record, chunk_text, iter_chunks
+from fakes import WordTokenizer
+
+WORD = re.compile(r"\S+")
+
+
+TEXT = ("Primero. El actor demanda. La demandada contesta.\n\n"
+        "Segundo. El tribunal considera los hechos probados y resuelve conforme a derecho.\n\n"
+        "Tercero. Se condena en costas.")
+
+
+def words(text):
+    return len(WORD.findall(text))
+
+
+def test_chunks_fit_the_token_limit_and_cut_at_boundaries():
+    chunks = chunk_text(TEXT, WordTokenizer(), max_tokens=8, overlap=0)
+    assert all(n_tokens <= 8 and n_tokens == words(TEXT[start:end]) for start, end, n_tokens in chunks)
+    # the second paragraph has no sentence boundary in the limit, so it is cut every 8 tokens
+    assert [TEXT[start:end] for start, end, _ in chunks] == [
+        "Primero. El actor demanda. La demandada contesta.\n\nSegundo.",
+        "El tribunal considera los hechos probados y resuelve",
+        "conforme a derecho.\n\nTercero. Se condena en costas."]
+    # every word is in some chunk
+    assert " ".join(TEXT[start:end] for start, end, _ in chunks).split() == TEXT.split()
+
+
+def test_chunks_repeat_the_overlap():
+    text = " ".join(f"Frase {i}." for i in range(10))
+    chunks = chunk_text(text, WordTokenizer(), max_tokens=6, overlap=2)
+    assert [text[start:end] for start, end, _ in chunks][:2] == ["Frase 0. Frase 1. Frase 2.", "Frase 2. Frase 3. Frase 4."]
+    for (_, previous_end, _), (start, _, _) in zip(chunks, chunks[1:]):
+        assert words(text[start:previous_end]) == 2
+
+
+def test_short_text_is_one_chunk():
+    assert chunk_text("  una sola frase  ", WordTokenizer()) == [(2, 16, 3)]
+
+
+@pytest.mark.parametrize("text", ["", "   ", "\n\n\t"])
+def test_records_with_empty_text_are_kept(text):
+    record = {"id": "a", "text": text, "year": 2023}
+    assert chunk_record(record, WordTokenizer()) == [
+        {"id": "a", "text": "", "year": 2023, "parent_id": "a", "chunk_index": 0, "start": 0, "end": 0,
+         "n_tokens": 0}]
+
+
+def test_records_without_text_are_returned_unchanged():
+    record = {"id": "a", "title": "sin texto"}
+    assert chunk_record(record, WordTokenizer()) == [record]
+
+
+def test_iter_chunks_keeps_every_record_in_order(monkeypatch):
+    monkeypatch.setattr(embedding.chunking, "load_tokenizer", lambda model_name: WordTokenizer())
+    records = [{"id": "a", "text": TEXT}, {"text": ""}, {"id": "c", "text": "corto"}, {"id": "d"}]
+
+    chunks = list(iter_chunks(records, "any-model", max_tokens=8, overlap=0, window_size=2))
+    assert [chunk.get("parent_id") for chunk in chunks] == ["a"] * (len(chunks) - 3) + [1, "c", None]
+    assert [chunk["chunk_index"] for chunk in chunks if chunk.get("parent_id") == "a"] == list(range(len(chunks) - 3))
+    assert chunks[-1] == {"id": "d"}
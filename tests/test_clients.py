@@ -0,0 +1,88 @@
+#built-in modules
+import asyncio
+
+#third-party libraries
+from azure.core.credentials import AzureNamedKeyCredential
+import azure.identity.aio
+import azure.storage.blob.aio
+import pytest
+
+#own libraries
+from embedding import clients
+
+ACCOUNT_URL = "https://example.blob.core.windows.net"
+
+
+class FakeAsyncBlobServiceClient:
+    def __init__(self, account_url, credential=None, **kwargs):
+        self.account_url = account_url
+        self.credential = credential
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeAsyncCredential:
+    async def get_token(self, *scopes, **kwargs):
+        raise AssertionError("no token should be requested")
+
+    async def close(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    # the aio clients need aiohttp, which is not installed for the tests
+    monkeypatch.setattr(azure.storage.blob.aio, "BlobServiceClient", FakeAsyncBlobServiceClient)
+    monkeypatch.setattr(azure.identity.aio, "DefaultAzureCredential", FakeAsyncCredential)
+    clients.clear_clients()
+    yield
+    clients.clear_clients()
+
+
+def test_blob_clients_are_shared_for_equal_keys_and_dicts():
+    key = {"account_name": "example", "account_key": "a2V5"}
+    assert clients.get_blob_service_client(ACCOUNT_URL, dict(key)) is clients.get_blob_service_client(ACCOUNT_URL, dict(key))
+    assert clients.get_blob_service_client(ACCOUNT_URL, "sas") is clients.get_blob_service_client(ACCOUNT_URL, "sas")
+    assert clients.get_blob_service_client(ACCOUNT_URL, "sas") is not clients.get_blob_service_client(ACCOUNT_URL, "other")
+
+
+def test_blob_clients_for_credential_objects_are_not_cached():
+    first = clients.get_blob_service_client(ACCOUNT_URL, AzureNamedKeyCredential("example", "a2V5"))
+    second = clients.get_blob_service_client(ACCOUNT_URL, AzureNamedKeyCredential("example", "a2V5"))
+    assert first is not second
+    assert len(clients._clients) == 0
+
+
+def test_async_blob_clients_are_shared_within_a_loop():
+    async def get_twice():
+        first = clients.get_async_blob_service_client(ACCOUNT_URL)
+        second = clients.get_async_blob_service_client(ACCOUNT_URL)
+        return first, second
+
+    first, second = asyncio.run(get_twice())
+    assert first is second
+    assert isinstance(first.credential, clients.AsyncCachingCredential)
+
+
+def test_async_blob_clients_are_not_shared_across_loops_and_closed_loops_are_dropped():
+    first = asyncio.run(_get_client())
+    second = asyncio.run(_get_client())
+    assert first is not second
+    # the first loop was closed and dropped when the second one asked for a client
+    assert len(clients._loop_clients) == 1
+
+
+def test_close_async_clients_closes_the_loops_clients():
+    async def get_and_close():
+        client = clients.get_async_blob_service_client(ACCOUNT_URL, "sas")
+        await clients.close_async_clients()
+        return client
+
+    assert asyncio.run(get_and_close()).closed
+    assert clients._loop_clients == {}
+
+
+async def _get_client():
+    return clients.get_async_blob_service_client(ACCOUNT_URL, "sas")
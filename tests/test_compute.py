@@ -0,0 +1,57 @@
+#built-in modules
+import os
+import sys
+
+#third-party libraries
+import pytest
+
+#own libraries
+import embedding.compute
+from embedding.compute import RunCommandExecutor
+from embedding.sharding import ShardCoordinator, plan_shards
+from fakes import FakeRunCommandClient
+from test_sharding import TESTS_DIR, write_corpus
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = FakeRunCommandClient(env={"PYTHONPATH": os.pathsep.join([os.path.dirname(TESTS_DIR), TESTS_DIR])})
+    monkeypatch.setattr(embedding.compute, "get_compute_client", lambda subscription_id: client)
+    return client
+
+
+def make_specs(tmp_path, executor, fail_marker):
+    path = str(tmp_path / "corpus.json")
+    write_corpus(path, 20)
+    source = {"path": path}
+    coordinator = ShardCoordinator(executor, str(tmp_path / "coordinator"), max_attempts=1)
+    return coordinator.make_specs(plan_shards(source, 1, by="records"), source, "fake",
+                                  provider="test_sharding:fake_stream", fail_marker=fail_marker, fail_id=5)
+
+
+def test_shards_run_detached_and_are_polled_until_they_exit(tmp_path, client):
+    vm_dir = tmp_path / "vm"
+    vm_dir.mkdir()
+    (tmp_path / "failed").touch()
+    with RunCommandExecutor("sub", "group", ["vm-1"], workdir=str(vm_dir), python=sys.executable,
+                            poll_interval=0.2) as executor:
+        spec = make_specs(tmp_path, executor, str(tmp_path / "failed"))[0]
+        result = executor.submit(spec).result()
+
+    assert result["count"] == 20 and result["vm_name"] == "vm-1"
+    # the worker is started in the background, so no Run Command waits for the whole shard
+    assert "nohup" in client.scripts[0][1]
+    assert len(client.scripts) >= 2
+    assert (vm_dir / "shards" / "shard-00000.exit").read_text().strip() == "0"
+    assert (vm_dir / "shards" / "shard-00000.npy").exists()
+
+
+def test_a_failed_worker_fails_the_shard(tmp_path, client):
+    vm_dir = tmp_path / "vm"
+    vm_dir.mkdir()
+    with RunCommandExecutor("sub", "group", ["vm-1"], workdir=str(vm_dir), python=sys.executable,
+                            poll_interval=0.2) as executor:
+        spec = make_specs(tmp_path, executor, str(tmp_path / "failed"))[0]
+        with pytest.raises(RuntimeError, match="EXIT 1"):
+            executor.submit(spec).result()
+    assert "simulated failure" in (vm_dir / "shards" / "shard-00000.log").read_text()
@@ -0,0 +1,43 @@
+#third-party libraries
+import numpy as np
+
+#own libraries
+import embedding.dedup
+from embedding.dedup import Deduplicator, find_duplicates, minhash_signatures, normalize_text
+
+
+def words(first, last):
+    return " ".join(f"palabra{i}" for i in range(first, last))
+
+
+def test_exact_duplicates_share_the_first_occurrence():
+    texts = ["El actor demanda.", "el  ACTOR demanda", "Se condena en costas."]
+    assert find_duplicates(texts, near=False).tolist() == [0, 0, 2]
+
+
+def test_near_duplicate_groups_do_not_chain():
+    # A and B share 40 of 60 words, B and C too, but A and C only 20 of 60
+    a, b, c = words(0, 40), words(0, 60), words(20, 60)
+    signatures = minhash_signatures([a, b, c], shingle_size=1)
+    similarity = lambda i, j: np.mean(signatures[i] == signatures[j])
+    assert similarity(0, 1) >= 0.5 and similarity(1, 2) >= 0.5 and similarity(0, 2) < 0.5
+
+    representative = find_duplicates([a, b, c], threshold=0.5, shingle_size=1)
+    assert representative.tolist() == [0, 0, 2]
+    assert all(similarity(i, j) >= 0.5 for i, j in enumerate(representative))
+
+
+def test_deduplicator_embeds_one_text_per_group(monkeypatch):
+    monkeypatch.setattr(embedding.dedup, "load_tokenizer", lambda model: None)
+    monkeypatch.setattr(embedding.dedup, "_count_tokens", lambda tokenizer, texts: np.array([len(t.split()) for t in texts]))
+    texts = [words(0, 40), words(0, 60), words(20, 60), words(0, 40)]
+    embedded = []
+
+    def embed(batch):
+        embedded.extend(batch)
+        return [normalize_text(text) for text in batch]
+
+    dedup = Deduplicator(threshold=0.5, shingle_size=1)
+    assert dedup.compute(texts, "model", embed) == [texts[0], texts[0], texts[2], texts[0]]
+    assert embedded == [texts[0], texts[2]]
+    assert dedup.stats()["exact_duplicates"] == 1 and dedup.stats()["near_duplicates"] == 1
@@ -0,0 +1,125 @@
+#built-in modules
+from types import SimpleNamespace
+
+#third-party libraries
+import numpy as np
+import pytest
+
+# embedding.embedding imports the Hugging Face stack at the top
+pytest.importorskip("torch")
+pytest.importorskip("sentence_transformers")
+
+#own libraries
+import embedding.chunking
+import embedding.embedding
+from embedding.embedding import (generate_huggingface_embeddings, generate_openai_embeddings, populate_openai_embeddings,
+                                 stream_openai_embeddings)
+from fakes import WordTokenizer
+
+
+class FakeEmbeddings:
+    """
+    The embeddings endpoint: one vector per text, rejecting the whole request when any input is empty.
+    """
+
+    def __init__(self):
+        self.requests = []
+
+    def create(self, input, model, **kwargs):
+        self.requests.append(list(input))
+        if any(not text or text == "FALLA" for text in input):
+            raise ValueError("'$.input' is invalid")
+        return SimpleNamespace(data=[SimpleNamespace(index=i, embedding=[float(len(text)), 1.0])
+                                     for i, text in enumerate(input)])
+
+
+class FakeOpenAI:
+    # the endpoint shared by the sync and async clients, replaced for each test
+    embeddings = None
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+
+class FakeAsyncOpenAI:
+
+    def __init__(self, *args, **kwargs):
+        self.embeddings = SimpleNamespace(create=self.create)
+
+    async def create(self, **kwargs):
+        return FakeOpenAI.embeddings.create(**kwargs)
+
+    async def close(self):
+        pass
+
+
+class FakePool:
+    """
+    A CPUEncoderPool whose model has a max_seq_length of 4 words and embeds each text as [words, 1].
+    """
+
+    def __init__(self, model_name, n_workers=None, **model_kwargs):
+        self.model_kwargs = model_kwargs
+        self.batches = []
+        self.closed = False
+        FakePool.last = self
+
+    def count_tokens(self, texts):
+        return np.array([min(len(text.split()), 4) for text in texts])
+
+    def imap(self, batches):
+        for batch in batches:
+            self.batches.append(batch)
+            yield np.array([[float(len(text.split())), 1.0] for text in batch])
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture(autouse=True)
+def fake_openai(monkeypatch):
+    FakeOpenAI.embeddings = FakeEmbeddings()
+    monkeypatch.setattr(embedding.embedding, "OpenAI", FakeOpenAI)
+    monkeypatch.setattr(embedding.embedding, "AsyncOpenAI", FakeAsyncOpenAI)
+    # count one token per word instead of downloading the tiktoken encoding
+    monkeypatch.setattr(embedding.embedding, "count_tokens_each", lambda texts, model: [len(t.split()) for t in texts])
+    monkeypatch.setattr(embedding.chunking, "load_tokenizer", lambda model_name: WordTokenizer())
+    return FakeOpenAI.embeddings
+
+
+def test_blank_records_get_no_embedding_without_failing_their_batch(fake_openai):
+    records = [{"id": 0, "text": "El actor demanda."}, {"id": 1, "text": "   "}, {"id": 2, "text": "Se condena en costas."}]
+    chunks = embedding.chunking.iter_chunks(records, model_name="text-embedding-3-small", max_tokens=8, overlap=0)
+    embedded = list(stream_openai_embeddings(chunks, "text-embedding-3-small", window_size=10))
+
+    assert [record["parent_id"] for record in embedded] == [0, 1, 2]
+    assert embedded[1]["n_tokens"] == 0 and embedded[1]["embedding"] is None
+    assert embedded[0]["embedding"] == [17.0, 1.0] and embedded[2]["embedding"] == [21.0, 1.0]
+    assert fake_openai.requests == [["El actor demanda.", "Se condena en costas."]]
+
+
+def test_sync_path_skips_blank_texts(fake_openai):
+    records = [{"text": ""}, {"text": "Primero."}]
+    assert generate_openai_embeddings(records, "text-embedding-3-small") == [None, [8.0, 1.0]]
+    assert fake_openai.requests == [["Primero."]]
+
+
+def test_failed_batches_give_one_none_per_record_in_both_paths(fake_openai):
+    # one text per batch, so only the failing text loses its embedding
+    records = [{"text": "Primero."}, {"text": "FALLA"}]
+    assert generate_openai_embeddings(records, "text-embedding-3-small", batch_size=1) == [[8.0, 1.0], None]
+    populated = populate_openai_embeddings([dict(record) for record in records], "text-embedding-3-small", batch_size=1)
+    assert [record["embedding"] for record in populated] == [[8.0, 1.0], None]
+
+
+def test_cpu_pool_gets_the_model_kwargs_and_counts_tokens_in_the_workers(monkeypatch):
+    monkeypatch.setattr(embedding.embedding, "CPUEncoderPool", FakePool)
+    records = [{"text": "uno dos tres cuatro cinco seis siete ocho"}, {"text": "uno"}, {"text": "uno dos"}]
+    # with truncation the three texts fit one batch of 3 * 4 padded tokens
+    embeddings = generate_huggingface_embeddings(records, "model", device="cpu", n_workers=2, max_tokens_per_batch=12,
+                                                 model_kwargs={"trust_remote_code": True})
+
+    assert embeddings == [[8.0, 1.0], [1.0, 1.0], [2.0, 1.0]]
+    assert len(FakePool.last.batches) == 1
+    assert FakePool.last.model_kwargs == {"trust_remote_code": True}
+    assert FakePool.last.closed
@@ -0,0 +1,104 @@
+#built-in modules
+import time
+
+#third-party libraries
+import pytest
+
+#own libraries
+from embedding.inventory import AzureInventory
+from fakes import FakeComputeClient
+
+REGIONS = {
+    "westus2": {"sizes": [("Standard_D2s_v3", 2, 8192), ("Standard_D4s_v3", 4, 16384)],
+                "usage": [("cores", 10, 100), ("standardDSv3Family", 4, 20)]},
+    "westus3": {"sizes": [("Standard_D2s_v3", 2, 8192)], "usage": [("cores", 0, 50)]},
+    "eastus": {"sizes": [("Standard_NC4as_T4_v3", 4, 28672)], "usage": [("cores", 0, 10)]},
+    "eastus2": {"sizes": [("Standard_D2s_v3", 2, 8192)], "usage": [("cores", 0, 10)]},
+}
+
+
+@pytest.fixture
+def client():
+    return FakeComputeClient(REGIONS, vms=[("embedding", "westus2", "Lawgorithm_group"),
+                                           ("embedding-2", "eastus", "other_group")], latency=0.2)
+
+
+@pytest.fixture
+def inventory(client, tmp_path):
+    return AzureInventory("sub", regions=list(REGIONS), cache_dir=str(tmp_path), compute_client=client)
+
+
+def test_regions_are_queried_concurrently(inventory, client):
+    start = time.perf_counter()
+    sizes = inventory.vm_sizes()
+    seconds = time.perf_counter() - start
+
+    assert sizes["westus2"] == [
+        {"name": "Standard_D2s_v3", "number_of_cores": 2, "memory_in_mb": 8192, "max_data_disk_count": 4},
+        {"name": "Standard_D4s_v3", "number_of_cores": 4, "memory_in_mb": 16384, "max_data_disk_count": 4},
+    ]
+    assert list(sizes) == list(REGIONS)
+    assert client.count("sizes") == len(REGIONS)
+    # four calls of 0.2s each would take 0.8s one after another
+    assert seconds < 0.6
+    starts = [call[2] for call in client.calls]
+    assert max(starts) - min(starts) < 0.15
+
+
+def test_cached_responses_are_reused_within_the_ttl(inventory, client, tmp_path):
+    first = inventory.remaining_cores()
+    assert client.count("usage") == len(REGIONS)
+
+    start = time.perf_counter()
+    assert inventory.remaining_cores() == first
+    assert time.perf_counter() - start < 0.1
+    assert client.count("usage") == len(REGIONS)
+    assert first["westus2"] == {"cores": 90, "standardDSv3Family": 16}
+
+    # the cache is on disk, so another inventory on the same directory reuses it
+    other = AzureInventory("sub", regions=list(REGIONS), cache_dir=str(tmp_path), compute_client=client)
+    assert other.remaining_cores(["eastus"]) == {"eastus": {"cores": 10}}
+    assert client.count("usage") == len(REGIONS)
+
+
+def test_refresh_bypasses_the_cache(inventory, client):
+    inventory.vm_sizes(["westus2", "eastus"])
+    inventory.vm_sizes(["westus2"], refresh=True)
+    assert client.count("sizes", "westus2") == 2
+    assert client.count("sizes", "eastus") == 1
+
+
+def test_expired_responses_are_queried_again(client, tmp_path):
+    inventory = AzureInventory("sub", regions=["westus2"], cache_dir=str(tmp_path), ttl=0, compute_client=client)
+    inventory.dedicated_cores()
+    inventory.dedicated_cores()
+    assert client.count("usage", "westus2") == 2
+
+
+def test_empty_responses_are_not_cached(inventory, client):
+    assert inventory.vm_sizes(["northeurope"]) == {"northeurope": []}
+    assert inventory.vm_sizes(["northeurope"]) == {"northeurope": []}
+    assert client.count("sizes", "northeurope") == 2
+
+
+def test_compute_instances_are_grouped_by_region(inventory, client):
+    instances = inventory.compute_instances()
+    assert instances["westus2"] == [{"name": "embedding", "location": "westus2", "resource_group": "Lawgorithm_group"}]
+    assert instances["eastus"] == [{"name": "embedding-2", "location": "eastus", "resource_group": "other_group"}]
+    assert instances["westus3"] == []
+
+    inventory.compute_instances(["eastus"])
+    assert client.count("vms") == 1
+
+
+def test_vm_size_regions_merges_regions(inventory):
+    regions = inventory.vm_size_regions()
+    assert regions["Standard_D2s_v3"] == ["westus2", "westus3", "eastus2"]
+    assert regions["Standard_NC4as_T4_v3"] == ["eastus"]
+
+
+def test_clear_deletes_the_cache(inventory, client):
+    inventory.vm_sizes(["westus2"])
+    inventory.clear()
+    inventory.vm_sizes(["westus2"])
+    assert client.count("sizes", "westus2") == 2
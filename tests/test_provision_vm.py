@@ -0,0 +1,187 @@
+#built-in modules
+import threading
+import time
+from types import SimpleNamespace
+
+#third-party libraries
+import pytest
+from azure.core.exceptions import ResourceNotFoundError
+
+#own libraries
+from embedding.provision_vm import ProvisioningStep, provision_vm, run_steps
+
+
+class FakePoller:
+
+    def __init__(self, result, seconds):
+        self._result = result
+        self._seconds = seconds
+
+    def result(self):
+        time.sleep(self._seconds)
+        return self._result
+
+
+class FakeAzure:
+    """
+    Stands in for the resource, network and compute clients, keeping the resources in a dictionary.
+
+    Every create records its start and end time, takes the seconds given in latency for its kind,
+    and fails if its kind is in fail.
+    """
+
+    def __init__(self, latency: dict=None, fail: set=()):
+        self.resources = {}
+        self.creates = {}
+        self.latency = latency or {}
+        self.fail = set(fail)
+        self._lock = threading.Lock()
+
+        self.resource_client = SimpleNamespace(resource_groups=SimpleNamespace(
+            get=lambda name: self._get("resource_group", name),
+            create_or_update=lambda name, body: self._create(
+                "resource_group", (name,), SimpleNamespace(name=name, location=body["location"], id=f"/rg/{name}"),
+                poller=False)))
+        self.network_client = SimpleNamespace(
+            virtual_networks=SimpleNamespace(
+                get=lambda group, name: self._get("virtual_network", group, name),
+                begin_create_or_update=lambda group, name, body: self._create(
+                    "virtual_network", (group, name),
+                    SimpleNamespace(name=name, id=f"/rg/{group}/vnet/{name}",
+                                    address_space=SimpleNamespace(address_prefixes=body["address_space"]["address_prefixes"])))),
+            subnets=SimpleNamespace(
+                get=lambda group, vnet, name: self._get("subnet", group, vnet, name),
+                begin_create_or_update=lambda group, vnet, name, body: self._create(
+                    "subnet", (group, vnet, name),
+                    SimpleNamespace(name=name, id=f"/rg/{group}/vnet/{vnet}/subnets/{name}",
+                                    address_prefix=body["address_prefix"]))),
+            public_ip_addresses=SimpleNamespace(
+                get=lambda group, name: self._get("public_ip", group, name),
+                begin_create_or_update=lambda group, name, body: self._create(
+                    "public_ip", (group, name),
+                    SimpleNamespace(name=name, id=f"/rg/{group}/ip/{name}", sku=SimpleNamespace(name=body["sku"]["name"]),
+                                    public_ip_allocation_method=body["public_ip_allocation_method"]))),
+            network_interfaces=SimpleNamespace(
+                get=lambda group, name: self._get("network_interface", group, name),
+                begin_create_or_update=lambda group, name, body: self._create(
+                    "network_interface", (group, name),
+                    SimpleNamespace(name=name, id=f"/rg/{group}/nic/{name}", ip_configurations=[
+                        # the service returns ids in its own case
+                        SimpleNamespace(subnet=SimpleNamespace(id=configuration["subnet"]["id"].upper()),
+                                        public_ip_address=SimpleNamespace(id=configuration["public_ip_address"]["id"]))
+                        for configuration in body["ip_configurations"]]))),
+        )
+        self.compute_client = SimpleNamespace(virtual_machines=SimpleNamespace(
+            get=lambda group, name: self._get("virtual_machine", group, name),
+            begin_create_or_update=lambda group, name, body: self._create(
+                "virtual_machine", (group, name),
+                SimpleNamespace(name=name, id=f"/rg/{group}/vm/{name}", os_profile=body["os_profile"],
+                                hardware_profile=SimpleNamespace(vm_size=body["hardware_profile"]["vm_size"]),
+                                network_profile=SimpleNamespace(network_interfaces=[
+                                    SimpleNamespace(id=nic["id"]) for nic in body["network_profile"]["network_interfaces"]])))))
+
+    def clients(self) -> dict:
+        return {"resource_client": self.resource_client, "network_client": self.network_client,
+                "compute_client": self.compute_client}
+
+    def _get(self, kind, *key):
+        with self._lock:
+            if (kind, *key) not in self.resources:
+                raise ResourceNotFoundError(f"{kind} {key} not found")
+            return self.resources[(kind, *key)]
+
+    def _create(self, kind, key, resource, poller=True):
+        start = time.perf_counter()
+        if kind in self.fail:
+            raise RuntimeError(f"{kind} quota exceeded")
+        with self._lock:
+            self.resources[(kind, *key)] = resource
+        seconds = self.latency.get(kind, 0.0)
+        with self._lock:
+            self.creates.setdefault(kind, []).append((start, start + seconds))
+        return FakePoller(resource, seconds) if poller else FakePoller(resource, seconds).result()
+
+
+def test_independent_steps_run_concurrently():
+    azure = FakeAzure(latency={"virtual_network": 0.3, "subnet": 0.3, "public_ip": 0.5})
+    provisioned = provision_vm("sub", password="secret", **azure.clients())
+
+    assert {name: timing["status"] for name, timing in provisioned["timings"].items()} == {
+        "resource_group": "created", "virtual_network": "created", "subnet": "created", "public_ip": "created",
+        "network_interface": "created", "virtual_machine": "created"}
+    (ip_start, ip_end), = azure.creates["public_ip"]
+    (vnet_start, _), = azure.creates["virtual_network"]
+    (_, subnet_end), = azure.creates["subnet"]
+    # the public IP is created while the virtual network and subnet are
+    assert ip_start < subnet_end and vnet_start < ip_end
+    # 1.1s one step after another, the longest path takes 0.6s
+    assert provisioned["seconds"] < 0.9
+    assert provisioned["timings"]["public_ip"]["seconds"] >= 0.5
+
+    vm = provisioned["resources"]["virtual_machine"]
+    assert vm.network_profile.network_interfaces[0].id == provisioned["resources"]["network_interface"].id
+    assert vm.os_profile["admin_password"] == "secret"
+
+
+def test_second_run_skips_every_resource():
+    azure = FakeAzure()
+    provision_vm("sub", password="secret", **azure.clients())
+    creates = {kind: len(calls) for kind, calls in azure.creates.items()}
+
+    provisioned = provision_vm("sub", password="secret", **azure.clients())
+    assert {timing["status"] for timing in provisioned["timings"].values()} == {"skipped"}
+    assert {kind: len(calls) for kind, calls in azure.creates.items()} == creates
+
+
+def test_resources_in_another_state_are_updated():
+    azure = FakeAzure()
+    provision_vm("sub", password="secret", **azure.clients())
+    subnet = azure.resources[("subnet", "Lawgoritm_group", "python-example-vnet", "python-example-subnet")]
+    subnet.address_prefix = "10.0.1.0/24"
+
+    provisioned = provision_vm("sub", vm_size="Standard_D4s_v3", password="secret", **azure.clients())
+    statuses = {name: timing["status"] for name, timing in provisioned["timings"].items()}
+    assert statuses == {"resource_group": "skipped", "virtual_network": "skipped", "subnet": "updated",
+                        "public_ip": "skipped", "network_interface": "skipped", "virtual_machine": "updated"}
+    assert provisioned["resources"]["subnet"].address_prefix == "10.0.0.0/24"
+    assert provisioned["resources"]["virtual_machine"].hardware_profile.vm_size == "Standard_D4s_v3"
+
+
+def test_a_failed_step_cancels_its_dependents():
+    azure = FakeAzure(fail={"subnet"})
+    provisioned = provision_vm("sub", password="secret", **azure.clients())
+
+    timings = provisioned["timings"]
+    assert timings["subnet"]["status"] == "failed"
+    assert "quota exceeded" in timings["subnet"]["error"]
+    assert timings["network_interface"]["status"] == "cancelled"
+    assert timings["virtual_machine"]["status"] == "cancelled"
+    # the public IP does not depend on the subnet
+    assert timings["public_ip"]["status"] == "created"
+    assert "network_interface" not in azure.creates and "virtual_machine" not in azure.creates
+
+
+def test_a_password_is_required(monkeypatch):
+    monkeypatch.delenv("vm_password", raising=False)
+    azure = FakeAzure()
+    with pytest.raises(ValueError):
+        provision_vm("sub", **azure.clients())
+    assert not azure.creates
+
+    monkeypatch.setenv("vm_password", "from-env")
+    provisioned = provision_vm("sub", **azure.clients())
+    assert provisioned["resources"]["virtual_machine"].os_profile["admin_password"] == "from-env"
+
+
+def test_run_steps_rejects_unknown_dependencies():
+    with pytest.raises(ValueError):
+        run_steps([ProvisioningStep("a", create=lambda results: 1, depends_on=("b",))])
+
+
+def test_run_steps_cancels_dependency_cycles():
+    steps = [ProvisioningStep("a", create=lambda results: 1, depends_on=("b",)),
+             ProvisioningStep("b", create=lambda results: 2, depends_on=("a",)),
+             ProvisioningStep("c", create=lambda results: 3)]
+    results, timings = run_steps(steps)
+    assert results == {"c": 3}
+    assert timings["a"]["status"] == timings["b"]["status"] == "cancelled"
@@ -0,0 +1,18 @@
+#third-party libraries
+import numpy as np
+
+#own libraries
+from embedding.reduction import PCAReducer
+
+
+def test_fit_records_skips_failed_embeddings():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(50, 4)) * [10.0, 1.0, 0.1, 0.01]
+    records = [{"id": i, "embedding": vector.tolist()} for i, vector in enumerate(vectors)]
+    records += [{"id": 50, "embedding": []}, {"id": 51, "embedding": None}, {"id": 52, "embedding": [None]}, {"id": 53}]
+
+    reducer = PCAReducer(n_components=2).fit_records(records, window_size=16)
+    assert reducer.count == 50
+    # the first component follows the axis with the largest variance
+    assert abs(reducer.components[0][0]) > 0.99
+    assert reducer.transform(vectors[:3]).shape == (3, 2)
@@ -0,0 +1,135 @@
+#built-in modules
+import json
+import os
+import sys
+
+#third-party libraries
+import numpy as np
+
+#own libraries
+from embedding.sharding import (LocalSubprocessExecutor, ShardCoordinator, iter_source_records, plan_record_shards,
+                                plan_shards, plan_token_shards)
+from embedding.storage import iter_metadata, load_vectors, merge_embeddings, save_embeddings
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def fake_stream(records, model_name, key='text', fail_marker=None, fail_id=None):
+    """
+    Embeds each record as [id, length of its text], and fails once on the record fail_id.
+    """
+    for record in records:
+        if record["id"] == fail_id and not os.path.exists(fail_marker):
+            open(fail_marker, "w").close()
+            raise RuntimeError(f"simulated failure on record {fail_id}")
+        yield {**record, "embedding": [float(record["id"]), float(len(record[key]))]}
+
+
+def write_corpus(path, n_records, lines=False):
+    records = [{"id": i, "text": "ñandú " * (i % 7) + str(i)} for i in range(n_records)]
+    with open(path, "w", encoding="utf-8") as f:
+        if lines:
+            f.write("\n".join(json.dumps(record, ensure_ascii=False) for record in records) + "\n")
+        else:
+            json.dump(records, f, ensure_ascii=False, indent=1)
+    return records
+
+
+def test_plan_record_shards_covers_every_record():
+    assert plan_record_shards(10, 3) == [(0, 3), (3, 7), (7, 10)]
+    assert plan_record_shards(2, 5) == [(0, 1), (1, 2)]
+
+
+def test_plan_token_shards_balances_tokens():
+    shards = plan_token_shards([100, 1, 1, 1, 1, 100], 2)
+    assert shards == [(0, 3), (3, 6)]
+    assert plan_token_shards([], 3) == []
+
+
+def test_shards_read_only_their_byte_range(tmp_path):
+    for lines in (False, True):
+        path = str(tmp_path / f"corpus-{lines}.json")
+        records = write_corpus(path, 101, lines)
+        source = {"path": path}
+        shards = plan_shards(source, 4, by="records")
+
+        assert [shard["format"] for shard in shards] == ["lines" if lines else "array"] * 4
+        assert shards[-1]["end_offset"] is None
+        read = []
+        for shard in shards:
+            read.extend(iter_source_records(source, shard["start"], shard["end"], shard["offset"],
+                                            shard["end_offset"], shard["format"]))
+        assert read == records
+        # without offsets the records before start are skipped
+        assert list(iter_source_records(source, 10, 12)) == records[10:12]
+
+
+def test_sharded_run_retries_a_failed_shard_and_merges_in_order(tmp_path):
+    path = str(tmp_path / "corpus.json")
+    records = write_corpus(path, 60)
+    work_dir = str(tmp_path / "shards")
+    source = {"path": path}
+
+    shards = plan_shards(source, 3, by="records")
+    env = {"PYTHONPATH": os.pathsep.join([os.path.dirname(TESTS_DIR), TESTS_DIR])}
+    with LocalSubprocessExecutor(max_workers=3, python=sys.executable, env=env, timeout=120) as executor:
+        coordinator = ShardCoordinator(executor, work_dir, max_attempts=2)
+        specs = coordinator.make_specs(shards, source, "fake", provider="test_sharding:fake_stream",
+                                       fail_marker=str(tmp_path / "failed"), fail_id=30)
+        state = coordinator.run(specs)
+
+    assert [shard["status"] for shard in state] == ["done"] * 3
+    assert [shard["attempts"] for shard in state] == [1, 2, 1]
+    assert all("error" not in shard for shard in state)
+
+    assert coordinator.merge(specs, str(tmp_path / "merged")) == len(records)
+    vectors = load_vectors(str(tmp_path / "merged"))
+    np.testing.assert_array_equal(vectors, [[record["id"], len(record["text"])] for record in records])
+    assert list(iter_metadata(str(tmp_path / "merged"))) == records
+
+    # a second run finds every shard done and dispatches nothing
+    with LocalSubprocessExecutor(env=env) as executor:
+        state = ShardCoordinator(executor, work_dir, max_attempts=2).run(specs)
+    assert [shard["attempts"] for shard in state] == [1, 2, 1]
+
+    # another model reuses no output of the previous job
+    with LocalSubprocessExecutor(max_workers=3, env=env, timeout=120) as executor:
+        coordinator = ShardCoordinator(executor, work_dir, max_attempts=2)
+        specs = coordinator.make_specs(shards, source, "fake-2", provider="test_sharding:fake_stream",
+                                       fail_marker=str(tmp_path / "failed"), fail_id=30)
+        state = coordinator.run(specs)
+    assert [(shard["status"], shard["attempts"]) for shard in state] == [("done", 1)] * 3
+    with open(os.path.join(work_dir, "shards.json"), encoding="utf-8") as f:
+        assert json.load(f)["fingerprint"] == coordinator.fingerprint
+
+
+def test_coordinator_gives_up_after_max_attempts(tmp_path, caplog):
+    path = str(tmp_path / "corpus.json")
+    write_corpus(path, 10)
+    source = {"path": path}
+    env = {"PYTHONPATH": os.pathsep.join([os.path.dirname(TESTS_DIR), TESTS_DIR])}
+    with LocalSubprocessExecutor(env=env, timeout=120) as executor:
+        coordinator = ShardCoordinator(executor, str(tmp_path / "shards"), max_attempts=1)
+        specs = coordinator.make_specs(plan_shards(source, 2, by="records"), source, "fake",
+                                       provider="test_sharding:fake_stream",
+                                       fail_marker=str(tmp_path / "failed"), fail_id=7)
+        state = coordinator.run(specs)
+
+    assert [shard["status"] for shard in state] == ["done", "failed"]
+    assert "simulated failure" in state[1]["error"]
+    assert coordinator.merge(specs, str(tmp_path / "merged")) is None
+    errors = [record.getMessage() for record in caplog.records if record.levelname == "ERROR"]
+    assert errors[0].startswith("Shard 1 failed (attempt 1), giving up")
+    assert errors[1] == "Cannot merge, shards not done: [1]"
+
+
+def test_merge_embeddings_concatenates_in_order(tmp_path):
+    prefixes = []
+    for part in range(3):
+        prefix = str(tmp_path / f"part-{part}")
+        save_embeddings(({"id": part * 10 + i, "embedding": [part, i]} for i in range(part + 1)), prefix)
+        prefixes.append(prefix)
+
+    assert merge_embeddings(prefixes, str(tmp_path / "all"), block_size=1) == 6
+    np.testing.assert_array_equal(load_vectors(str(tmp_path / "all")), [[0, 0], [1, 0], [1, 1], [2, 0], [2, 1], [2, 2]])
+    assert [record["id"] for record in iter_metadata(str(tmp_path / "all"))] == [0, 10, 11, 20, 21, 22]
@@ -0,0 +1,31 @@
+#third-party libraries
+import numpy as np
+
+#own libraries
+from embedding.storage import iter_metadata, load_vectors, save_embeddings
+
+
+def test_failed_embeddings_are_written_as_nan_rows(tmp_path):
+    path_prefix = str(tmp_path / "embeddings")
+    records = [
+        {"id": 0, "embedding": []},
+        {"id": 1, "embedding": [1.0, 2.0]},
+        {"id": 2, "embedding": None},
+        {"id": 3, "embedding": [None]},
+        {"id": 4, "embedding": [3.0, 4.0]},
+    ]
+    save_embeddings(records, path_prefix)
+
+    vectors = load_vectors(path_prefix, mmap=False)
+    assert vectors.shape == (5, 2)
+    assert np.isnan(vectors[[0, 2, 3]]).all()
+    assert vectors[1].tolist() == [1.0, 2.0] and vectors[4].tolist() == [3.0, 4.0]
+    assert [record["id"] for record in iter_metadata(path_prefix)] == [0, 1, 2, 3, 4]
+
+
+def test_only_failed_embeddings_give_an_empty_matrix(tmp_path):
+    path_prefix = str(tmp_path / "embeddings")
+    save_embeddings([{"id": 0, "embedding": []}, {"id": 1, "embedding": None}], path_prefix)
+
+    assert load_vectors(path_prefix, mmap=False).shape == (2, 0)
+    assert len(list(iter_metadata(path_prefix))) == 2
@@ -0,0 +1,116 @@
+#built-in modules
+import json
+
+#third-party libraries
+import pytest
+
+#own libraries
+from embedding.benchmarks.mock_blob import MockBlobServer
+from embedding.streaming import (detect_format, iter_blob_chunks, iter_blob_records, iter_file_chunks,
+                                 iter_file_records, iter_json_array, iter_json_lines, iter_records, iter_windows)
+
+RECORDS = [
+    {"id": 0, "text": "El tribunal resolvió: «ha lugar» — ñandú €"},
+    {"id": 1, "text": "", "score": -1.5e-3, "tags": ["a", {"b": [1, 2, None]}]},
+    {"id": 2, "text": "comillas \"escapadas\" y \\ barras", "ok": True},
+    {"id": 3, "text": "😀" * 5, "score": 12345.678},
+]
+
+
+def split(data: bytes, size: int):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def as_array(records, indent=None) -> bytes:
+    return json.dumps(records, ensure_ascii=False, indent=indent).encode("utf-8")
+
+
+def as_lines(records) -> bytes:
+    return "\n".join(json.dumps(record, ensure_ascii=False) for record in records).encode("utf-8")
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 64, 4096])
+def test_array_elements_split_across_chunks(size):
+    for indent in (None, 2):
+        assert list(iter_json_array(split(as_array(RECORDS, indent), size))) == RECORDS
+
+
+@pytest.mark.parametrize("size", [1, 2, 3])
+def test_numbers_split_across_chunks_are_not_cut(size):
+    data = b"[-1.5, 12345, 2e10, 0.25,7]"
+    assert list(iter_json_array(split(data, size))) == [-1.5, 12345, 2e10, 0.25, 7]
+
+
+@pytest.mark.parametrize("size", [1, 4, 4096])
+def test_json_lines(size):
+    data = b"\n" + as_lines(RECORDS[:2]) + b"\r\n\n  \n" + as_lines(RECORDS[2:])
+    assert list(iter_json_lines(split(data, size))) == RECORDS
+    # with and without a newline at the end
+    assert list(iter_json_lines(split(as_lines(RECORDS) + b"\n", size))) == RECORDS
+
+
+@pytest.mark.parametrize("prefix", [b"", b" \n\t", b"\xef\xbb\xbf", b"\xef\xbb\xbf\r\n  "])
+def test_format_detection(prefix):
+    for data, format in ((prefix + as_array(RECORDS), "array"), (prefix + as_lines(RECORDS), "lines")):
+        # the prefix may be split too, even inside the byte order mark
+        for size in (1, 2, 4096):
+            detected, chunks = detect_format(split(data, size))
+            assert detected == format
+            assert b"".join(chunks) == data
+            assert list(iter_records(split(data, size))) == RECORDS
+
+
+def test_offsets_point_at_each_record():
+    for data, parse in ((b"\xef\xbb\xbf" + as_array(RECORDS, indent=1), iter_json_array),
+                        (as_lines(RECORDS), iter_json_lines)):
+        pairs = list(parse(split(data, 3), offsets=True))
+        assert [record for _, record in pairs] == RECORDS
+        for index, (offset, record) in enumerate(pairs):
+            if parse is iter_json_array:
+                assert list(iter_json_array([data[offset:]], resume=True)) == RECORDS[index:]
+            else:
+                assert list(iter_json_lines([data[offset:]])) == RECORDS[index:]
+
+
+@pytest.mark.parametrize("data", [b'[{"id": 0},', b'[{"id": 0}, {"id"', b"[1, 2", b"[", b"", b"  \n"])
+def test_truncated_array_raises(data):
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_json_array(split(data, 2)))
+
+
+def test_invalid_array_raises():
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_json_array([b'{"id": 0}']))
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_json_array([b'[{"id": 0} {"id": 1}]']))
+
+
+def test_file_records(tmp_path):
+    array_path, lines_path = tmp_path / "records.json", tmp_path / "records.jsonl"
+    array_path.write_bytes(b"\xef\xbb\xbf" + as_array(RECORDS, indent=2))
+    lines_path.write_bytes(as_lines(RECORDS))
+
+    assert list(iter_file_records(str(array_path), chunk_size=5)) == RECORDS
+    assert list(iter_file_records(str(lines_path), chunk_size=5)) == RECORDS
+    assert b"".join(iter_file_chunks(str(lines_path), chunk_size=4, offset=3, length=10)) == as_lines(RECORDS)[3:13]
+
+
+def test_blob_records():
+    with MockBlobServer() as server:
+        server.put("corpus", "records.json", as_array(RECORDS, indent=2))
+        server.put("corpus", "records.jsonl", as_lines(RECORDS))
+
+        for blob_name in ("records.json", "records.jsonl"):
+            records = iter_blob_records(server.account_url, "corpus", blob_name, chunk_size=16,
+                                        credential=server.credential)
+            assert list(records) == RECORDS
+
+        chunks = list(iter_blob_chunks(server.account_url, "corpus", "records.jsonl", chunk_size=16,
+                                       credential=server.credential, offset=5, length=40))
+        assert b"".join(chunks) == as_lines(RECORDS)[5:45]
+        assert max(len(chunk) for chunk in chunks) <= 16
+
+
+def test_windows():
+    assert list(iter_windows(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(iter_windows([], 2)) == []
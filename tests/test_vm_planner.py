@@ -0,0 +1,117 @@
+#third-party libraries
+import pytest
+
+#own libraries
+from embedding.compute import recommend_vm_size
+from embedding.vm_planner import (RETAIL_PRICES_URL, estimate_vm_throughput, fetch_vm_prices, gpu_model,
+                                  load_calibration, plan_vm_size, save_calibration)
+from fakes import FakeComputeClient, FakeSession
+
+SKUS = [
+    {"name": "Standard_D2s_v3", "family": "standardDSv3Family", "vcpus": 2, "memory_gb": 8.0, "gpus": 0},
+    {"name": "Standard_D8s_v3", "family": "standardDSv3Family", "vcpus": 8, "memory_gb": 32.0, "gpus": 0},
+    {"name": "Standard_NC4as_T4_v3", "family": "standardNCASv3_T4Family", "vcpus": 4, "memory_gb": 28.0, "gpus": 1},
+]
+PRICES = {"Standard_D2s_v3": 0.1, "Standard_D8s_v3": 0.4, "Standard_NC4as_T4_v3": 0.5}
+QUOTA = {"cores": 100, "standardDSv3Family": 100, "standardNCASv3_T4Family": 8}
+# tokens per second of one worker with 1, 2 and 4 cores, and of one T4
+CPU_THROUGHPUT = {1: 100.0, 2: 180.0, 4: 320.0}
+GPU_THROUGHPUT = {"T4": 2000.0}
+# 5 hours on a D2s_v3, 1.25 on a D8s_v3, 0.5 on a T4
+TOTAL_TOKENS = 3_600_000
+
+
+def price_item(sku, price, product="Virtual Machines DSv3 Series", sku_name=None, unit="1 Hour"):
+    return {"armSkuName": sku, "retailPrice": price, "productName": product, "skuName": sku_name or sku,
+            "unitOfMeasure": unit}
+
+
+def test_estimate_vm_throughput_uses_the_best_worker_layout():
+    assert estimate_vm_throughput(SKUS[0], CPU_THROUGHPUT) == {"tokens_per_second": 200.0, "workers": 2,
+                                                               "threads_per_worker": 1}
+    assert estimate_vm_throughput(SKUS[1], CPU_THROUGHPUT)["tokens_per_second"] == 800.0
+    # one model copy per worker: 32 GB fit two workers of 16 GB only
+    assert estimate_vm_throughput(SKUS[1], CPU_THROUGHPUT, model_memory_gb=16.0) == {
+        "tokens_per_second": 640.0, "workers": 2, "threads_per_worker": 4}
+    assert estimate_vm_throughput(SKUS[2], CPU_THROUGHPUT, GPU_THROUGHPUT)["tokens_per_second"] == 2000.0
+    assert estimate_vm_throughput(SKUS[2], CPU_THROUGHPUT)["tokens_per_second"] == 0.0
+    assert gpu_model("Standard_NC4as_T4_v3") == "T4" and gpu_model("Standard_D2s_v3") is None
+
+
+def test_plan_picks_the_cheapest_feasible_size():
+    plan = plan_vm_size(TOTAL_TOKENS, 3, SKUS, PRICES, QUOTA, CPU_THROUGHPUT, GPU_THROUGHPUT)
+    assert plan["sku"] == "Standard_NC4as_T4_v3"
+    assert plan["vms"] == 1 and plan["feasible"]
+    assert plan["wall_hours"] == pytest.approx(0.75)
+    assert plan["cost"] == pytest.approx(0.375)
+    assert [alternative["sku"] for alternative in plan["alternatives"]] == ["Standard_D2s_v3", "Standard_D8s_v3"]
+
+    # without the GPU, two D2s_v3 ($0.55) are cheaper than one faster D8s_v3 ($0.60)
+    plan = plan_vm_size(TOTAL_TOKENS, 3, SKUS, PRICES, QUOTA, CPU_THROUGHPUT)
+    assert (plan["sku"], plan["vms"]) == ("Standard_D2s_v3", 2)
+    assert plan["cost"] == pytest.approx(0.55)
+    assert plan["alternatives"][0]["sku"] == "Standard_D8s_v3"
+
+
+def test_plan_respects_the_remaining_quota():
+    # four free DSv3 cores fit two D2s_v3 but no D8s_v3, and no T4 core is left
+    quota = {"cores": 100, "standardDSv3Family": 4, "standardNCASv3_T4Family": 0}
+    plan = plan_vm_size(TOTAL_TOKENS, 3, SKUS, PRICES, quota, CPU_THROUGHPUT, GPU_THROUGHPUT)
+    assert (plan["sku"], plan["vms"], plan["feasible"]) == ("Standard_D2s_v3", 2, True)
+    assert plan["alternatives"] == []
+
+    # the regional total caps the family quota: one D2s_v3 cannot finish in time
+    plan = plan_vm_size(TOTAL_TOKENS, 3, SKUS, PRICES, {**quota, "cores": 2}, CPU_THROUGHPUT, GPU_THROUGHPUT)
+    assert (plan["sku"], plan["vms"], plan["feasible"]) == ("Standard_D2s_v3", 1, False)
+    assert plan["wall_hours"] == pytest.approx(5.25)
+
+
+def test_plan_falls_back_to_the_fastest_size_when_none_is_feasible():
+    plan = plan_vm_size(TOTAL_TOKENS, 0.5, SKUS, PRICES, QUOTA, CPU_THROUGHPUT, GPU_THROUGHPUT, max_vms=1)
+    assert plan["sku"] == "Standard_NC4as_T4_v3"
+    assert not plan["feasible"]
+    assert [alternative["sku"] for alternative in plan["alternatives"]] == ["Standard_D8s_v3", "Standard_D2s_v3"]
+
+
+def test_plan_is_none_when_no_size_can_run_the_job():
+    assert plan_vm_size(TOTAL_TOKENS, 3, SKUS, {}, QUOTA, CPU_THROUGHPUT) is None
+    assert plan_vm_size(TOTAL_TOKENS, 3, SKUS[2:], PRICES, QUOTA, CPU_THROUGHPUT) is None
+
+
+def test_fetch_vm_prices_follows_every_page():
+    session = FakeSession({
+        RETAIL_PRICES_URL: {"Items": [
+            price_item("Standard_D2s_v3", 0.1),
+            price_item("Standard_D2s_v3", 0.2, product="Virtual Machines DSv3 Series Windows"),
+            price_item("Standard_D2s_v3", 0.03, sku_name="D2s v3 Spot"),
+            price_item("Standard_D8s_v3", 9.6, unit="1 Day"),
+        ], "NextPageLink": "https://prices.example/page2"},
+        "https://prices.example/page2": {"Items": [
+            price_item("Standard_D8s_v3", 0.45),
+            price_item("Standard_D8s_v3", 0.4),
+            price_item("Standard_D8s_v3", 0.1, sku_name="D8s v3 Low Priority"),
+        ], "NextPageLink": None},
+    })
+
+    assert fetch_vm_prices("westus3", session=session) == {"Standard_D2s_v3": 0.1, "Standard_D8s_v3": 0.4}
+    (first_url, first_params), (second_url, second_params) = session.requests
+    assert first_url == RETAIL_PRICES_URL and "armRegionName eq 'westus3'" in first_params["$filter"]
+    # the next page link already carries the filter
+    assert (second_url, second_params) == ("https://prices.example/page2", None)
+
+    assert fetch_vm_prices("westus3", spot=True, session=session) == {"Standard_D2s_v3": 0.03}
+
+
+def test_recommend_vm_size_offline(tmp_path):
+    client = FakeComputeClient({"westus3": {
+        "skus": [(sku["name"], sku["family"], sku["vcpus"], sku["memory_gb"], sku["gpus"]) for sku in SKUS],
+        "usage": [(name, 0, limit) for name, limit in QUOTA.items()],
+    }})
+    session = FakeSession({RETAIL_PRICES_URL: {"Items": [price_item(name, price) for name, price in PRICES.items()]}})
+    path = str(tmp_path / "calibration.json")
+    save_calibration(path, CPU_THROUGHPUT, GPU_THROUGHPUT, model_name="intfloat/multilingual-e5-small")
+    assert load_calibration(path)["cpu"] == CPU_THROUGHPUT
+
+    plan = recommend_vm_size("sub", "westus3", TOTAL_TOKENS, 3, path, compute_client=client, price_session=session)
+    assert (plan["sku"], plan["vms"], plan["feasible"]) == ("Standard_NC4as_T4_v3", 1, True)
+    assert client.count("skus", "westus3") == 1 and client.count("usage", "westus3") == 1